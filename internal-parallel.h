@@ -94,34 +94,71 @@ static ptrdiff_t _bsearch_last_le(void * P,
  * myCLT[Plength + 1] is always mynmemb
  *
  * */
-static void _histogram(unsigned char * P, int Plength, void * mybase, size_t mynmemb,
-        ptrdiff_t * myCLT, ptrdiff_t * myCLE,
+static void _histogram_one(unsigned char * P, int Plength, void * mybase, size_t mynmemb,
+        ptrdiff_t * myC,
+        ptrdiff_t (*bsearch)(void * P, void * base, size_t nmemb, struct crstruct * d),
         struct crstruct * d) {
-    int it;
+    int nblocks = d->nthreads < Plength ? d->nthreads : Plength;
+    int ib;
 
-    if(myCLT) {
-        myCLT[0] = 0;
-        for(it = 0; it < Plength; it ++) {
-            /* No need to start from the beginging of mybase, since myubase and P are both sorted */
-            ptrdiff_t offset = myCLT[it];
-            myCLT[it + 1] = _bsearch_last_lt(P + it * d->rsize,
+    if(nblocks < 1) nblocks = 1;
+
+    myC[0] = 0;
+    /* every thread takes a block of P */
+#pragma omp parallel for num_threads(nblocks) if(nblocks > 1)
+    for(ib = 0; ib < nblocks; ib ++) {
+        int it;
+        ptrdiff_t offset = 0;
+        for(it = Plength * ib / nblocks; it < Plength * (ib + 1) / nblocks; it ++) {
+            /* No need to start from the beginging of mybase, since myubase and P are both sorted;
+             * unless P decreases, which happens while the splitters are searched. */
+            if(offset > 0 && d->compar(P + it * d->rsize, P + (it - 1) * d->rsize, d->rsize) < 0) {
+                offset = 0;
+            }
+            myC[it + 1] = bsearch(P + it * d->rsize,
                             ((char*) mybase) + offset * d->size,
                             mynmemb - offset, d)
                             + 1 + offset;
+            offset = myC[it + 1];
         }
-        myCLT[it + 1] = mynmemb;
+    }
+    myC[Plength + 1] = mynmemb;
+}
+
+static void _histogram(unsigned char * P, int Plength, void * mybase, size_t mynmemb,
+        ptrdiff_t * myCLT, ptrdiff_t * myCLE,
+        struct crstruct * d) {
+    if(myCLT) {
+        _histogram_one(P, Plength, mybase, mynmemb, myCLT, _bsearch_last_lt, d);
     }
     if(myCLE) {
-        myCLE[0] = 0;
-        for(it = 0; it < Plength; it ++) {
-            /* No need to start from the beginging of mybase, since myubase and P are both sorted */
-            ptrdiff_t offset = myCLE[it];
-            myCLE[it + 1] = _bsearch_last_le(P + it * d->rsize,
-                            ((char*) mybase) + offset * d->size,
-                            mynmemb - offset, d)
-                            + 1 + offset;
+        _histogram_one(P, Plength, mybase, mynmemb, myCLE, _bsearch_last_le, d);
+    }
+}
+
+/*
+ * find the neighbours of the splitters in mybase, with the histogram.
+ *
+ * Pprev[i] is the last item < P[i], or 0 if there is none;
+ * Pnext[i] is the first item > P[i], or all bits set if there is none;
+ * thus they can be reduced with MAX and MIN.
+ * */
+static void _histogram_neighbours(int Plength, void * mybase, size_t mynmemb,
+        ptrdiff_t * myCLT, ptrdiff_t * myCLE,
+        unsigned char * Pprev, unsigned char * Pnext,
+        struct crstruct * d) {
+    int i;
+    for(i = 0; i < Plength; i ++) {
+        if(myCLT[i + 1] > 0) {
+            d->radix((char*) mybase + (myCLT[i + 1] - 1) * d->size, &Pprev[i * d->rsize], d->arg);
+        } else {
+            memset(&Pprev[i * d->rsize], 0, d->rsize);
+        }
+        if(myCLE[i + 1] < (ptrdiff_t) mynmemb) {
+            d->radix((char*) mybase + myCLE[i + 1] * d->size, &Pnext[i * d->rsize], d->arg);
+        } else {
+            memset(&Pnext[i * d->rsize], -1, d->rsize);
         }
-        myCLE[it + 1] = mynmemb;
     }
 }
 
@@ -131,6 +168,21 @@ struct piter {
     int Plength;
     unsigned char * Pleft;
     unsigned char * Pright;
+    /* for interpolation: counts at the bracket, -1 if unknown */
+    ptrdiff_t * CLEleft;
+    ptrdiff_t * CLTright;
+    /* desired counts of the splitters */
+    ptrdiff_t * C;
+    /* for interpolation: the largest item < P and the smallest item > P,
+     * filled by the caller after the histogram. */
+    unsigned char * Pprev;
+    unsigned char * Pnext;
+    /* +1 if the last step moved Pright, -1 if Pleft */
+    int * side;
+    /* whether the last step was interpolated and the next step shall bisect */
+    int * interpolated;
+    int * stalled;
+    int interpolate;
     struct crstruct * d;
 };
 static void piter_init(struct piter * pi,
@@ -141,7 +193,16 @@ static void piter_init(struct piter * pi,
     pi->d = d;
     pi->Pleft = malloc(d->rsize * Plength);
     pi->Pright = malloc(d->rsize * Plength);
+    pi->CLEleft = malloc(Plength * sizeof(ptrdiff_t));
+    pi->CLTright = malloc(Plength * sizeof(ptrdiff_t));
+    pi->C = malloc(Plength * sizeof(ptrdiff_t));
+    pi->Pprev = malloc(d->rsize * Plength);
+    pi->Pnext = malloc(d->rsize * Plength);
+    pi->side = malloc(Plength * sizeof(int));
+    pi->interpolated = malloc(Plength * sizeof(int));
+    pi->stalled = malloc(Plength * sizeof(int));
     pi->Plength = Plength;
+    pi->interpolate = 0;
 
     int i;
     for(i = 0; i < pi->Plength; i ++) {
@@ -149,13 +210,74 @@ static void piter_init(struct piter * pi,
         pi->narrow[i] = 0;
         memcpy(&pi->Pleft[i * d->rsize], Pmin, d->rsize);
         memcpy(&pi->Pright[i * d->rsize], Pmax, d->rsize);
+        pi->CLEleft[i] = -1;
+        pi->CLTright[i] = -1;
+        pi->C[i] = 0;
+        pi->side[i] = 0;
+        pi->interpolated[i] = 0;
+        pi->stalled[i] = 0;
+    }
+}
+
+/*
+ * use the counts at Pleft and Pright to interpolate the splitters,
+ * C is the desired counts, of length Plength + 2.
+ * has no effect if the radix can not be interpolated.
+ *
+ * With interpolation, the caller shall fill pi->Pprev and pi->Pnext
+ * (see _histogram_neighbours) before piter_accept; the bracket is then
+ * moved to the nearest items, so that it closes on the solution
+ * instead of bisecting the gap between two items.
+ * */
+static void piter_enable_interpolation(struct piter * pi, ptrdiff_t * C) {
+    int i;
+    pi->interpolate = pi->d->interp != NULL;
+    for(i = 0; i < pi->Plength; i ++) {
+        pi->C[i] = C[i + 1];
+        /* about right for Pmin and Pmax */
+        if(pi->CLEleft[i] < 0) pi->CLEleft[i] = C[0];
+        if(pi->CLTright[i] < 0) pi->CLTright[i] = C[pi->Plength + 1];
     }
 }
+
 static void piter_destroy(struct piter * pi) {
     free(pi->stable);
     free(pi->narrow);
     free(pi->Pleft);
     free(pi->Pright);
+    free(pi->CLEleft);
+    free(pi->CLTright);
+    free(pi->C);
+    free(pi->Pprev);
+    free(pi->Pnext);
+    free(pi->side);
+    free(pi->interpolated);
+    free(pi->stalled);
+}
+
+/*
+ * interpolates P between Pleft and Pright with the counts at the bracket.
+ * returns 0 if there is not enough information, or the interpolation
+ * does not land strictly inside the bracket; then the caller shall bisect.
+ * */
+static int _piter_interp(struct piter * pi, int i, unsigned char * P) {
+    struct crstruct * d = pi->d;
+    ptrdiff_t left = pi->CLEleft[i];
+    ptrdiff_t right = pi->CLTright[i];
+
+    if(left < 0 || right < 0 || right <= left) return 0;
+
+    double frac = (double) (pi->C[i] - left) / (double) (right - left);
+    if(frac < 0) frac = 0;
+    if(frac > 1) frac = 1;
+
+    d->interp(&P[i * d->rsize],
+            &pi->Pleft[i * d->rsize],
+            &pi->Pright[i * d->rsize], frac, d->rsize);
+
+    if(d->compar(&P[i * d->rsize], &pi->Pleft[i * d->rsize], d->rsize) <= 0) return 0;
+    if(d->compar(&P[i * d->rsize], &pi->Pright[i * d->rsize], d->rsize) >= 0) return 0;
+    return 1;
 }
 
 /*
@@ -176,8 +298,11 @@ static void piter_bisect(struct piter * pi, unsigned char * P) {
                 &pi->Pright[i * d->rsize],
                 d->rsize);
             pi->stable[i] = 1;
+        } else if(pi->interpolate && !pi->stalled[i] && _piter_interp(pi, i, P)) {
+            pi->interpolated[i] = 1;
         } else {
             /* ordinary iteration */
+            pi->interpolated[i] = 0;
             d->bisect(&P[i * d->rsize],
                     &pi->Pleft[i * d->rsize],
                     &pi->Pright[i * d->rsize], d->rsize);
@@ -236,13 +361,32 @@ static void piter_accept(struct piter * pi, unsigned char * P,
             pi->stable[i] = 1;
             continue;
         } else {
+            int side;
             if(CLT[i + 1] >= C[i + 1]) {
                 /* P[i] is too big */
                 memcpy(&pi->Pright[i * d->rsize], &P[i * d->rsize], d->rsize);
+                /* the solution is an item, thus at most the item before P */
+                if(pi->interpolate
+                && d->compar(&pi->Pprev[i * d->rsize], &pi->Pleft[i * d->rsize], d->rsize) >= 0) {
+                    memcpy(&pi->Pright[i * d->rsize], &pi->Pprev[i * d->rsize], d->rsize);
+                }
+                pi->CLTright[i] = CLT[i + 1];
+                side = 1;
             } else {
                 /* P[i] is too small */
                 memcpy(&pi->Pleft[i * d->rsize], &P[i * d->rsize], d->rsize);
+                /* the solution is an item, thus at least the item after P */
+                if(pi->interpolate
+                && d->compar(&pi->Pnext[i * d->rsize], &pi->Pright[i * d->rsize], d->rsize) <= 0) {
+                    memcpy(&pi->Pleft[i * d->rsize], &pi->Pnext[i * d->rsize], d->rsize);
+                }
+                pi->CLEleft[i] = CLE[i + 1];
+                side = -1;
             }
+            /* interpolation stalls if it keeps moving the same end of the bracket;
+             * then bisect once, which guarantees the progress of bisection. */
+            pi->stalled[i] = pi->interpolated[i] && side == pi->side[i];
+            pi->side[i] = side;
         }
     }
 }
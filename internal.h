@@ -10,6 +10,7 @@
 
 typedef int (*_compar_fn_t)(const void * r1, const void * r2, size_t rsize);
 typedef void (*_bisect_fn_t)(void * r, const void * r1, const void * r2, size_t rsize);
+typedef void (*_interp_fn_t)(void * r, const void * r1, const void * r2, double frac, size_t rsize);
 
 struct crstruct {
     void * base;
@@ -20,6 +21,9 @@ struct crstruct {
     void (*radix)(const void * ptr, void * radix, void * arg);
     _compar_fn_t compar;
     _bisect_fn_t bisect;
+    /* NULL if the radix can not be interpolated */
+    _interp_fn_t interp;
+    int nthreads;
 };
 
 void _setup_radix_sort(
@@ -30,4 +34,26 @@ void _setup_radix_sort(
         void (*radix)(const void * ptr, void * radix, void * arg),
         size_t rsize,
         void * arg);
+
+/* merges the sorted runs of base into out;
+ * returns 0 on success, -1 if the temporary storage cannot be allocated. */
+int _radix_merge(const void * base,
+        const size_t * runoffset,
+        const size_t * runnmemb,
+        int nrun,
+        void * out,
+        struct crstruct * d);
+
+/* same as _radix_merge, but writes the index of the merged items to perm */
+int _radix_merge_permutation(const void * base,
+        const size_t * runoffset,
+        const size_t * runnmemb,
+        int nrun,
+        size_t * perm,
+        struct crstruct * d);
+
+void _radix_permute(void * base, size_t * perm, size_t nmemb, size_t size);
+
+/* sorts a nearly sorted array in place, moving aside at most nmemb / maxfrac items */
+size_t _radix_sort_nearly_sorted(struct crstruct * d, void * base, size_t nmemb, size_t maxfrac);
 #endif
@@ -3,6 +3,7 @@
 #include <stdlib.h>
 #include <stdint.h>
 #include <string.h>
+#include <limits.h>
 
 #include <mpi.h>
 #include "mp-mpiu.h"
@@ -50,25 +51,115 @@ MPIU_Set_verbose_malloc(MPI_Comm comm)
     mpiu_set_malloc(verbose_mpiu_malloc_func, verbose_mpiu_free_func, (void*) (intptr_t) comm);
 }
 
+/* bytes allocated by mpiu_malloc and not yet freed, and the peak since the last reset.
+ * the size of each allocation is kept in a header in front of the memory. */
+static size_t _MPIU_Allocated = 0;
+static size_t _MPIU_AllocatedPeak = 0;
+#define MPIU_MALLOC_HEADER 16
+
 void * mpiu_malloc(const char * name, size_t size, const char * file, const int line) {
-    return _MPIUMem.malloc_func(name, size, file, line, _MPIUMem.userdata);
+    char * ptr = _MPIUMem.malloc_func(name, size + MPIU_MALLOC_HEADER, file, line, _MPIUMem.userdata);
+    if(ptr == NULL) return NULL;
+    *((size_t *) ptr) = size;
+    _MPIU_Allocated += size;
+    if(_MPIU_Allocated > _MPIU_AllocatedPeak)
+        _MPIU_AllocatedPeak = _MPIU_Allocated;
+    return ptr + MPIU_MALLOC_HEADER;
 }
 
 void mpiu_free(void * ptr, const char * file, const int line) {
-    _MPIUMem.free_func(ptr, file, line, _MPIUMem.userdata);
+    if(ptr == NULL) return;
+    char * base = (char *) ptr - MPIU_MALLOC_HEADER;
+    _MPIU_Allocated -= *((size_t *) base);
+    _MPIUMem.free_func(base, file, line, _MPIUMem.userdata);
+}
+
+size_t
+MPIU_Get_allocated()
+{
+    return _MPIU_Allocated;
+}
+
+size_t
+MPIU_Get_allocated_peak()
+{
+    return _MPIU_AllocatedPeak;
+}
+
+void
+MPIU_Reset_allocated_peak()
+{
+    _MPIU_AllocatedPeak = _MPIU_Allocated;
+}
+
+/* whether the last MPIU_Alltoallv used the sparse implementation */
+static int _MPIU_LastSparse = 0;
+
+int
+MPIU_Alltoallv_was_sparse()
+{
+    return _MPIU_LastSparse;
+}
+
+/* ranks per node of the hierarchical exchange; 0 to group the ranks sharing memory. */
+static int _MPIU_RanksPerNode = 0;
+
+void
+MPIU_Set_ranks_per_node(int n)
+{
+    _MPIU_RanksPerNode = n > 0 ? n : 0;
+}
+
+/* largest count of a single MPI call; can be lowered to test the large count code paths. */
+static ptrdiff_t _MPIU_MaxCount = INT_MAX;
+
+void
+MPIU_Set_max_count(ptrdiff_t maxcount)
+{
+    _MPIU_MaxCount = maxcount > 0 && maxcount < INT_MAX ? maxcount : INT_MAX;
+}
+
+/* returns true if all of counts and displacements of the NTask ranks
+ * fit in a single MPI call. */
+static int
+_MPIU_fits_count(const ptrdiff_t * counts, const ptrdiff_t * displs, int NTask)
+{
+    int i;
+    for(i = 0; i < NTask; i ++) {
+        if(counts[i] > _MPIU_MaxCount) return 0;
+        if(displs[i] > _MPIU_MaxCount) return 0;
+    }
+    return 1;
+}
+
+static void
+_MPIU_to_int(const ptrdiff_t * in, int * out, int n)
+{
+    int i;
+    for(i = 0; i < n; i ++) {
+        out[i] = in[i];
+    }
 }
 
 /* The following two functions are taken from MP-Gadget. The hope
  * is that when the exchange is sparse posting requests is
  * faster than Alltoall on some implementations. */
 
-static int MPI_Alltoallv_sparse(void *sendbuf, int *sendcnts, int *sdispls,
-        MPI_Datatype sendtype, void *recvbuf, int *recvcnts,
-        int *rdispls, MPI_Datatype recvtype, MPI_Comm comm);
+static int MPI_Alltoallv_sparse(void *sendbuf, ptrdiff_t *sendcnts, ptrdiff_t *sdispls,
+        MPI_Datatype sendtype, void *recvbuf, ptrdiff_t *recvcnts,
+        ptrdiff_t *rdispls, MPI_Datatype recvtype, MPI_Comm comm);
+
+static int MPI_Alltoallv_dense(void *sendbuf, ptrdiff_t *sendcnts, ptrdiff_t *sdispls,
+        MPI_Datatype sendtype, void *recvbuf, ptrdiff_t *recvcnts,
+        ptrdiff_t *rdispls, MPI_Datatype recvtype, MPI_Comm comm);
 
-int MPIU_Alltoallv(void *sendbuf, int *sendcnts, int *sdispls,
-        MPI_Datatype sendtype, void *recvbuf, int *recvcnts,
-        int *rdispls, MPI_Datatype recvtype, MPI_Comm comm,
+static int MPI_Alltoallv_hierarchical(void *sendbuf, ptrdiff_t *sendcnts, ptrdiff_t *sdispls,
+        MPI_Datatype sendtype, void *recvbuf, ptrdiff_t *recvcnts,
+        ptrdiff_t *rdispls, MPI_Datatype recvtype, MPI_Comm comm);
+
+int MPIU_Alltoallv(void *sendbuf, ptrdiff_t *sendcnts, ptrdiff_t *sdispls,
+        MPI_Datatype sendtype, void *recvbuf, ptrdiff_t *recvcnts,
+        ptrdiff_t *rdispls, MPI_Datatype recvtype, MPI_Comm comm,
         enum MPIU_AlltoallvSparsePolicy policy
 )
 /*
@@ -84,20 +175,20 @@ int MPIU_Alltoallv(void *sendbuf, int *sendcnts, int *sdispls,
     MPI_Comm_size(comm, &NTask);
     int i;
     int nn = 0;
-    int *a_sdispls=NULL, *a_recvcnts=NULL, *a_rdispls=NULL;
+    ptrdiff_t *a_sdispls=NULL, *a_recvcnts=NULL, *a_rdispls=NULL;
     for(i = 0; i < NTask; i ++) {
         if(sendcnts[i] > 0) {
             nn ++;
         }
     }
     if(recvcnts == NULL) {
-        a_recvcnts = malloc(sizeof(int) * NTask);
+        a_recvcnts = malloc(sizeof(ptrdiff_t) * NTask);
         recvcnts = a_recvcnts;
-        MPI_Alltoall(sendcnts, 1, MPI_INT,
-                     recvcnts, 1, MPI_INT, comm);
+        MPI_Alltoall(sendcnts, sizeof(ptrdiff_t), MPI_BYTE,
+                     recvcnts, sizeof(ptrdiff_t), MPI_BYTE, comm);
     }
     if(recvbuf == NULL) {
-        int totalrecv = 0;
+        ptrdiff_t totalrecv = 0;
         for(i = 0; i < NTask; i ++) {
             totalrecv += recvcnts[i];
         }
@@ -106,7 +197,7 @@ int MPIU_Alltoallv(void *sendbuf, int *sendcnts, int *sdispls,
         return totalrecv;
     }
     if(sdispls == NULL) {
-        a_sdispls = malloc(sizeof(int) * NTask);
+        a_sdispls = malloc(sizeof(ptrdiff_t) * NTask);
         sdispls = a_sdispls;
         sdispls[0] = 0;
         for (i = 1; i < NTask; i++) {
@@ -114,7 +205,7 @@ int MPIU_Alltoallv(void *sendbuf, int *sendcnts, int *sdispls,
         }
     }
     if(rdispls == NULL) {
-        a_rdispls = malloc(sizeof(int) * NTask);
+        a_rdispls = malloc(sizeof(ptrdiff_t) * NTask);
         rdispls = a_rdispls;
         rdispls[0] = 0;
         for (i = 1; i < NTask; i++) {
@@ -122,7 +213,7 @@ int MPIU_Alltoallv(void *sendbuf, int *sendcnts, int *sdispls,
         }
     }
 
-    int dense;
+    int dense = 1;
 
     if(policy == AUTO) {
         dense = nn > 128;
@@ -135,9 +226,17 @@ int MPIU_Alltoallv(void *sendbuf, int *sendcnts, int *sdispls,
         dense = 0;
     }
 
+    _MPIU_LastSparse = dense == 0;
+
     int ret;
-    if(dense != 0) {
-        ret = MPI_Alltoallv(sendbuf, sendcnts, sdispls,
+    if(policy == HIERARCHICAL) {
+        ret = MPI_Alltoallv_hierarchical(sendbuf, sendcnts, sdispls,
+                    sendtype, recvbuf,
+                    recvcnts, rdispls, recvtype, comm);
+        /* the exchange of the leaders has overwritten it */
+        _MPIU_LastSparse = 0;
+    } else if(dense != 0) {
+        ret = MPI_Alltoallv_dense(sendbuf, sendcnts, sdispls,
                     sendtype, recvbuf,
                     recvcnts, rdispls, recvtype, comm);
     } else {
@@ -155,9 +254,189 @@ int MPIU_Alltoallv(void *sendbuf, int *sendcnts, int *sdispls,
     return ret;
 }
 
-static int MPI_Alltoallv_sparse(void *sendbuf, int *sendcnts, int *sdispls,
-        MPI_Datatype sendtype, void *recvbuf, int *recvcnts,
-        int *rdispls, MPI_Datatype recvtype, MPI_Comm comm) {
+#if MPI_VERSION < 4
+/* a datatype of count items of type at the absolute address base,
+ * in blocks of at most _MPIU_MaxCount items, such that the count fits an int. */
+static void
+_MPIU_Type_create_large(void * base, ptrdiff_t count, MPI_Datatype type, MPI_Datatype * newtype)
+{
+    ptrdiff_t lb;
+    ptrdiff_t elsize;
+    MPI_Type_get_extent(type, &lb, &elsize);
+
+    ptrdiff_t nblocks = count / _MPIU_MaxCount;
+    int rem = count % _MPIU_MaxCount;
+
+    MPI_Datatype block;
+    MPI_Type_contiguous(_MPIU_MaxCount, type, &block);
+
+    int blocklengths[2] = {1, rem};
+    MPI_Aint displs[2];
+    MPI_Datatype types[2] = {MPI_DATATYPE_NULL, type};
+    MPI_Datatype blocks;
+
+    MPI_Get_address(base, &displs[0]);
+    MPI_Get_address((char*) base + nblocks * _MPIU_MaxCount * elsize, &displs[1]);
+
+    MPI_Type_contiguous(nblocks, block, &blocks);
+    types[0] = blocks;
+
+    MPI_Type_create_struct(2, blocklengths, displs, types, newtype);
+    MPI_Type_commit(newtype);
+    MPI_Type_free(&blocks);
+    MPI_Type_free(&block);
+}
+#endif
+
+static int MPI_Alltoallv_dense(void *sendbuf, ptrdiff_t *sendcnts, ptrdiff_t *sdispls,
+        MPI_Datatype sendtype, void *recvbuf, ptrdiff_t *recvcnts,
+        ptrdiff_t *rdispls, MPI_Datatype recvtype, MPI_Comm comm) {
+
+    int NTask;
+    MPI_Comm_size(comm, &NTask);
+    int i;
+    int ret;
+
+#if MPI_VERSION >= 4
+    MPI_Count * c_sendcnts = malloc(sizeof(MPI_Count) * NTask);
+    MPI_Count * c_recvcnts = malloc(sizeof(MPI_Count) * NTask);
+    MPI_Aint * c_sdispls = malloc(sizeof(MPI_Aint) * NTask);
+    MPI_Aint * c_rdispls = malloc(sizeof(MPI_Aint) * NTask);
+    for(i = 0; i < NTask; i ++) {
+        c_sendcnts[i] = sendcnts[i];
+        c_recvcnts[i] = recvcnts[i];
+        c_sdispls[i] = sdispls[i];
+        c_rdispls[i] = rdispls[i];
+    }
+    ret = MPI_Alltoallv_c(sendbuf, c_sendcnts, c_sdispls,
+                sendtype, recvbuf,
+                c_recvcnts, c_rdispls, recvtype, comm);
+    free(c_rdispls);
+    free(c_sdispls);
+    free(c_recvcnts);
+    free(c_sendcnts);
+#else
+    int fits = _MPIU_fits_count(sendcnts, sdispls, NTask)
+            && _MPIU_fits_count(recvcnts, rdispls, NTask);
+
+    /* the usual case, but it must be decided collectively */
+    MPI_Allreduce(MPI_IN_PLACE, &fits, 1, MPI_INT, MPI_LAND, comm);
+
+    if(fits) {
+        int * i_sendcnts = malloc(sizeof(int) * NTask * 4);
+        int * i_sdispls = i_sendcnts + NTask;
+        int * i_recvcnts = i_sendcnts + 2 * NTask;
+        int * i_rdispls = i_sendcnts + 3 * NTask;
+        _MPIU_to_int(sendcnts, i_sendcnts, NTask);
+        _MPIU_to_int(sdispls, i_sdispls, NTask);
+        _MPIU_to_int(recvcnts, i_recvcnts, NTask);
+        _MPIU_to_int(rdispls, i_rdispls, NTask);
+        ret = MPI_Alltoallv(sendbuf, i_sendcnts, i_sdispls,
+                    sendtype, recvbuf,
+                    i_recvcnts, i_rdispls, recvtype, comm);
+        free(i_sendcnts);
+        return ret;
+    }
+
+    /* large counts: one derived datatype at the absolute address of every piece. */
+    ptrdiff_t lb;
+    ptrdiff_t send_elsize;
+    ptrdiff_t recv_elsize;
+
+    MPI_Type_get_extent(sendtype, &lb, &send_elsize);
+    MPI_Type_get_extent(recvtype, &lb, &recv_elsize);
+
+    int * ones = malloc(sizeof(int) * NTask * 3);
+    int * zeros = ones + NTask;
+    int * recvones = ones + 2 * NTask;
+    MPI_Datatype * sendtypes = malloc(sizeof(MPI_Datatype) * NTask);
+    MPI_Datatype * recvtypes = malloc(sizeof(MPI_Datatype) * NTask);
+
+    for(i = 0; i < NTask; i ++) {
+        ones[i] = sendcnts[i] > 0;
+        recvones[i] = recvcnts[i] > 0;
+        zeros[i] = 0;
+        sendtypes[i] = sendtype;
+        recvtypes[i] = recvtype;
+        if(ones[i])
+            _MPIU_Type_create_large((char*) sendbuf + sdispls[i] * send_elsize,
+                    sendcnts[i], sendtype, &sendtypes[i]);
+        if(recvones[i])
+            _MPIU_Type_create_large((char*) recvbuf + rdispls[i] * recv_elsize,
+                    recvcnts[i], recvtype, &recvtypes[i]);
+    }
+
+    ret = MPI_Alltoallw(MPI_BOTTOM, ones, zeros, sendtypes,
+                MPI_BOTTOM, recvones, zeros, recvtypes, comm);
+
+    for(i = 0; i < NTask; i ++) {
+        if(ones[i]) MPI_Type_free(&sendtypes[i]);
+        if(recvones[i]) MPI_Type_free(&recvtypes[i]);
+    }
+    free(recvtypes);
+    free(sendtypes);
+    free(ones);
+#endif
+    return ret;
+}
+
+/* post the receives (or sends) of count items in messages of at most _MPIU_MaxCount items. */
+static int
+_MPIU_Irecv_large(void * buf, ptrdiff_t count, MPI_Datatype type, int source, int tag,
+        MPI_Comm comm, MPI_Request * requests)
+{
+#if MPI_VERSION >= 4
+    MPI_Irecv_c(buf, count, type, source, tag, comm, &requests[0]);
+    return 1;
+#else
+    ptrdiff_t lb;
+    ptrdiff_t elsize;
+    MPI_Type_get_extent(type, &lb, &elsize);
+    int n = 0;
+    ptrdiff_t offset;
+    for(offset = 0; offset < count; offset += _MPIU_MaxCount) {
+        ptrdiff_t chunk = count - offset < _MPIU_MaxCount ? count - offset : _MPIU_MaxCount;
+        MPI_Irecv((char*) buf + offset * elsize, chunk, type, source, tag, comm, &requests[n++]);
+    }
+    return n;
+#endif
+}
+
+static int
+_MPIU_Isend_large(void * buf, ptrdiff_t count, MPI_Datatype type, int dest, int tag,
+        MPI_Comm comm, MPI_Request * requests)
+{
+#if MPI_VERSION >= 4
+    MPI_Isend_c(buf, count, type, dest, tag, comm, &requests[0]);
+    return 1;
+#else
+    ptrdiff_t lb;
+    ptrdiff_t elsize;
+    MPI_Type_get_extent(type, &lb, &elsize);
+    int n = 0;
+    ptrdiff_t offset;
+    for(offset = 0; offset < count; offset += _MPIU_MaxCount) {
+        ptrdiff_t chunk = count - offset < _MPIU_MaxCount ? count - offset : _MPIU_MaxCount;
+        MPI_Isend((char*) buf + offset * elsize, chunk, type, dest, tag, comm, &requests[n++]);
+    }
+    return n;
+#endif
+}
+
+/* number of messages to carry count items */
+static int
+_MPIU_nmessages(ptrdiff_t count)
+{
+#if MPI_VERSION >= 4
+    return count > 0;
+#else
+    return (count + _MPIU_MaxCount - 1) / _MPIU_MaxCount;
+#endif
+}
+
+static int MPI_Alltoallv_sparse(void *sendbuf, ptrdiff_t *sendcnts, ptrdiff_t *sdispls,
+        MPI_Datatype sendtype, void *recvbuf, ptrdiff_t *recvcnts,
+        ptrdiff_t *rdispls, MPI_Datatype recvtype, MPI_Comm comm) {
 
     int ThisTask;
     int NTask;
@@ -175,9 +454,14 @@ static int MPI_Alltoallv_sparse(void *sendbuf, int *sendcnts, int *sdispls,
     MPI_Type_get_extent(sendtype, &lb, &send_elsize);
     MPI_Type_get_extent(recvtype, &lb, &recv_elsize);
 
-#ifndef NO_ISEND_IRECV_IN_DOMAIN
     int n_requests;
-    MPI_Request *requests = malloc(NTask * 2 * sizeof(MPI_Request));
+    int i;
+    /* large pieces are carried by several messages */
+    n_requests = 0;
+    for(i = 0; i < NTask; i ++) {
+        n_requests += _MPIU_nmessages(sendcnts[i]) + _MPIU_nmessages(recvcnts[i]);
+    }
+    MPI_Request *requests = malloc((n_requests + 1) * sizeof(MPI_Request));
     n_requests = 0;
 
 
@@ -187,10 +471,10 @@ static int MPI_Alltoallv_sparse(void *sendbuf, int *sendcnts, int *sdispls,
 
         if(target >= NTask) continue;
         if(recvcnts[target] == 0) continue;
-        MPI_Irecv(
+        n_requests += _MPIU_Irecv_large(
                 ((char*) recvbuf) + recv_elsize * rdispls[target],
                 recvcnts[target],
-                recvtype, target, 101934, comm, &requests[n_requests++]);
+                recvtype, target, 101934, comm, &requests[n_requests]);
     }
 
     MPI_Barrier(comm);
@@ -205,30 +489,14 @@ static int MPI_Alltoallv_sparse(void *sendbuf, int *sendcnts, int *sdispls,
         int target = ThisTask ^ ngrp;
         if(target >= NTask) continue;
         if(sendcnts[target] == 0) continue;
-        MPI_Isend(((char*) sendbuf) + send_elsize * sdispls[target],
+        n_requests += _MPIU_Isend_large(((char*) sendbuf) + send_elsize * sdispls[target],
                 sendcnts[target],
-                sendtype, target, 101934, comm, &requests[n_requests++]);
+                sendtype, target, 101934, comm, &requests[n_requests]);
     }
 
     MPI_Waitall(n_requests, requests, MPI_STATUSES_IGNORE);
     free(requests);
-#else
-    for(ngrp = 0; ngrp < (1 << PTask); ngrp++)
-    {
-        int target = ThisTask ^ ngrp;
 
-        if(target >= NTask) continue;
-        if(sendcnts[target] == 0 && recvcnts[target] == 0) continue;
-        MPI_Sendrecv(((char*)sendbuf) + send_elsize * sdispls[target],
-                sendcnts[target], sendtype,
-                target, 101934,
-                ((char*)recvbuf) + recv_elsize * rdispls[target],
-                recvcnts[target], recvtype,
-                target, 101934,
-                comm, MPI_STATUS_IGNORE);
-
-    }
-#endif
     /* ensure the collective-ness */
     MPI_Barrier(comm);
 
@@ -269,7 +537,7 @@ MPIU_GetLoc(const void * base, MPI_Datatype type, MPI_Op op, MPI_Comm comm)
 }
 
 void *
-MPIU_Gather (MPI_Comm comm, int root, const void * sendbuffer, void * recvbuffer, int nsend, size_t elsize, int * totalnrecv)
+MPIU_Gather (MPI_Comm comm, int root, const void * sendbuffer, void * recvbuffer, ptrdiff_t nsend, size_t elsize, ptrdiff_t * totalnrecv)
 {
     int NTask;
     int ThisTask;
@@ -281,10 +549,10 @@ MPIU_Gather (MPI_Comm comm, int root, const void * sendbuffer, void * recvbuffer
     MPI_Type_contiguous(elsize, MPI_BYTE, &dtype);
     MPI_Type_commit(&dtype);
 
-    int recvcount[NTask];
-    int rdispls[NTask + 1];
+    ptrdiff_t recvcount[NTask];
+    ptrdiff_t rdispls[NTask + 1];
     int i;
-    MPI_Gather(&nsend, 1, MPI_INT, recvcount, 1, MPI_INT, root, comm);
+    MPI_Gather(&nsend, sizeof(ptrdiff_t), MPI_BYTE, recvcount, sizeof(ptrdiff_t), MPI_BYTE, root, comm);
 
     rdispls[0] = 0;
     for(i = 1; i <= NTask; i ++) {
@@ -301,7 +569,30 @@ MPIU_Gather (MPI_Comm comm, int root, const void * sendbuffer, void * recvbuffer
             *totalnrecv = 0;
     }
 
-    MPI_Gatherv(sendbuffer, nsend, dtype, recvbuffer, recvcount, rdispls, dtype, root, comm);
+    /* only meaningful on the root */
+    int fits = ThisTask != root || _MPIU_fits_count(recvcount, rdispls, NTask);
+    MPI_Bcast(&fits, 1, MPI_INT, root, comm);
+
+    if(fits) {
+        int i_recvcount[NTask];
+        int i_rdispls[NTask];
+        if(ThisTask == root) {
+            _MPIU_to_int(recvcount, i_recvcount, NTask);
+            _MPIU_to_int(rdispls, i_rdispls, NTask);
+        }
+        MPI_Gatherv(sendbuffer, nsend, dtype, recvbuffer, i_recvcount, i_rdispls, dtype, root, comm);
+    } else {
+        /* large counts: a sparse exchange with only the root receiving */
+        ptrdiff_t sendcount[NTask];
+        ptrdiff_t zeros[NTask];
+        for(i = 0; i < NTask; i ++) {
+            sendcount[i] = i == root ? nsend : 0;
+            zeros[i] = 0;
+            if(ThisTask != root) recvcount[i] = 0;
+        }
+        MPI_Alltoallv_sparse((void*) sendbuffer, sendcount, zeros, dtype,
+                recvbuffer, recvcount, rdispls, dtype, comm);
+    }
 
     MPI_Type_free(&dtype);
 
@@ -309,7 +600,7 @@ MPIU_Gather (MPI_Comm comm, int root, const void * sendbuffer, void * recvbuffer
 }
 
 void *
-MPIU_Scatter (MPI_Comm comm, int root, const void * sendbuffer, void * recvbuffer, int nrecv, size_t elsize, int * totalnsend)
+MPIU_Scatter (MPI_Comm comm, int root, const void * sendbuffer, void * recvbuffer, ptrdiff_t nrecv, size_t elsize, ptrdiff_t * totalnsend)
 {
     int NTask;
     int ThisTask;
@@ -320,11 +611,11 @@ MPIU_Scatter (MPI_Comm comm, int root, const void * sendbuffer, void * recvbuffe
     MPI_Type_contiguous(elsize, MPI_BYTE, &dtype);
     MPI_Type_commit(&dtype);
 
-    int sendcount[NTask];
-    int sdispls[NTask + 1];
+    ptrdiff_t sendcount[NTask];
+    ptrdiff_t sdispls[NTask + 1];
     int i;
 
-    MPI_Gather(&nrecv, 1, MPI_INT, sendcount, 1, MPI_INT, root, comm);
+    MPI_Gather(&nrecv, sizeof(ptrdiff_t), MPI_BYTE, sendcount, sizeof(ptrdiff_t), MPI_BYTE, root, comm);
 
     sdispls[0] = 0;
     for(i = 1; i <= NTask; i ++) {
@@ -341,15 +632,335 @@ MPIU_Scatter (MPI_Comm comm, int root, const void * sendbuffer, void * recvbuffe
         if(totalnsend)
             *totalnsend = 0;
     }
-    MPI_Scatterv(sendbuffer, sendcount, sdispls, dtype, recvbuffer, nrecv, dtype, root, comm);
+
+    /* only meaningful on the root */
+    int fits = ThisTask != root || _MPIU_fits_count(sendcount, sdispls, NTask);
+    MPI_Bcast(&fits, 1, MPI_INT, root, comm);
+
+    if(fits) {
+        int i_sendcount[NTask];
+        int i_sdispls[NTask];
+        if(ThisTask == root) {
+            _MPIU_to_int(sendcount, i_sendcount, NTask);
+            _MPIU_to_int(sdispls, i_sdispls, NTask);
+        }
+        MPI_Scatterv(sendbuffer, i_sendcount, i_sdispls, dtype, recvbuffer, nrecv, dtype, root, comm);
+    } else {
+        /* large counts: a sparse exchange with only the root sending */
+        ptrdiff_t recvcount[NTask];
+        ptrdiff_t zeros[NTask];
+        for(i = 0; i < NTask; i ++) {
+            recvcount[i] = i == root ? nrecv : 0;
+            zeros[i] = 0;
+            if(ThisTask != root) sendcount[i] = 0;
+        }
+        MPI_Alltoallv_sparse((void*) sendbuffer, sendcount, sdispls, dtype,
+                recvbuffer, recvcount, zeros, dtype, comm);
+    }
 
     MPI_Type_free(&dtype);
 
     return recvbuffer;
 }
 
+/* the ranks of comm on the same node as this rank, ordered by rank. */
+static void
+_MPIU_Comm_split_node(MPI_Comm comm, MPI_Comm * node)
+{
+    int ThisTask;
+    MPI_Comm_rank(comm, &ThisTask);
+    if(_MPIU_RanksPerNode > 0) {
+        MPI_Comm_split(comm, ThisTask / _MPIU_RanksPerNode, ThisTask, node);
+        return;
+    }
+#if MPI_VERSION >= 3
+    MPI_Comm_split_type(comm, MPI_COMM_TYPE_SHARED, ThisTask, MPI_INFO_NULL, node);
+#else
+    /* no way to find the node; every rank is a node of its own */
+    MPI_Comm_split(comm, ThisTask, 0, node);
+#endif
+}
+
+/* the lowest rank on the node of each rank of comm */
+static void
+_MPIU_node_ids(MPI_Comm comm, int * nodes)
+{
+    int ThisTask;
+    int first;
+    MPI_Comm node;
+    MPI_Comm_rank(comm, &ThisTask);
+    _MPIU_Comm_split_node(comm, &node);
+    MPI_Allreduce(&ThisTask, &first, 1, MPI_INT, MPI_MIN, node);
+    MPI_Allgather(&first, 1, MPI_INT, nodes, 1, MPI_INT, comm);
+    MPI_Comm_free(&node);
+}
+
+int
+MPIU_Comm_is_shared(MPI_Comm comm)
+{
+    int shared = 0;
+#if MPI_VERSION >= 3
+    int NTask;
+    int NodeSize;
+    MPI_Comm node;
+    MPI_Comm_size(comm, &NTask);
+    MPI_Comm_split_type(comm, MPI_COMM_TYPE_SHARED, 0, MPI_INFO_NULL, &node);
+    MPI_Comm_size(node, &NodeSize);
+    MPI_Comm_free(&node);
+    shared = NodeSize == NTask;
+    MPI_Allreduce(MPI_IN_PLACE, &shared, 1, MPI_INT, MPI_LAND, comm);
+#endif
+    return shared;
+}
+
+/* The two-level exchange of the HIERARCHICAL policy.
+ *
+ * 1. every rank gathers its send buffer, ordered by the receiving rank, to the leader
+ *    (rank 0) of its node;
+ * 2. the leaders reorder the blocks by the receiving node, then by the receiving rank
+ *    and the sending rank, and exchange them with MPIU_Alltoallv over the leaders;
+ * 3. the leaders scatter the received blocks to the receiving ranks of the node,
+ *    which place the block of each sending rank at its rdispls.
+ *
+ * The items must be contiguous, e.g. MPI_BYTE or a contiguous type; only the extent
+ * of sendtype is used.
+ * */
+static int MPI_Alltoallv_hierarchical(void *sendbuf, ptrdiff_t *sendcnts, ptrdiff_t *sdispls,
+        MPI_Datatype sendtype, void *recvbuf, ptrdiff_t *recvcnts,
+        ptrdiff_t *rdispls, MPI_Datatype recvtype, MPI_Comm comm)
+{
+    int ThisTask;
+    int NTask;
+    MPI_Comm_rank(comm, &ThisTask);
+    MPI_Comm_size(comm, &NTask);
+
+    MPI_Comm node;
+    MPI_Comm leaders;
+    int NodeRank;
+    int NodeSize;
+    int NodeId;
+    int NNodes;
+    int i;
+    int j;
+
+    _MPIU_Comm_split_node(comm, &node);
+    MPI_Comm_rank(node, &NodeRank);
+    MPI_Comm_size(node, &NodeSize);
+    MPI_Comm_split(comm, NodeRank == 0 ? 0 : MPI_UNDEFINED, ThisTask, &leaders);
+
+    if(NodeRank == 0) {
+        MPI_Comm_rank(leaders, &NodeId);
+        MPI_Comm_size(leaders, &NNodes);
+    }
+    MPI_Bcast(&NodeId, 1, MPI_INT, 0, node);
+    MPI_Bcast(&NNodes, 1, MPI_INT, 0, node);
+
+    if(NNodes == NTask) {
+        /* every node is a single rank; nothing to aggregate */
+        if(leaders != MPI_COMM_NULL)
+            MPI_Comm_free(&leaders);
+        MPI_Comm_free(&node);
+        return MPI_Alltoallv_dense(sendbuf, sendcnts, sdispls,
+                    sendtype, recvbuf,
+                    recvcnts, rdispls, recvtype, comm);
+    }
+
+    /* Members lists the ranks of node n at NodeStart[n] .. NodeStart[n + 1], ordered by rank,
+     * which is also the order of the ranks in the node communicator. */
+    int * NodeOf = malloc(sizeof(int) * NTask);
+    int * Members = malloc(sizeof(int) * NTask);
+    int * NodeStart = calloc(NNodes + 1, sizeof(int));
+
+    MPI_Allgather(&NodeId, 1, MPI_INT, NodeOf, 1, MPI_INT, comm);
+
+    for(i = 0; i < NTask; i ++) {
+        NodeStart[NodeOf[i] + 1] ++;
+    }
+    for(i = 0; i < NNodes; i ++) {
+        NodeStart[i + 1] += NodeStart[i];
+    }
+    {
+        int * fill = malloc(sizeof(int) * NNodes);
+        memcpy(fill, NodeStart, sizeof(int) * NNodes);
+        for(i = 0; i < NTask; i ++) {
+            Members[fill[NodeOf[i]] ++] = i;
+        }
+        free(fill);
+    }
+
+    MPI_Aint lb;
+    MPI_Aint elsize;
+    MPI_Type_get_extent(sendtype, &lb, &elsize);
+
+    MPI_Datatype MPI_TYPE_COUNT;
+    MPI_Type_contiguous(sizeof(ptrdiff_t), MPI_BYTE, &MPI_TYPE_COUNT);
+    MPI_Type_commit(&MPI_TYPE_COUNT);
+
+    /* 1. gather the send buffers, ordered by the receiving rank, to the leader */
+    ptrdiff_t nsend = 0;
+    int packed = 1;
+    for(i = 0; i < NTask; i ++) {
+        if(sendcnts[i] > 0 && sdispls[i] != nsend) packed = 0;
+        nsend += sendcnts[i];
+    }
+    char * sendpacked = sendbuf;
+    if(!packed) {
+        ptrdiff_t offset = 0;
+        sendpacked = MPIU_Malloc("sendpacked", elsize, nsend);
+        for(i = 0; i < NTask; i ++) {
+            memcpy(sendpacked + offset * elsize, (char*) sendbuf + sdispls[i] * elsize, sendcnts[i] * elsize);
+            offset += sendcnts[i];
+        }
+    }
+
+    ptrdiff_t * NodeSendCount = NULL;
+    char * NodeSendBuf = NULL;
+    if(NodeRank == 0) {
+        NodeSendCount = MPIU_Malloc("NodeSendCount", sizeof(ptrdiff_t), (ptrdiff_t) NodeSize * NTask);
+    }
+    MPI_Gather(sendcnts, NTask, MPI_TYPE_COUNT, NodeSendCount, NTask, MPI_TYPE_COUNT, 0, node);
+
+    ptrdiff_t nnode = 0;
+    if(NodeRank == 0) {
+        for(i = 0; i < NodeSize * NTask; i ++) {
+            nnode += NodeSendCount[i];
+        }
+        NodeSendBuf = MPIU_Malloc("NodeSendBuf", elsize, nnode);
+    }
+    MPIU_Gather(node, 0, sendpacked, NodeSendBuf, nsend, elsize, NULL);
+
+    if(!packed)
+        MPIU_Free(sendpacked);
+
+    /* the leaders of the nodes; the other ranks wait at the scatter */
+    char * ScatterBuf = NULL;
+    if(NodeRank == 0) {
+        /* 2. order the blocks by receiving node, receiving rank, then sending rank of this node */
+        ptrdiff_t * BlockOffset = MPIU_Malloc("BlockOffset", sizeof(ptrdiff_t), (ptrdiff_t) NodeSize * NTask);
+        {
+            ptrdiff_t offset = 0;
+            for(i = 0; i < NodeSize * NTask; i ++) {
+                BlockOffset[i] = offset;
+                offset += NodeSendCount[i];
+            }
+        }
+
+        ptrdiff_t * HeaderSend = MPIU_Malloc("HeaderSend", sizeof(ptrdiff_t), (ptrdiff_t) NTask * NodeSize);
+        char * LeaderSendBuf = MPIU_Malloc("LeaderSendBuf", elsize, nnode);
+        ptrdiff_t * LeaderCount = MPIU_Malloc("LeaderCount", sizeof(ptrdiff_t), 4 * NNodes);
+        ptrdiff_t * LeaderSendCount = LeaderCount;
+        ptrdiff_t * LeaderRecvCount = LeaderCount + NNodes;
+        ptrdiff_t * HeaderSendCount = LeaderCount + 2 * NNodes;
+        ptrdiff_t * HeaderRecvCount = LeaderCount + 3 * NNodes;
+
+        ptrdiff_t offset = 0;
+        int n;
+        for(n = 0; n < NNodes; n ++) {
+            int k;
+            LeaderSendCount[n] = 0;
+            HeaderSendCount[n] = (ptrdiff_t) (NodeStart[n + 1] - NodeStart[n]) * NodeSize;
+            HeaderRecvCount[n] = (ptrdiff_t) (NodeStart[n + 1] - NodeStart[n]) * NodeSize;
+            for(k = NodeStart[n]; k < NodeStart[n + 1]; k ++) {
+                int d = Members[k];
+                int s;
+                for(s = 0; s < NodeSize; s ++) {
+                    ptrdiff_t count = NodeSendCount[(ptrdiff_t) s * NTask + d];
+                    HeaderSend[(ptrdiff_t) k * NodeSize + s] = count;
+                    memcpy(LeaderSendBuf + offset * elsize,
+                           NodeSendBuf + BlockOffset[(ptrdiff_t) s * NTask + d] * elsize,
+                           count * elsize);
+                    offset += count;
+                    LeaderSendCount[n] += count;
+                }
+            }
+        }
+        MPIU_Free(BlockOffset);
+        MPIU_Free(NodeSendBuf);
+        MPIU_Free(NodeSendCount);
+
+        /* the block counts from node m are ordered by the receiving rank in this node,
+         * then by the sending rank in node m. */
+        ptrdiff_t * HeaderRecv = MPIU_Malloc("HeaderRecv", sizeof(ptrdiff_t), (ptrdiff_t) NTask * NodeSize);
+        MPIU_Alltoallv(HeaderSend, HeaderSendCount, NULL, MPI_TYPE_COUNT,
+                       HeaderRecv, HeaderRecvCount, NULL, MPI_TYPE_COUNT, leaders, AUTO);
+        MPIU_Free(HeaderSend);
+
+        ptrdiff_t * HeaderRecvDispl = MPIU_Malloc("HeaderRecvDispl", sizeof(ptrdiff_t), 2 * NNodes);
+        ptrdiff_t * LeaderRecvDispl = HeaderRecvDispl + NNodes;
+        ptrdiff_t nrecv = 0;
+        ptrdiff_t hoffset = 0;
+        for(n = 0; n < NNodes; n ++) {
+            ptrdiff_t k;
+            HeaderRecvDispl[n] = hoffset;
+            LeaderRecvDispl[n] = nrecv;
+            LeaderRecvCount[n] = 0;
+            for(k = 0; k < HeaderRecvCount[n]; k ++) {
+                LeaderRecvCount[n] += HeaderRecv[hoffset + k];
+            }
+            hoffset += HeaderRecvCount[n];
+            nrecv += LeaderRecvCount[n];
+        }
+
+        char * LeaderRecvBuf = MPIU_Malloc("LeaderRecvBuf", elsize, nrecv);
+        MPIU_Alltoallv(LeaderSendBuf, LeaderSendCount, NULL, sendtype,
+                       LeaderRecvBuf, LeaderRecvCount, NULL, recvtype, leaders, AUTO);
+        MPIU_Free(LeaderSendBuf);
+
+        /* 3. the data of the receiving ranks, each ordered by the sending node, then the sending rank */
+        ScatterBuf = MPIU_Malloc("ScatterBuf", elsize, nrecv);
+        offset = 0;
+        for(j = 0; j < NodeSize; j ++) {
+            for(n = 0; n < NNodes; n ++) {
+                int size = NodeStart[n + 1] - NodeStart[n];
+                ptrdiff_t * header = HeaderRecv + HeaderRecvDispl[n];
+                ptrdiff_t count = 0;
+                int t;
+                for(t = 0; t < size; t ++) {
+                    count += header[(ptrdiff_t) j * size + t];
+                }
+                memcpy(ScatterBuf + offset * elsize,
+                       LeaderRecvBuf + LeaderRecvDispl[n] * elsize,
+                       count * elsize);
+                LeaderRecvDispl[n] += count;
+                offset += count;
+            }
+        }
+        MPIU_Free(LeaderRecvBuf);
+        MPIU_Free(HeaderRecvDispl);
+        MPIU_Free(HeaderRecv);
+        MPIU_Free(LeaderCount);
+        MPI_Comm_free(&leaders);
+    }
+
+    ptrdiff_t nrecv = 0;
+    for(i = 0; i < NTask; i ++) {
+        nrecv += recvcnts[i];
+    }
+    char * recvpacked = MPIU_Malloc("recvpacked", elsize, nrecv);
+    MPIU_Scatter(node, 0, ScatterBuf, recvpacked, nrecv, elsize, NULL);
+
+    if(NodeRank == 0)
+        MPIU_Free(ScatterBuf);
+
+    /* the blocks arrive in the order of Members */
+    ptrdiff_t offset = 0;
+    for(j = 0; j < NTask; j ++) {
+        int src = Members[j];
+        memcpy((char*) recvbuf + rdispls[src] * elsize, recvpacked + offset * elsize, recvcnts[src] * elsize);
+        offset += recvcnts[src];
+    }
+    MPIU_Free(recvpacked);
+
+    MPI_Type_free(&MPI_TYPE_COUNT);
+    MPI_Comm_free(&node);
+    free(NodeStart);
+    free(Members);
+    free(NodeOf);
+    return 0;
+}
+
 int
-_MPIU_Segmenter_assign_colors(size_t glocalsize, size_t * sizes, size_t * sizes2, int * ncolor, MPI_Comm comm)
+_MPIU_Segmenter_assign_colors(size_t glocalsize, size_t * sizes, size_t * sizes2, const int * nodes, int * ncolor, MPI_Comm comm)
 {
     int NTask;
     int ThisTask;
@@ -367,6 +978,13 @@ _MPIU_Segmenter_assign_colors(size_t glocalsize, size_t * sizes, size_t * sizes2
     int current_color = 0;
     int lastcolor = 0;
     for(i = 0; i < NTask; i ++) {
+        if(nodes && i > 0 && nodes[i] != nodes[i - 1]
+        && (current_size > 0 || current_sizes2 > 0)) {
+            /* a segment never spans two nodes */
+            current_size = 0;
+            current_sizes2 = 0;
+            current_color ++;
+        }
         current_size += sizes[i];
         current_sizes2 += sizes2[i];
 
@@ -424,10 +1042,11 @@ MPIU_Segmenter_collect_sizes(size_t localsize, size_t * sizes, size_t * myoffset
     return totalsize;
 }
 
-void
-MPIU_Segmenter_init(MPIU_Segmenter * segmenter,
+static void
+_MPIU_Segmenter_init(MPIU_Segmenter * segmenter,
                size_t * sizes,
                size_t * sizes2,
+               const int * nodes,
                size_t avgsegsize,
                int Ngroup,
                MPI_Comm comm)
@@ -437,7 +1056,7 @@ MPIU_Segmenter_init(MPIU_Segmenter * segmenter,
     MPI_Comm_size(comm, &NTask);
     MPI_Comm_rank(comm, &ThisTask);
 
-    segmenter->ThisSegment = _MPIU_Segmenter_assign_colors(avgsegsize, sizes, sizes2, &segmenter->Nsegments, comm);
+    segmenter->ThisSegment = _MPIU_Segmenter_assign_colors(avgsegsize, sizes, sizes2, nodes, &segmenter->Nsegments, comm);
 
     if(segmenter->ThisSegment >= 0) {
         /* assign segments to groups.
@@ -474,6 +1093,34 @@ MPIU_Segmenter_init(MPIU_Segmenter * segmenter,
     segmenter->segment_leader_rank = MPIU_GetLoc(&sizes[ThisTask], MPI_LONG, MPI_MIN, segmenter->Segment);
 }
 
+void
+MPIU_Segmenter_init(MPIU_Segmenter * segmenter,
+               size_t * sizes,
+               size_t * sizes2,
+               size_t avgsegsize,
+               int Ngroup,
+               MPI_Comm comm)
+{
+    _MPIU_Segmenter_init(segmenter, sizes, sizes2, NULL, avgsegsize, Ngroup, comm);
+}
+
+void
+MPIU_Segmenter_init_within_nodes(MPIU_Segmenter * segmenter,
+               size_t * sizes,
+               size_t * sizes2,
+               size_t avgsegsize,
+               int Ngroup,
+               MPI_Comm comm)
+{
+    int NTask;
+    MPI_Comm_size(comm, &NTask);
+
+    int * nodes = malloc(sizeof(int) * NTask);
+    _MPIU_node_ids(comm, nodes);
+    _MPIU_Segmenter_init(segmenter, sizes, sizes2, nodes, avgsegsize, Ngroup, comm);
+    free(nodes);
+}
+
 void
 MPIU_Segmenter_destroy(MPIU_Segmenter * segmenter)
 {
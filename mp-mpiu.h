@@ -15,24 +15,59 @@ void MPIU_Set_verbose_malloc(MPI_Comm comm);
  * */
 #define MPIU_SetMalloc mpiu_set_malloc
 #define MPIU_MallocT(name, type, nmemb) MPIU_Malloc(name, sizeof(type), nmemb, __FILE__, __LINE__)
-#define MPIU_Malloc(name, elsize, nmemb) mpiu_malloc(name, ((size_t)(elsize)) * nmemb, __FILE__, __LINE__)
+#define MPIU_Malloc(name, elsize, nmemb) mpiu_malloc(name, ((size_t)(elsize)) * (nmemb), __FILE__, __LINE__)
 #define MPIU_Free(ptr) mpiu_free(ptr, __FILE__, __LINE__)
 
+/*
+ * Bytes allocated with MPIU_Malloc and not yet freed; the peak since the last reset.
+ * */
+size_t MPIU_Get_allocated();
+size_t MPIU_Get_allocated_peak();
+void MPIU_Reset_allocated_peak();
+
 /*
  * MPIU_Alltoallv:
- * a Alltoallv can automatically switch to a sparse implementation
+ * a Alltoallv can automatically switch to a sparse implementation.
+ *
+ * HIERARCHICAL exchanges in two levels: the ranks of a node first gather their
+ * data to the node leader, the leaders exchange the data of the whole node,
+ * then each leader scatters the received data inside the node. It trades
+ * memory and copies on the leaders for fewer and larger inter-node messages.
  */
 enum MPIU_AlltoallvSparsePolicy {
     AUTO = 0,
     DISABLED = 1,
-    REQUIRED = 2
+    REQUIRED = 2,
+    HIERARCHICAL = 3
 };
 
-int MPIU_Alltoallv(void *sendbuf, int *sendcnts, int *sdispls,
-        MPI_Datatype sendtype, void *recvbuf, int *recvcnts,
-        int *rdispls, MPI_Datatype recvtype, MPI_Comm comm,
+int MPIU_Alltoallv(void *sendbuf, ptrdiff_t *sendcnts, ptrdiff_t *sdispls,
+        MPI_Datatype sendtype, void *recvbuf, ptrdiff_t *recvcnts,
+        ptrdiff_t *rdispls, MPI_Datatype recvtype, MPI_Comm comm,
         enum MPIU_AlltoallvSparsePolicy policy);
 
+/* returns true if the last MPIU_Alltoallv used the sparse implementation. */
+int MPIU_Alltoallv_was_sparse();
+
+/*
+ * The nodes of the HIERARCHICAL policy are the ranks sharing memory
+ * (MPI_COMM_TYPE_SHARED). A positive n groups every n consecutive ranks
+ * into a node instead, e.g. to test on a single host; 0 restores the default.
+ * */
+void MPIU_Set_ranks_per_node(int n);
+
+/* returns true if all ranks of comm can share memory (MPI_Win_allocate_shared). */
+int MPIU_Comm_is_shared(MPI_Comm comm);
+
+/*
+ * Counts and displacements of MPIU_Alltoallv, MPIU_Gather and MPIU_Scatter are
+ * ptrdiff_t. Larger than int counts use the MPI-4 large count functions if available;
+ * otherwise derived datatypes (dense) or several messages (sparse, gather and scatter)
+ * of at most maxcount items. maxcount defaults to INT_MAX; lower it to test
+ * the large count code paths.
+ * */
+void MPIU_Set_max_count(ptrdiff_t maxcount);
+
 /*
  * Returns the rank that contains the first result matching the MPI_Op.
  * op can be MPI_MIN or MPI_MAX. This function works around potentially buggy
@@ -45,13 +80,13 @@ MPIU_GetLoc(const void * base, MPI_Datatype type, MPI_Op op, MPI_Comm comm);
  * Gathers from all ranks to root. if recvbuffer is NULL, allocate new memory with MPIU_Malloc.
  */
 void *
-MPIU_Gather (MPI_Comm comm, int root, const void * sendbuffer, void * recvbuffer, int nsend, size_t elsize, int * totalnrecv);
+MPIU_Gather (MPI_Comm comm, int root, const void * sendbuffer, void * recvbuffer, ptrdiff_t nsend, size_t elsize, ptrdiff_t * totalnrecv);
 
 /*
  * Scatter from root to all ranks. if recvbuffer is NULL, allocate new memory with MPIU_Malloc.
  */
 void *
-MPIU_Scatter (MPI_Comm comm, int root, const void * sendbuffer, void * recvbuffer, int nrecv, size_t elsize, int * totalnsend);
+MPIU_Scatter (MPI_Comm comm, int root, const void * sendbuffer, void * recvbuffer, ptrdiff_t nrecv, size_t elsize, ptrdiff_t * totalnsend);
 
 /* Segment a MPI Comm into 'groups', such that distributed data in each group is roughly even.
  * NOTE: this API needs some revision to incorporate some of the downstream behaviors. Currently
@@ -90,6 +125,15 @@ MPIU_Segmenter_init(MPIU_Segmenter * segmenter,
                size_t expected_segsize, /* desired size per segment */
                int Ngroup,  /* number of groups to form. */
                MPI_Comm comm);
+/* MPIU_Segmenter_init_within_nodes: as MPIU_Segmenter_init, but a segment
+ * never spans the ranks of two nodes (see MPIU_Set_ranks_per_node). */
+void
+MPIU_Segmenter_init_within_nodes(MPIU_Segmenter * segmenter,
+               size_t * sizes,
+               size_t * sizes2,
+               size_t expected_segsize,
+               int Ngroup,
+               MPI_Comm comm);
 void
 MPIU_Segmenter_destroy(MPIU_Segmenter * segmenter);
 
@@ -7,6 +7,9 @@
 #include <string.h>
 
 #include <mpi.h>
+#ifdef _OPENMP
+#include <omp.h>
+#endif
 
 #include "mpsort.h"
 #include "internal.h"
@@ -15,6 +18,15 @@
 #include "internal-parallel.h"
 
 static int _mpsort_mpi_options = 0;
+static void _mpsort_mpi_parse_env();
+static size_t _mpsort_mpi_max_buffer_bytes = 0;
+
+/* the splitters of the last histogram sort, for MPSORT_ENABLE_INCREMENTAL */
+static struct {
+    unsigned char * P;
+    size_t rsize;
+    int NTask;
+} _mpsort_mpi_last_splitters;
 
 /* mpi version of radix sort;
  *
@@ -34,6 +46,8 @@ static MPI_Datatype MPI_TYPE_PTRDIFF = 0;
 
 struct crmpistruct {
     MPI_Datatype MPI_TYPE_RADIX;
+    /* the radix as an unsigned integer; MPI_DATATYPE_NULL unless rsize is 2, 4 or 8 */
+    MPI_Datatype MPI_TYPE_RADIX_UINT;
     MPI_Datatype MPI_TYPE_DATA;
     MPI_Comm comm;
     void * mybase;
@@ -44,6 +58,7 @@ struct crmpistruct {
     size_t outnmemb;
     int NTask;
     int ThisTask;
+    int options;
 };
 
 static void
@@ -81,19 +96,67 @@ _setup_mpsort_mpi(struct crmpistruct * o,
     MPI_Type_contiguous(d->size, MPI_BYTE, &o->MPI_TYPE_DATA);
     MPI_Type_commit(&o->MPI_TYPE_DATA);
 
+    switch(d->rsize) {
+        case 2: o->MPI_TYPE_RADIX_UINT = MPI_UINT16_T; break;
+        case 4: o->MPI_TYPE_RADIX_UINT = MPI_UINT32_T; break;
+        case 8: o->MPI_TYPE_RADIX_UINT = MPI_UINT64_T; break;
+        default: o->MPI_TYPE_RADIX_UINT = MPI_DATATYPE_NULL;
+    }
+
 }
 static void _destroy_mpsort_mpi(struct crmpistruct * o) {
     MPI_Type_free(&o->MPI_TYPE_RADIX);
     MPI_Type_free(&o->MPI_TYPE_DATA);
 }
 
-static void _find_Pmax_Pmin_C(void * mybase, size_t mynmemb, size_t nmemb,
+static void _find_Pmax_Pmin_C(void * mybase,
+        const size_t * runoffset, const size_t * runnmemb, int nrun,
+        size_t nmemb,
         size_t myoutnmemb,
         unsigned char * Pmax, unsigned char * Pmin,
         ptrdiff_t * C,
         struct crstruct * d,
         struct crmpistruct * o);
 
+static void _find_P_brackets_by_sampling(
+        ptrdiff_t * C,
+        unsigned char * Pleft, unsigned char * Pright,
+        ptrdiff_t * CLEleft, ptrdiff_t * CLTright,
+        struct crstruct * d,
+        struct crmpistruct * o);
+
+static void
+_histogram_runs(unsigned char * P, int Plength, void * mybase,
+        const size_t * runoffset, const size_t * runnmemb, int nrun,
+        ptrdiff_t * myCLT, ptrdiff_t * myCLE,
+        unsigned char * Pprev, unsigned char * Pnext,
+        struct crstruct * d);
+
+/* a piece of the run from source, starting at offset of the run,
+ * stored at pos of the local array. */
+struct piece {
+    int source;
+    ptrdiff_t offset;
+    ptrdiff_t pos;
+    ptrdiff_t nmemb;
+};
+
+static int _exchange_in_place(
+        struct crstruct * d,
+        struct crmpistruct * o,
+        ptrdiff_t * SendCount,
+        ptrdiff_t * SendDispl,
+        ptrdiff_t * RecvCount,
+        enum MPIU_AlltoallvSparsePolicy policy,
+        size_t max_buffer_bytes,
+        struct piece ** pieces,
+        const int line, const char * file);
+
+static int _merge_pieces_in_place(
+        struct crstruct * d,
+        void * base, size_t nmemb,
+        struct piece * pieces, int npieces);
+
 static int _solve_for_layout_mpi (
         int NTask,
         ptrdiff_t * C,
@@ -126,6 +189,45 @@ int mpsort_mpi_find_ntimers(struct TIMER * tmr) {
     return n;
 }
 
+static struct mpsort_mpi_stats _mpsort_mpi_stats;
+
+/* start counting; returns the memory allocated before */
+static size_t
+_mpsort_mpi_stats_reset()
+{
+    memset(&_mpsort_mpi_stats, 0, sizeof(_mpsort_mpi_stats));
+    _mpsort_mpi_stats.nthreads = mpsort_get_nthreads();
+    MPIU_Reset_allocated_peak();
+    return MPIU_Get_allocated();
+}
+
+static void
+_mpsort_mpi_stats_finish(size_t allocated)
+{
+    _mpsort_mpi_stats.peak_memory = MPIU_Get_allocated_peak() - allocated;
+}
+
+void
+mpsort_mpi_get_last_run_stats(struct mpsort_mpi_stats * stats)
+{
+    *stats = _mpsort_mpi_stats;
+}
+
+int
+mpsort_mpi_get_last_run_nphases()
+{
+    /* no sort yet */
+    if(0 != strcmp(_TIMERS[0].name, "START")) return 0;
+    return mpsort_mpi_find_ntimers(_TIMERS) - 1;
+}
+
+const char *
+mpsort_mpi_get_last_run_phase(int i, double * elapsed)
+{
+    *elapsed = _TIMERS[i + 1].time - _TIMERS[i].time;
+    return _TIMERS[i + 1].name;
+}
+
 void
 mpsort_mpi_impl (void * mybase, size_t mynmemb, size_t size,
         void (*radix)(const void * ptr, void * radix, void * arg),
@@ -145,6 +247,34 @@ static int
 mpsort_mpi_histogram_sort(struct crstruct d, struct crmpistruct o, struct TIMER * tmr,
     const int line, const char * file);
 
+static void
+_mpsort_mpi_out_of_memory(const char * what, MPI_Comm comm, const int line, const char * file)
+{
+    fprintf(stderr, "MPSort: cannot allocate the %s. "
+                    "Caller site: %s:%d\n", what, file, line);
+    MPI_Abort(comm, -1);
+}
+
+static void
+_mpsort_mpi_init_ptrdiff_type(MPI_Comm comm)
+{
+    if(MPI_TYPE_PTRDIFF == 0) {
+        if(sizeof(ptrdiff_t) == sizeof(int)) {
+            MPI_TYPE_PTRDIFF = MPI_INT;
+        }
+        else if(sizeof(ptrdiff_t) == sizeof(long)) {
+            MPI_TYPE_PTRDIFF = MPI_LONG;
+        }
+        else if(sizeof(ptrdiff_t) == sizeof(long long)) {
+            MPI_TYPE_PTRDIFF = MPI_LONG_LONG;
+        }
+        else {
+            fprintf(stderr, "MPSort: sizeof(ptrdiff) = %lu, not recognised\n", sizeof(ptrdiff_t));
+            MPI_Abort(comm, -1);
+        }
+    }
+}
+
 static uint64_t
 checksum(void * base, ptrdiff_t nbytes, MPI_Comm comm)
 {
@@ -158,9 +288,79 @@ checksum(void * base, ptrdiff_t nbytes, MPI_Comm comm)
     return sum;
 }
 
-void
-mpsort_mpi_newarray_impl (void * mybase, size_t mynmemb,
-        void * myoutbase, size_t myoutnmemb,
+static uint64_t
+_mix64(uint64_t word)
+{
+    word *= 0x9E3779B97F4A7C15ull;
+    return word ^ (word >> 29);
+}
+
+/* a sum of hashed 64-bit words of each item; a tail shorter than
+ * a word is padded with zeros. The sum does not depend on the order of the items. */
+static uint64_t
+fast_checksum(void * base, size_t nmemb, size_t elsize, MPI_Comm comm)
+{
+    uint64_t sum = 0;
+    const char * ptr = (const char *) base;
+    int nthreads = mpsort_get_nthreads();
+    ptrdiff_t i;
+
+    if(elsize % 8 == 0) {
+        /* the items are contiguous words */
+        ptrdiff_t nwords = nmemb * elsize / 8;
+#pragma omp parallel for reduction(+: sum) num_threads(nthreads) if(nthreads > 1)
+        for(i = 0; i < nwords; i ++) {
+            uint64_t word;
+            memcpy(&word, ptr + i * 8, 8);
+            sum += _mix64(word);
+        }
+    } else {
+#pragma omp parallel for reduction(+: sum) num_threads(nthreads) if(nthreads > 1)
+        for(i = 0; i < nmemb; i ++) {
+            const char * item = ptr + i * elsize;
+            size_t j;
+            uint64_t word;
+            for(j = 0; j + 8 <= elsize; j += 8) {
+                memcpy(&word, item + j, 8);
+                sum += _mix64(word);
+            }
+            word = 0;
+            memcpy(&word, item + j, elsize - j);
+            sum += _mix64(word);
+        }
+    }
+    MPI_Allreduce(MPI_IN_PLACE, &sum, 1, MPI_UINT64_T, MPI_SUM, comm);
+    return sum;
+}
+
+static uint64_t
+_mpsort_mpi_checksum(void * base, size_t nmemb, size_t elsize, int options, MPI_Comm comm)
+{
+    if(options & MPSORT_DISABLE_CHECKSUM) return 0;
+    if(options & MPSORT_ENABLE_FAST_CHECKSUM) return fast_checksum(base, nmemb, elsize, comm);
+    return checksum(base, elsize * nmemb, comm);
+}
+
+/* returns true if the local array is sorted by the radix */
+static int
+_is_sorted(const void * base, size_t nmemb, struct crstruct * d)
+{
+    unsigned char r[d->rsize];
+    unsigned char last[d->rsize];
+    size_t i;
+    for(i = 0; i < nmemb; i ++) {
+        d->radix((const char*) base + i * d->size, r, d->arg);
+        if(i > 0 && d->compar(last, r, d->rsize) > 0) {
+            return 0;
+        }
+        memcpy(last, r, d->rsize);
+    }
+    return 1;
+}
+
+/* abort if the items are not globally sorted by the radix. */
+static void
+_mpsort_mpi_check_sorted(void * mybase, size_t mynmemb,
         size_t elsize,
         void (*radix)(const void * ptr, void * radix, void * arg),
         size_t rsize,
@@ -169,29 +369,145 @@ mpsort_mpi_newarray_impl (void * mybase, size_t mynmemb,
         const int line,
         const char * file)
 {
+    struct crstruct d;
+    int NTask;
+    int ThisTask;
+    MPI_Comm_size(comm, &NTask);
+    MPI_Comm_rank(comm, &ThisTask);
 
-    if(MPI_TYPE_PTRDIFF == 0) {
-        if(sizeof(ptrdiff_t) == sizeof(int)) {
-            MPI_TYPE_PTRDIFF = MPI_INT;
-        }
-        else if(sizeof(ptrdiff_t) == sizeof(long)) {
-            MPI_TYPE_PTRDIFF = MPI_LONG;
+    _setup_radix_sort(&d, mybase, mynmemb, elsize, radix, rsize, arg);
+
+    int broken = 0;
+    ptrdiff_t i;
+
+    /* the first and the last radix of each rank, after a flag for non-empty ranks */
+    size_t ssize = 1 + 2 * rsize;
+    unsigned char mine[ssize];
+    unsigned char * all = MPIU_Malloc("bounds", ssize, NTask);
+    unsigned char r[rsize];
+
+    memset(mine, 0, ssize);
+    mine[0] = mynmemb > 0;
+    for(i = 0; i < mynmemb; i ++) {
+        radix((char*) mybase + i * elsize, r, arg);
+        if(i == 0) {
+            memcpy(mine + 1, r, rsize);
+        } else if(d.compar(mine + 1 + rsize, r, rsize) > 0) {
+            broken = 1;
         }
-        else if(sizeof(ptrdiff_t) == sizeof(long long)) {
-            MPI_TYPE_PTRDIFF = MPI_LONG_LONG;
+        memcpy(mine + 1 + rsize, r, rsize);
+    }
+
+    MPI_Allgather(mine, ssize, MPI_BYTE, all, ssize, MPI_BYTE, comm);
+
+    unsigned char * last = NULL;
+    for(i = 0; i < NTask; i ++) {
+        unsigned char * bounds = all + i * ssize;
+        if(!bounds[0]) continue;
+        if(last && d.compar(last, bounds + 1, rsize) > 0) {
+            broken = 1;
         }
-        else {
-            fprintf(stderr, "MPSort: sizeof(ptrdiff) = %lu, not recognised\n", sizeof(ptrdiff_t));
-            MPI_Abort(comm, -1);
+        last = bounds + 1 + rsize;
+    }
+
+    MPIU_Free(all);
+
+    MPI_Allreduce(MPI_IN_PLACE, &broken, 1, MPI_INT, MPI_LOR, comm);
+
+    if(broken) {
+        if(ThisTask == 0) {
+            fprintf(stderr, "MPSort: output is not sorted. "
+                            "Caller site: %s:%d\n",
+                            file, line);
         }
+        MPI_Abort(comm, -1);
+    }
+}
+
+static void
+_mpsort_mpi_sort_records(void * mybase, size_t mynmemb,
+        void * myoutbase, size_t myoutnmemb,
+        size_t elsize,
+        void (*radix)(const void * ptr, void * radix, void * arg),
+        size_t rsize,
+        void * arg,
+        MPI_Comm comm,
+        int options,
+        const int line,
+        const char * file);
+
+static void
+_mpsort_mpi_sort_key_index(void * mybase, size_t mynmemb,
+        void * myoutbase, size_t myoutnmemb,
+        size_t elsize,
+        void (*radix)(const void * ptr, void * radix, void * arg),
+        size_t rsize,
+        void * arg,
+        MPI_Comm comm,
+        int options,
+        const int line,
+        const char * file);
+
+void
+mpsort_mpi_newarray_impl (void * mybase, size_t mynmemb,
+        void * myoutbase, size_t myoutnmemb,
+        size_t elsize,
+        void (*radix)(const void * ptr, void * radix, void * arg),
+        size_t rsize,
+        void * arg,
+        MPI_Comm comm,
+        const int line,
+        const char * file)
+{
+
+    _mpsort_mpi_init_ptrdiff_type(comm);
+
+    _mpsort_mpi_parse_env();
+    int options = _mpsort_mpi_options;
+
+    size_t allocated = _mpsort_mpi_stats_reset();
+
+    uint64_t sum1 = _mpsort_mpi_checksum(mybase, mynmemb, elsize, options, comm);
+
+    if(options & (MPSORT_ENABLE_KEY_INDEX_SORT | MPSORT_ENABLE_STABLE)) {
+        _mpsort_mpi_sort_key_index(mybase, mynmemb, myoutbase, myoutnmemb,
+            elsize, radix, rsize, arg, comm, options & ~MPSORT_ENABLE_KEY_INDEX_SORT, line, file);
+    } else {
+        _mpsort_mpi_sort_records(mybase, mynmemb, myoutbase, myoutnmemb,
+            elsize, radix, rsize, arg, comm, options, line, file);
+    }
+
+    _mpsort_mpi_stats_finish(allocated);
+
+    uint64_t sum2 = _mpsort_mpi_checksum(myoutbase, myoutnmemb, elsize, options, comm);
+    if (sum1 != sum2) {
+        fprintf(stderr, "MPSort: Data changed after sorting; checksum mismatch. "
+                        "Caller site: %s:%d\n",
+                        file, line);
+        MPI_Abort(comm, -1);
+    }
+
+    if(options & MPSORT_ENABLE_CHECK_SORTED) {
+        _mpsort_mpi_check_sorted(myoutbase, myoutnmemb, elsize, radix, rsize, arg, comm, line, file);
     }
+}
 
+static void
+_mpsort_mpi_sort_records(void * mybase, size_t mynmemb,
+        void * myoutbase, size_t myoutnmemb,
+        size_t elsize,
+        void (*radix)(const void * ptr, void * radix, void * arg),
+        size_t rsize,
+        void * arg,
+        MPI_Comm comm,
+        int options,
+        const int line,
+        const char * file)
+{
     struct TIMER * tmr = _TIMERS;
 
     MPIU_Segmenter segmenter[1];
 
-    uint64_t sum1 = checksum(mybase, elsize * mynmemb, comm);
-
     int NTask;
     int ThisTask;
     MPI_Comm_size(comm, &NTask);
@@ -236,7 +552,11 @@ mpsort_mpi_newarray_impl (void * mybase, size_t mynmemb,
         /* do not use more than 4MB in a segment */
         avgsegsize = 4 * 1024 * 1024 / elsize;
     }
-    if(mpsort_mpi_has_options(MPSORT_REQUIRE_GATHER_SORT)) {
+    if (_mpsort_mpi_max_buffer_bytes > 0 && avgsegsize * elsize > _mpsort_mpi_max_buffer_bytes) {
+        /* with a memory bound, a segment shall fit into the bound */
+        avgsegsize = _mpsort_mpi_max_buffer_bytes / elsize;
+    }
+    if((options & MPSORT_REQUIRE_GATHER_SORT)) {
         if(ThisTask == 0) {
             fprintf(stderr, "MPSort: gathering all data to a single rank for sorting due to MPSORT_REQUIRE_GATHER_SORT. "
                             "Total number of items is %ld. "
@@ -246,7 +566,7 @@ mpsort_mpi_newarray_impl (void * mybase, size_t mynmemb,
         avgsegsize = totalsize;
     }
 
-    if(mpsort_mpi_has_options(MPSORT_DISABLE_GATHER_SORT)) {
+    if((options & MPSORT_DISABLE_GATHER_SORT)) {
         avgsegsize = 0;
         if(ThisTask == 0) {
             fprintf(stderr, "MPSort: disable gathering data into larger chunks due to MPSORT_DISABLE_GATHER_SORT. "
@@ -255,78 +575,1125 @@ mpsort_mpi_newarray_impl (void * mybase, size_t mynmemb,
         }
     }
 
-    /* use as many groups as possible (some will be empty) but at most 1 segment per group */
-    MPIU_Segmenter_init(segmenter, sizes, outsizes, avgsegsize, NTask, comm);
+    /* use as many groups as possible (some will be empty) but at most 1 segment per group */
+    if((options & (MPSORT_DISABLE_SHARED_MEMORY_GATHER | MPSORT_REQUIRE_GATHER_SORT))) {
+        MPIU_Segmenter_init(segmenter, sizes, outsizes, avgsegsize, NTask, comm);
+    } else {
+        /* keep the groups within a node, such that they can share memory */
+        MPIU_Segmenter_init_within_nodes(segmenter, sizes, outsizes, avgsegsize, NTask, comm);
+
+        /* if no node has two ranks to combine (e.g. one rank per node), the groups within nodes
+         * are all single ranks; then let the groups span nodes and gather with messages. */
+        int nodegroupsize;
+        int maxnodegroupsize;
+        MPI_Comm_size(segmenter->Group, &nodegroupsize);
+        MPI_Allreduce(&nodegroupsize, &maxnodegroupsize, 1, MPI_INT, MPI_MAX, comm);
+        if(maxnodegroupsize == 1 && NTask > 1) {
+            MPIU_Segmenter_destroy(segmenter);
+            MPIU_Segmenter_init(segmenter, sizes, outsizes, avgsegsize, NTask, comm);
+        }
+    }
+
+    /* group comm == seg comm */
+
+    void * mysegmentbase = NULL;
+    void * myoutsegmentbase = NULL;
+    size_t mysegmentnmemb;
+    size_t myoutsegmentnmemb;
+
+    int groupsize;
+    int grouprank;
+    MPI_Comm_size(segmenter->Group, &groupsize);
+    MPI_Comm_rank(segmenter->Group, &grouprank);
+
+    MPI_Allreduce(&mynmemb, &mysegmentnmemb, 1, MPI_TYPE_PTRDIFF, MPI_SUM, segmenter->Group);
+    MPI_Allreduce(&myoutnmemb, &myoutsegmentnmemb, 1, MPI_TYPE_PTRDIFF, MPI_SUM, segmenter->Group);
+
+    /* with a memory bound the segments are sorted in place, but only if the caller sorts in place
+     * on every rank: the leaders and the single ranks shall all take the same exchange. */
+    int inplace = _mpsort_mpi_max_buffer_bytes > 0 && mybase == myoutbase && mynmemb == myoutnmemb;
+    MPI_Allreduce(MPI_IN_PLACE, &inplace, 1, MPI_INT, MPI_MIN, comm);
+
+    int shared = 0;
+    if (groupsize > 1 && !(options & MPSORT_DISABLE_SHARED_MEMORY_GATHER)) {
+        shared = MPIU_Comm_is_shared(segmenter->Group);
+    }
+
+#if MPI_VERSION >= 3
+    MPI_Win segmentwin = MPI_WIN_NULL;
+    size_t mysegmentoffset = 0;
+    size_t myoutsegmentoffset = 0;
+
+    if (shared) {
+        /* the leader allocates the segments in a shared window;
+         * each rank copies its own items in and out of it, and no item is sent. */
+        MPI_Aint winsize = 0;
+        MPI_Aint qsize;
+        int qdisp;
+        char * winbase;
+
+        if(grouprank == segmenter->group_leader_rank) {
+            winsize = (mysegmentnmemb + (inplace ? 0 : myoutsegmentnmemb)) * elsize;
+        }
+        MPI_Win_allocate_shared(winsize, 1, MPI_INFO_NULL, segmenter->Group, &winbase, &segmentwin);
+        MPI_Win_shared_query(segmentwin, segmenter->group_leader_rank, &qsize, &qdisp, &winbase);
+
+        mysegmentbase = winbase;
+        myoutsegmentbase = inplace ? winbase : winbase + mysegmentnmemb * elsize;
+
+        MPI_Exscan(&mynmemb, &mysegmentoffset, 1, MPI_TYPE_PTRDIFF, MPI_SUM, segmenter->Group);
+        MPI_Exscan(&myoutnmemb, &myoutsegmentoffset, 1, MPI_TYPE_PTRDIFF, MPI_SUM, segmenter->Group);
+        if(grouprank == 0) {
+            mysegmentoffset = 0;
+            myoutsegmentoffset = 0;
+        }
+
+        MPI_Win_lock_all(MPI_MODE_NOCHECK, segmentwin);
+        if(mynmemb > 0)
+            memcpy((char*) mysegmentbase + mysegmentoffset * elsize, mybase, mynmemb * elsize);
+        MPI_Win_sync(segmentwin);
+        MPI_Barrier(segmenter->Group);
+        MPI_Win_sync(segmentwin);
+    } else
+#endif
+    if (groupsize > 1) {
+        if(grouprank == segmenter->group_leader_rank) {
+            mysegmentbase = MPIU_Malloc("mysegment", elsize, mysegmentnmemb);
+            if(inplace) {
+                /* with a memory bound, sort the segment in place */
+                myoutsegmentbase = mysegmentbase;
+            } else {
+                myoutsegmentbase = MPIU_Malloc("outsegment", elsize, myoutsegmentnmemb);
+            }
+        }
+        MPIU_Gather(segmenter->Group, segmenter->group_leader_rank, mybase, mysegmentbase, mynmemb, elsize, NULL);
+        if(grouprank == segmenter->group_leader_rank) {
+            _mpsort_mpi_stats.bytes_recv += (mysegmentnmemb - mynmemb) * elsize;
+            _mpsort_mpi_stats.bytes_sent += (myoutsegmentnmemb - myoutnmemb) * elsize;
+        } else {
+            _mpsort_mpi_stats.bytes_sent += mynmemb * elsize;
+            _mpsort_mpi_stats.bytes_recv += myoutnmemb * elsize;
+        }
+    } else {
+        mysegmentbase = mybase;
+        myoutsegmentbase = myoutbase;
+    }
+
+    /* only do sorting on the group leaders for each segment */
+    if(segmenter->is_group_leader) {
+
+        struct crstruct d;
+        struct crmpistruct o;
+
+        _setup_radix_sort(&d, mysegmentbase, mysegmentnmemb, elsize, radix, rsize, arg);
+
+        _setup_mpsort_mpi(&o, &d, myoutsegmentbase, myoutsegmentnmemb, segmenter->Leaders, line, file);
+        o.options = options;
+
+        mpsort_mpi_histogram_sort(d, o, tmr, line, file);
+
+        _destroy_mpsort_mpi(&o);
+    }
+
+#if MPI_VERSION >= 3
+    if(shared) {
+        MPI_Win_sync(segmentwin);
+        MPI_Barrier(segmenter->Group);
+        MPI_Win_sync(segmentwin);
+        if(myoutnmemb > 0)
+            memcpy(myoutbase, (char*) myoutsegmentbase + myoutsegmentoffset * elsize, myoutnmemb * elsize);
+        MPI_Win_unlock_all(segmentwin);
+        MPI_Win_free(&segmentwin);
+    } else
+#endif
+    if(groupsize > 1) {
+        MPIU_Scatter(segmenter->Group, segmenter->group_leader_rank, myoutsegmentbase, myoutbase, myoutnmemb, elsize, NULL);
+    }
+
+    {
+        int ntmr;
+        if(segmenter->is_group_leader)
+            ntmr = (mpsort_mpi_find_ntimers(tmr) + 1);
+
+        MPI_Bcast(&ntmr, 1, MPI_INT, segmenter->group_leader_rank, segmenter->Group);
+        MPI_Bcast(tmr, sizeof(tmr[0]) * ntmr, MPI_BYTE, segmenter->group_leader_rank, segmenter->Group);
+    }
+
+    {
+        int leaderstats[2] = {_mpsort_mpi_stats.niter, _mpsort_mpi_stats.sparse};
+        MPI_Bcast(leaderstats, 2, MPI_INT, segmenter->group_leader_rank, segmenter->Group);
+        _mpsort_mpi_stats.niter = leaderstats[0];
+        _mpsort_mpi_stats.sparse = leaderstats[1];
+        _mpsort_mpi_stats.ngroups = segmenter->Ngroup;
+        _mpsort_mpi_stats.groupsize = groupsize;
+    }
+
+    if(!shared && grouprank == segmenter->group_leader_rank) {
+        if(myoutsegmentbase != myoutbase && myoutsegmentbase != mysegmentbase)
+            MPIU_Free(myoutsegmentbase);
+        if(mysegmentbase != mybase)
+            MPIU_Free(mysegmentbase);
+    }
+
+    MPIU_Segmenter_destroy(segmenter);
+}
+
+/* The exchange plan of a key-index sort:
+ * send the items at SendIndex, grouped by the receiving rank,
+ * and store the received items at RecvIndex of the output. */
+struct mpsort_mpi_plan {
+    MPI_Comm comm;
+    int NTask;
+    int ThisTask;
+    enum MPIU_AlltoallvSparsePolicy policy;
+    ptrdiff_t nsend;
+    ptrdiff_t nrecv;
+    ptrdiff_t * SendCount;
+    ptrdiff_t * SendDispl;
+    ptrdiff_t * RecvCount;
+    ptrdiff_t * RecvDispl;
+    ptrdiff_t * SendIndex;
+    ptrdiff_t * RecvIndex;
+    /* bound of the buffers of apply; 0 for no bound */
+    size_t max_buffer_bytes;
+};
+
+/* a key-index tuple is the radix padded to 8 bytes, followed by
+ * the origin of the item: the rank and the offset on the rank. */
+static size_t
+_key_index_radix_offset(size_t rsize)
+{
+    return (rsize + 7) / 8 * 8;
+}
+
+static void
+_key_index_radix(const void * ptr, void * radix, void * arg)
+{
+    memcpy(radix, ptr, *(size_t *) arg);
+}
+
+static void
+_plan_create_from_tuples(struct mpsort_mpi_plan * plan,
+        const char * tuples, size_t ntuples, size_t tuplesize, size_t keysize,
+        MPI_Comm comm,
+        int options)
+{
+    int NTask;
+    MPI_Comm_size(comm, &NTask);
+
+    plan->comm = comm;
+    plan->NTask = NTask;
+    MPI_Comm_rank(comm, &plan->ThisTask);
+    plan->max_buffer_bytes = _mpsort_mpi_max_buffer_bytes;
+    plan->policy = AUTO;
+    if (options & MPSORT_DISABLE_SPARSE_ALLTOALLV) {
+        plan->policy = DISABLED;
+    }
+    if (options & MPSORT_REQUIRE_SPARSE_ALLTOALLV) {
+        plan->policy = REQUIRED;
+    }
+    if (options & MPSORT_REQUIRE_HIERARCHICAL_ALLTOALLV) {
+        plan->policy = HIERARCHICAL;
+    }
+
+    plan->SendCount = MPIU_Malloc("SendCount", sizeof(ptrdiff_t), NTask);
+    plan->SendDispl = MPIU_Malloc("SendDispl", sizeof(ptrdiff_t), NTask);
+    plan->RecvCount = MPIU_Malloc("RecvCount", sizeof(ptrdiff_t), NTask);
+    plan->RecvDispl = MPIU_Malloc("RecvDispl", sizeof(ptrdiff_t), NTask);
+
+    ptrdiff_t i;
+    int r;
+    for(r = 0; r < NTask; r ++) {
+        plan->RecvCount[r] = 0;
+    }
+    for(i = 0; i < ntuples; i ++) {
+        const ptrdiff_t * origin = (const ptrdiff_t *) (tuples + i * tuplesize + keysize);
+        plan->RecvCount[origin[0]] ++;
+    }
+
+    MPI_Alltoall(plan->RecvCount, 1, MPI_TYPE_PTRDIFF,
+                 plan->SendCount, 1, MPI_TYPE_PTRDIFF, comm);
+
+    plan->SendDispl[0] = 0;
+    plan->RecvDispl[0] = 0;
+    for(r = 1; r < NTask; r ++) {
+        plan->SendDispl[r] = plan->SendDispl[r - 1] + plan->SendCount[r - 1];
+        plan->RecvDispl[r] = plan->RecvDispl[r - 1] + plan->RecvCount[r - 1];
+    }
+    plan->nsend = plan->SendDispl[NTask - 1] + plan->SendCount[NTask - 1];
+    plan->nrecv = plan->RecvDispl[NTask - 1] + plan->RecvCount[NTask - 1];
+
+    /* group the requests by the origin rank */
+    ptrdiff_t * RequestOffset = MPIU_Malloc("RequestOffset", sizeof(ptrdiff_t), plan->nrecv);
+    plan->RecvIndex = MPIU_Malloc("RecvIndex", sizeof(ptrdiff_t), plan->nrecv);
+    ptrdiff_t * fill = MPIU_Malloc("fill", sizeof(ptrdiff_t), NTask);
+
+    for(r = 0; r < NTask; r ++) {
+        fill[r] = plan->RecvDispl[r];
+    }
+    for(i = 0; i < ntuples; i ++) {
+        const ptrdiff_t * origin = (const ptrdiff_t *) (tuples + i * tuplesize + keysize);
+        ptrdiff_t j = fill[origin[0]] ++;
+        plan->RecvIndex[j] = i;
+        RequestOffset[j] = origin[1];
+    }
+
+    MPIU_Free(fill);
+
+    plan->SendIndex = MPIU_Malloc("SendIndex", sizeof(ptrdiff_t), plan->nsend);
+
+    MPIU_Alltoallv(RequestOffset, plan->RecvCount, plan->RecvDispl, MPI_TYPE_PTRDIFF,
+                   plan->SendIndex, plan->SendCount, plan->SendDispl, MPI_TYPE_PTRDIFF,
+                   comm, plan->policy);
+
+    MPIU_Free(RequestOffset);
+}
+
+static int
+_is_big_endian()
+{
+    union {
+        uint32_t i;
+        char c[4];
+    } be_detect = {0x01020304};
+    return be_detect.c[0] == 1;
+}
+
+/* The size of the sort key of a tuple; with MPSORT_ENABLE_STABLE the radix
+ * is extended by the global index of the item, as less significant bytes,
+ * such that equal radixes keep the order of the input. */
+static size_t
+_tuple_rsize(size_t rsize, int options)
+{
+    if(options & MPSORT_ENABLE_STABLE) {
+        return rsize + sizeof(uint64_t);
+    }
+    return rsize;
+}
+
+/* offset of the global index in the sort key of a stable tuple;
+ * the most significant byte of a radix is at the highest address on little endian. */
+static size_t
+_tuple_gindex_offset(size_t rsize)
+{
+    return _is_big_endian() ? rsize : 0;
+}
+
+/* Sort (radix, rank, offset) tuples of the items; returns the sorted tuples
+ * of this rank, to be freed by the caller. */
+static char *
+_plan_sort_tuples(const void * mybase, size_t mynmemb,
+        size_t myoutnmemb,
+        size_t elsize,
+        void (*radix)(const void * ptr, void * radix, void * arg),
+        size_t rsize,
+        void * arg,
+        MPI_Comm comm,
+        int options,
+        size_t * keysize,
+        size_t * tuplesize,
+        const int line,
+        const char * file)
+{
+    int ThisTask;
+    MPI_Comm_rank(comm, &ThisTask);
+
+    size_t trsize = _tuple_rsize(rsize, options);
+    *keysize = _key_index_radix_offset(trsize);
+    *tuplesize = *keysize + 2 * sizeof(ptrdiff_t);
+
+    uint64_t start = 0;
+    if(options & MPSORT_ENABLE_STABLE) {
+        uint64_t n = mynmemb;
+        MPI_Exscan(&n, &start, 1, MPI_UINT64_T, MPI_SUM, comm);
+        if(ThisTask == 0) start = 0;
+    }
+    size_t radixoffset = (options & MPSORT_ENABLE_STABLE) && !_is_big_endian() ? sizeof(uint64_t) : 0;
+
+    char * tuples = MPIU_Malloc("tuples", *tuplesize, mynmemb);
+    char * outtuples = MPIU_Malloc("outtuples", *tuplesize, myoutnmemb);
+
+    ptrdiff_t i;
+    for(i = 0; i < mynmemb; i ++) {
+        char * tuple = tuples + i * *tuplesize;
+        ptrdiff_t * origin = (ptrdiff_t *) (tuple + *keysize);
+        memset(tuple, 0, *keysize);
+        radix((const char *) mybase + i * elsize, tuple + radixoffset, arg);
+        if(options & MPSORT_ENABLE_STABLE) {
+            uint64_t gindex = start + i;
+            memcpy(tuple + _tuple_gindex_offset(rsize), &gindex, sizeof(gindex));
+        }
+        origin[0] = ThisTask;
+        origin[1] = i;
+    }
+
+    _mpsort_mpi_sort_records(tuples, mynmemb, outtuples, myoutnmemb,
+        *tuplesize, _key_index_radix, trsize, &trsize, comm, options, line, file);
+
+    MPIU_Free(tuples);
+
+    return outtuples;
+}
+
+/* Sort (radix, rank, offset) tuples of the items in place of the items,
+ * and make the plan that moves each item from its origin to its destination. */
+static void
+_plan_create(struct mpsort_mpi_plan * plan,
+        const void * mybase, size_t mynmemb,
+        size_t myoutnmemb,
+        size_t elsize,
+        void (*radix)(const void * ptr, void * radix, void * arg),
+        size_t rsize,
+        void * arg,
+        MPI_Comm comm,
+        int options,
+        const int line,
+        const char * file)
+{
+    size_t keysize, tuplesize;
+
+    char * outtuples = _plan_sort_tuples(mybase, mynmemb, myoutnmemb,
+        elsize, radix, rsize, arg, comm, options, &keysize, &tuplesize, line, file);
+
+    _plan_create_from_tuples(plan, outtuples, myoutnmemb, tuplesize, keysize, comm, options);
+
+    MPIU_Free(outtuples);
+}
+
+/* Move the items in place with a bounded staging buffer: sort the items into the
+ * order of sending, exchange them in place like the bounded histogram sort, then
+ * move each received item to its destination. Uses 8 bytes per item for the permutations. */
+static void
+_plan_apply_in_place(struct mpsort_mpi_plan * plan,
+        void * mybase, size_t elsize,
+        ptrdiff_t * SendCount, ptrdiff_t * SendDispl, ptrdiff_t * SendIndex,
+        ptrdiff_t * RecvCount, ptrdiff_t * RecvDispl, ptrdiff_t * RecvIndex,
+        ptrdiff_t nmemb,
+        MPI_Datatype MPI_TYPE_DATA)
+{
+    struct crstruct d;
+    struct crmpistruct o;
+    memset(&d, 0, sizeof(d));
+    memset(&o, 0, sizeof(o));
+    d.size = elsize;
+    o.MPI_TYPE_DATA = MPI_TYPE_DATA;
+    o.comm = plan->comm;
+    o.mybase = mybase;
+    o.myoutbase = mybase;
+    o.mynmemb = nmemb;
+    o.myoutnmemb = nmemb;
+    o.NTask = plan->NTask;
+    o.ThisTask = plan->ThisTask;
+
+    size_t * perm = MPIU_Malloc("perm", sizeof(size_t), nmemb);
+    if(perm == NULL && nmemb > 0) {
+        _mpsort_mpi_out_of_memory("plan permutation", plan->comm, __LINE__, __FILE__);
+    }
+
+    ptrdiff_t i, j;
+    for(i = 0; i < nmemb; i ++) {
+        perm[i] = SendIndex[i];
+    }
+    _radix_permute(mybase, perm, nmemb, elsize);
+
+    struct piece * pieces;
+    int npieces = _exchange_in_place(&d, &o, SendCount, SendDispl, RecvCount,
+                    plan->policy, plan->max_buffer_bytes, &pieces, __LINE__, __FILE__);
+
+    /* item j of a piece is the item offset + j from source, now at pos + j */
+    int p;
+    for(p = 0; p < npieces; p ++) {
+        for(j = 0; j < pieces[p].nmemb; j ++) {
+            perm[RecvIndex[RecvDispl[pieces[p].source] + pieces[p].offset + j]] = pieces[p].pos + j;
+        }
+    }
+    free(pieces);
+
+    _radix_permute(mybase, perm, nmemb, elsize);
+
+    MPIU_Free(perm);
+}
+
+/* Move the items with the plan; the inverse moves them back from the destination
+ * to the origin. mybase and myoutbase can be the same if the sizes agree.
+ * With max_buffer_bytes, the items move in rounds, each sending a slice
+ * of the items to every rank, such that the send and receive buffers
+ * together hold about max_buffer_bytes; in place, through a staging buffer
+ * of max_buffer_bytes. */
+static void
+_plan_apply(struct mpsort_mpi_plan * plan,
+        const void * mybase, void * myoutbase, size_t elsize, int inverse,
+        struct mpsort_mpi_stats * stats)
+{
+    ptrdiff_t * SendCount = plan->SendCount;
+    ptrdiff_t * SendDispl = plan->SendDispl;
+    ptrdiff_t * SendIndex = plan->SendIndex;
+    ptrdiff_t * RecvCount = plan->RecvCount;
+    ptrdiff_t * RecvDispl = plan->RecvDispl;
+    ptrdiff_t * RecvIndex = plan->RecvIndex;
+    ptrdiff_t nsend = plan->nsend;
+    ptrdiff_t nrecv = plan->nrecv;
+    int NTask = plan->NTask;
+
+    if(inverse) {
+        SendCount = plan->RecvCount;
+        SendDispl = plan->RecvDispl;
+        SendIndex = plan->RecvIndex;
+        RecvCount = plan->SendCount;
+        RecvDispl = plan->SendDispl;
+        RecvIndex = plan->SendIndex;
+        nsend = plan->nrecv;
+        nrecv = plan->nsend;
+    }
+
+    /* the same number of rounds on all ranks */
+    ptrdiff_t nround = 1;
+    if(plan->max_buffer_bytes > 0) {
+        nround = ((nsend + nrecv) * elsize + plan->max_buffer_bytes - 1) / plan->max_buffer_bytes;
+        if(nround < 1) nround = 1;
+        MPI_Allreduce(MPI_IN_PLACE, &nround, 1, MPI_TYPE_PTRDIFF, MPI_MAX, plan->comm);
+    }
+
+    MPI_Datatype MPI_TYPE_DATA;
+    MPI_Type_contiguous(elsize, MPI_BYTE, &MPI_TYPE_DATA);
+    MPI_Type_commit(&MPI_TYPE_DATA);
+
+    /* in place, the items of later rounds would be overwritten by the earlier rounds;
+     * then all ranks exchange in place, which works on a copy in a separate output. */
+    int inplace = nround > 1 && mybase == myoutbase;
+    if(nround > 1) {
+        MPI_Allreduce(MPI_IN_PLACE, &inplace, 1, MPI_INT, MPI_MAX, plan->comm);
+    }
+
+    if(inplace) {
+        if(nsend != nrecv) {
+            fprintf(stderr, "MPSort: a bounded plan applied in place on some ranks "
+                            "needs the same number of items before and after on all ranks.\n");
+            MPI_Abort(plan->comm, -1);
+        }
+        if(mybase != myoutbase) {
+            memcpy(myoutbase, mybase, nsend * elsize);
+        }
+        _plan_apply_in_place(plan, myoutbase, elsize,
+            SendCount, SendDispl, SendIndex, RecvCount, RecvDispl, RecvIndex,
+            nsend, MPI_TYPE_DATA);
+        nround = 0;
+    }
+
+    ptrdiff_t * RoundSendCount = MPIU_Malloc("RoundSendCount", sizeof(ptrdiff_t), NTask);
+    ptrdiff_t * RoundSendDispl = MPIU_Malloc("RoundSendDispl", sizeof(ptrdiff_t), NTask);
+    ptrdiff_t * RoundRecvCount = MPIU_Malloc("RoundRecvCount", sizeof(ptrdiff_t), NTask);
+    ptrdiff_t * RoundRecvDispl = MPIU_Malloc("RoundRecvDispl", sizeof(ptrdiff_t), NTask);
+
+    /* round k moves items [n * k / nround, n * (k + 1) / nround) of the n items of each pair of ranks;
+     * a round holds at most one more item per rank than its share. */
+    ptrdiff_t maxsend = 0;
+    ptrdiff_t maxrecv = 0;
+    if(nround > 0) {
+        maxsend = nsend / nround + NTask;
+        maxrecv = nrecv / nround + NTask;
+        if(maxsend > nsend) maxsend = nsend;
+        if(maxrecv > nrecv) maxrecv = nrecv;
+    }
+
+    char * recvbuf = MPIU_Malloc("recvbuf", elsize, maxrecv);
+    char * sendbuf = MPIU_Malloc("sendbuf", elsize, maxsend);
+
+    ptrdiff_t k;
+    for(k = 0; k < nround; k ++) {
+        ptrdiff_t i, j;
+        int r;
+        ptrdiff_t roundnsend = 0;
+        ptrdiff_t roundnrecv = 0;
+        for(r = 0; r < NTask; r ++) {
+            ptrdiff_t first = SendCount[r] * k / nround;
+            RoundSendCount[r] = SendCount[r] * (k + 1) / nround - first;
+            RoundSendDispl[r] = roundnsend;
+            for(j = 0; j < RoundSendCount[r]; j ++) {
+                i = SendIndex[SendDispl[r] + first + j];
+                memcpy(sendbuf + (roundnsend + j) * elsize, (const char *) mybase + i * elsize, elsize);
+            }
+            roundnsend += RoundSendCount[r];
+
+            RoundRecvCount[r] = RecvCount[r] * (k + 1) / nround - RecvCount[r] * k / nround;
+            RoundRecvDispl[r] = roundnrecv;
+            roundnrecv += RoundRecvCount[r];
+        }
+
+        MPIU_Alltoallv(sendbuf, RoundSendCount, RoundSendDispl, MPI_TYPE_DATA,
+                       recvbuf, RoundRecvCount, RoundRecvDispl, MPI_TYPE_DATA,
+                       plan->comm, plan->policy);
+
+        for(r = 0; r < NTask; r ++) {
+            ptrdiff_t first = RecvCount[r] * k / nround;
+            for(j = 0; j < RoundRecvCount[r]; j ++) {
+                i = RecvIndex[RecvDispl[r] + first + j];
+                memcpy((char *) myoutbase + i * elsize, recvbuf + (RoundRecvDispl[r] + j) * elsize, elsize);
+            }
+        }
+    }
+
+    if(stats) {
+        stats->bytes_sent += (nsend - SendCount[plan->ThisTask]) * elsize;
+        stats->bytes_recv += (nrecv - RecvCount[plan->ThisTask]) * elsize;
+        stats->sparse = MPIU_Alltoallv_was_sparse();
+    }
+
+    MPIU_Free(sendbuf);
+    MPIU_Free(recvbuf);
+    MPIU_Free(RoundRecvDispl);
+    MPIU_Free(RoundRecvCount);
+    MPIU_Free(RoundSendDispl);
+    MPIU_Free(RoundSendCount);
+
+    MPI_Type_free(&MPI_TYPE_DATA);
+}
+
+static void
+_plan_destroy(struct mpsort_mpi_plan * plan)
+{
+    MPIU_Free(plan->SendIndex);
+    MPIU_Free(plan->RecvIndex);
+    MPIU_Free(plan->RecvDispl);
+    MPIU_Free(plan->RecvCount);
+    MPIU_Free(plan->SendDispl);
+    MPIU_Free(plan->SendCount);
+}
+
+/* Sort (radix, rank, offset) tuples instead of the items, then move each item
+ * once from its origin to its destination. The items are only moved by
+ * a single exchange, which is cheaper than the histogram sort when
+ * the items are much larger than the radix. */
+static void
+_mpsort_mpi_sort_key_index(void * mybase, size_t mynmemb,
+        void * myoutbase, size_t myoutnmemb,
+        size_t elsize,
+        void (*radix)(const void * ptr, void * radix, void * arg),
+        size_t rsize,
+        void * arg,
+        MPI_Comm comm,
+        int options,
+        const int line,
+        const char * file)
+{
+    struct mpsort_mpi_plan plan[1];
+
+    _plan_create(plan, mybase, mynmemb, myoutnmemb,
+        elsize, radix, rsize, arg, comm, options, line, file);
+
+    struct TIMER * tmr = _TIMERS + mpsort_mpi_find_ntimers(_TIMERS);
+
+    (tmr->time = MPI_Wtime(), strcpy(tmr->name, "Plan"), tmr++);
+
+    _plan_apply(plan, mybase, myoutbase, elsize, 0, &_mpsort_mpi_stats);
+
+    (tmr->time = MPI_Wtime(), strcpy(tmr->name, "Payload"), tmr++);
+
+    _plan_destroy(plan);
+
+    (tmr->time = MPI_Wtime(), strcpy(tmr->name, "END"), tmr++);
+}
+
+mpsort_mpi_plan *
+mpsort_mpi_plan_create_impl(const void * mybase, size_t mynmemb,
+        size_t myoutnmemb,
+        size_t elsize,
+        void (*radix)(const void * ptr, void * radix, void * arg),
+        size_t rsize,
+        void * arg,
+        MPI_Comm comm,
+        const int line,
+        const char * file)
+{
+    _mpsort_mpi_init_ptrdiff_type(comm);
+    _mpsort_mpi_parse_env();
+
+    size_t allocated = _mpsort_mpi_stats_reset();
+
+    mpsort_mpi_plan * plan = malloc(sizeof(plan[0]));
+
+    _plan_create(plan, mybase, mynmemb, myoutnmemb,
+        elsize, radix, rsize, arg, comm,
+        _mpsort_mpi_options & ~MPSORT_ENABLE_KEY_INDEX_SORT, line, file);
+
+    _mpsort_mpi_stats_finish(allocated);
+
+    return plan;
+}
+
+void
+mpsort_mpi_argsort_impl(const void * mybase, size_t mynmemb,
+        size_t elsize,
+        void (*radix)(const void * ptr, void * radix, void * arg),
+        size_t rsize,
+        void * arg,
+        ptrdiff_t * myout, size_t myoutnmemb,
+        MPI_Comm comm,
+        const int line,
+        const char * file)
+{
+    _mpsort_mpi_init_ptrdiff_type(comm);
+    _mpsort_mpi_parse_env();
+
+    size_t allocated = _mpsort_mpi_stats_reset();
+
+    size_t keysize, tuplesize;
+    int options = (_mpsort_mpi_options & ~MPSORT_ENABLE_KEY_INDEX_SORT) | MPSORT_ENABLE_STABLE;
+
+    char * outtuples = _plan_sort_tuples(mybase, mynmemb, myoutnmemb,
+        elsize, radix, rsize, arg, comm, options, &keysize, &tuplesize, line, file);
+
+    /* the global index is already in the key of a stable tuple */
+    ptrdiff_t i;
+    for(i = 0; i < myoutnmemb; i ++) {
+        uint64_t gindex;
+        memcpy(&gindex, outtuples + i * tuplesize + _tuple_gindex_offset(rsize), sizeof(gindex));
+        myout[i] = gindex;
+    }
+
+    MPIU_Free(outtuples);
+
+    _mpsort_mpi_stats_finish(allocated);
+}
+
+void
+mpsort_mpi_plan_apply(mpsort_mpi_plan * plan,
+        const void * mybase, void * myoutbase, size_t elsize)
+{
+    _plan_apply(plan, mybase, myoutbase, elsize, 0, NULL);
+}
+
+void
+mpsort_mpi_plan_apply_inverse(mpsort_mpi_plan * plan,
+        const void * mybase, void * myoutbase, size_t elsize)
+{
+    _plan_apply(plan, mybase, myoutbase, elsize, 1, NULL);
+}
+
+size_t
+mpsort_mpi_plan_get_nmemb(mpsort_mpi_plan * plan)
+{
+    return plan->nsend;
+}
+
+size_t
+mpsort_mpi_plan_get_outnmemb(mpsort_mpi_plan * plan)
+{
+    return plan->nrecv;
+}
+
+void
+mpsort_mpi_plan_free(mpsort_mpi_plan * plan)
+{
+    _plan_destroy(plan);
+    free(plan);
+}
+
+void
+mpsort_mpi_select_impl(const void * mybase, size_t mynmemb,
+        size_t elsize,
+        void (*radix)(const void * ptr, void * radix, void * arg),
+        size_t rsize,
+        void * arg,
+        const ptrdiff_t * ranks, int nranks,
+        void * out,
+        MPI_Comm comm,
+        const int line,
+        const char * file)
+{
+    _mpsort_mpi_init_ptrdiff_type(comm);
+    _mpsort_mpi_parse_env();
+
+    struct crstruct d;
+    struct crmpistruct o;
+    int i;
+    int k;
+
+    /* the histograms need a sorted local array; the input is not touched,
+     * thus it is sorted in a copy unless it is sorted already. */
+    void * sorted = (void*) mybase;
+    void * copy = NULL;
+    _setup_radix_sort(&d, sorted, mynmemb, elsize, radix, rsize, arg);
+    if(!_is_sorted(sorted, mynmemb, &d)) {
+        copy = MPIU_Malloc("sorted", elsize, mynmemb);
+        if(copy == NULL && mynmemb > 0) {
+            _mpsort_mpi_out_of_memory("sorted copy", comm, line, file);
+        }
+        memcpy(copy, mybase, elsize * mynmemb);
+        radix_sort(copy, mynmemb, elsize, radix, rsize, arg);
+        sorted = copy;
+        d.base = sorted;
+    }
+
+    _setup_mpsort_mpi(&o, &d, NULL, mynmemb, comm, line, file);
+    o.options = _mpsort_mpi_options;
+
+    for(i = 0; i < nranks; i ++) {
+        if(ranks[i] < 0 || ranks[i] >= (ptrdiff_t) o.nmemb) {
+            if(o.ThisTask == 0) {
+                fprintf(stderr, "MPSort: rank %td of select is out of range [0, %td). "
+                                "Caller site: %s:%d\n",
+                                ranks[i], o.nmemb, file, line);
+            }
+            MPI_Abort(comm, -1);
+        }
+    }
+
+    unsigned char Pmax[d.rsize];
+    unsigned char Pmin[d.rsize];
+    /* nranks is up to the caller, thus the arrays of the ranks are not on the stack */
+    unsigned char * P = MPIU_Malloc("P", d.rsize, nranks + 1);
+    unsigned char * Pprev = MPIU_Malloc("Pprev", d.rsize, nranks + 1);
+    unsigned char * Pnext = MPIU_Malloc("Pnext", d.rsize, nranks + 1);
+    ptrdiff_t * Ctask = MPIU_Malloc("Ctask", sizeof(ptrdiff_t), o.NTask + 1);
+    ptrdiff_t * C = MPIU_Malloc("C", sizeof(ptrdiff_t), nranks + 2);
+    ptrdiff_t * myCLT = MPIU_Malloc("myCLT", sizeof(ptrdiff_t), nranks + 2);
+    ptrdiff_t * myCLE = MPIU_Malloc("myCLE", sizeof(ptrdiff_t), nranks + 2);
+    ptrdiff_t * CLT = MPIU_Malloc("CLT", sizeof(ptrdiff_t), nranks + 2);
+    ptrdiff_t * CLE = MPIU_Malloc("CLE", sizeof(ptrdiff_t), nranks + 2);
+    int * owner = MPIU_Malloc("owner", sizeof(int), nranks + 1);
+    size_t runoffset[1] = {0};
+    size_t runnmemb[1] = {mynmemb};
+
+    _find_Pmax_Pmin_C(sorted, runoffset, runnmemb, 1, o.nmemb, mynmemb, Pmax, Pmin, Ctask, &d, &o);
+
+    /* the item at rank r is the solution P of CLT(P) < r + 1 <= CLE(P) */
+    C[0] = 0;
+    for(i = 0; i < nranks; i ++) {
+        C[i + 1] = ranks[i] + 1;
+    }
+    C[nranks + 1] = o.nmemb;
+
+    memset(P, 0, d.rsize * nranks);
+
+    struct piter pi;
+    piter_init(&pi, Pmin, Pmax, nranks, &d);
+
+    if((o.options & MPSORT_ENABLE_INTERPOLATION_SEARCH)) {
+        piter_enable_interpolation(&pi, C);
+    }
+
+    int done = nranks == 0;
+    while(!done) {
+        piter_bisect(&pi, P);
+
+        _histogram_runs(P, nranks, sorted, runoffset, runnmemb, 1, myCLT, myCLE,
+                pi.interpolate ? pi.Pprev : NULL, pi.interpolate ? pi.Pnext : NULL, &d);
+
+        MPI_Allreduce(myCLT, CLT, nranks + 2, MPI_TYPE_PTRDIFF, MPI_SUM, comm);
+        MPI_Allreduce(myCLE, CLE, nranks + 2, MPI_TYPE_PTRDIFF, MPI_SUM, comm);
+
+        if(pi.interpolate) {
+            MPI_Allreduce(MPI_IN_PLACE, pi.Pprev, nranks,
+                    o.MPI_TYPE_RADIX_UINT, MPI_MAX, comm);
+            MPI_Allreduce(MPI_IN_PLACE, pi.Pnext, nranks,
+                    o.MPI_TYPE_RADIX_UINT, MPI_MIN, comm);
+        }
+
+        piter_accept(&pi, P, C, CLT, CLE);
+        done = piter_all_done(&pi);
+    }
+    piter_destroy(&pi);
+
+    /* the last splitter tested after the bracket is narrow may be the item after the solution;
+     * then the solution is the largest item less than the splitter. */
+    _histogram_runs(P, nranks, sorted, runoffset, runnmemb, 1, myCLT, myCLE, Pprev, Pnext, &d);
+    MPI_Allreduce(myCLT, CLT, nranks + 2, MPI_TYPE_PTRDIFF, MPI_SUM, comm);
+
+    unsigned char * eachPprev = MPIU_Malloc("eachPprev", d.rsize * nranks, o.NTask);
+    MPI_Allgather(Pprev, d.rsize * nranks, MPI_BYTE, eachPprev, d.rsize * nranks, MPI_BYTE, comm);
+    for(i = 0; i < nranks; i ++) {
+        if(CLT[i + 1] < C[i + 1]) continue;
+        memset(&P[i * d.rsize], 0, d.rsize);
+        for(k = 0; k < o.NTask; k ++) {
+            unsigned char * r = eachPprev + (k * nranks + i) * d.rsize;
+            if(d.compar(r, &P[i * d.rsize], d.rsize) > 0) {
+                memcpy(&P[i * d.rsize], r, d.rsize);
+            }
+        }
+    }
+    MPIU_Free(eachPprev);
+
+    /* the lowest rank with an item of the solution sends it */
+    for(i = 0; i < nranks; i ++) {
+        ptrdiff_t j = _bsearch_last_lt(&P[i * d.rsize], sorted, mynmemb, &d) + 1;
+        unsigned char r[d.rsize];
+        owner[i] = o.NTask;
+        if(j < (ptrdiff_t) mynmemb) {
+            d.radix((char*) sorted + j * elsize, r, d.arg);
+            if(d.compar(r, &P[i * d.rsize], d.rsize) == 0) {
+                owner[i] = o.ThisTask;
+                memcpy((char*) out + i * elsize, (char*) sorted + j * elsize, elsize);
+            }
+        }
+    }
+    MPI_Allreduce(MPI_IN_PLACE, owner, nranks, MPI_INT, MPI_MIN, comm);
+    for(i = 0; i < nranks; i ++) {
+        if(owner[i] != o.ThisTask) {
+            memset((char*) out + i * elsize, 0, elsize);
+        }
+    }
+    /* every item has one owner, the others contribute zeros */
+    MPI_Allreduce(MPI_IN_PLACE, out, elsize * nranks, MPI_BYTE, MPI_BOR, comm);
+
+    MPIU_Free(owner);
+    MPIU_Free(CLE);
+    MPIU_Free(CLT);
+    MPIU_Free(myCLE);
+    MPIU_Free(myCLT);
+    MPIU_Free(C);
+    MPIU_Free(Ctask);
+    MPIU_Free(Pnext);
+    MPIU_Free(Pprev);
+    MPIU_Free(P);
+    _destroy_mpsort_mpi(&o);
+    if(copy)
+        MPIU_Free(copy);
+}
+
+/* number of runs of the local array in the pipelined mode */
+#define MPSORT_PIPELINE_NRUN 8
+
+/* The pipelined mode needs a second copy of the local array, and the splitter sampling needs
+ * the local array sorted as a whole. */
+static int
+_mpsort_mpi_can_pipeline(struct crmpistruct * o)
+{
+    if(!(o->options & MPSORT_ENABLE_PIPELINE)) return 0;
+    if((o->options & MPSORT_ENABLE_SPLITTER_SAMPLING)) return 0;
+    if(_mpsort_mpi_max_buffer_bytes > 0) return 0;
+    return 1;
+}
+
+/* returns true if a second thread may run beside the thread calling MPI */
+static int
+_mpsort_mpi_thread_funneled()
+{
+    int provided;
+    MPI_Query_thread(&provided);
+    return provided >= MPI_THREAD_FUNNELED;
+}
+
+/* the counts of the sorted runs of mybase; the counts of run r are also kept at
+ * runCLT + r * (Plength + 2) and runCLE + r * (Plength + 2), for _neighbours_runs. */
+static void
+_counts_runs(unsigned char * P, int Plength, void * mybase,
+        const size_t * runoffset, const size_t * runnmemb, int nrun,
+        ptrdiff_t * runCLT, ptrdiff_t * runCLE,
+        ptrdiff_t * myCLT, ptrdiff_t * myCLE,
+        struct crstruct * d)
+{
+    int i;
+    int r;
+
+    memset(myCLT, 0, sizeof(ptrdiff_t) * (Plength + 2));
+    memset(myCLE, 0, sizeof(ptrdiff_t) * (Plength + 2));
+    for(r = 0; r < nrun; r ++) {
+        void * base = (char*) mybase + runoffset[r] * d->size;
+        ptrdiff_t * CLT = runCLT + r * (Plength + 2);
+        ptrdiff_t * CLE = runCLE + r * (Plength + 2);
+        _histogram(P, Plength, base, runnmemb[r], CLT, CLE, d);
+        for(i = 0; i < Plength + 2; i ++) {
+            myCLT[i] += CLT[i];
+            myCLE[i] += CLE[i];
+        }
+    }
+}
+
+/* the neighbours of the splitters in the sorted runs of mybase, from the counts of
+ * each run by _counts_runs; see _histogram_neighbours. */
+static void
+_neighbours_runs(int Plength, void * mybase,
+        const size_t * runoffset, const size_t * runnmemb, int nrun,
+        ptrdiff_t * runCLT, ptrdiff_t * runCLE,
+        unsigned char * Pprev, unsigned char * Pnext,
+        struct crstruct * d)
+{
+    unsigned char * runPprev = malloc(d->rsize * Plength + 1);
+    unsigned char * runPnext = malloc(d->rsize * Plength + 1);
+    int i;
+    int r;
+
+    memset(Pprev, 0, d->rsize * Plength);
+    memset(Pnext, -1, d->rsize * Plength);
+    for(r = 0; r < nrun; r ++) {
+        void * base = (char*) mybase + runoffset[r] * d->size;
+        _histogram_neighbours(Plength, base, runnmemb[r],
+                runCLT + r * (Plength + 2), runCLE + r * (Plength + 2), runPprev, runPnext, d);
+        for(i = 0; i < Plength; i ++) {
+            if(d->compar(&runPprev[i * d->rsize], &Pprev[i * d->rsize], d->rsize) > 0)
+                memcpy(&Pprev[i * d->rsize], &runPprev[i * d->rsize], d->rsize);
+            if(d->compar(&runPnext[i * d->rsize], &Pnext[i * d->rsize], d->rsize) < 0)
+                memcpy(&Pnext[i * d->rsize], &runPnext[i * d->rsize], d->rsize);
+        }
+    }
+    free(runPnext);
+    free(runPprev);
+}
+
+/* the histogram of the sorted runs of mybase; see _histogram and _histogram_neighbours.
+ * Pprev and Pnext are not computed if NULL. */
+static void
+_histogram_runs(unsigned char * P, int Plength, void * mybase,
+        const size_t * runoffset, const size_t * runnmemb, int nrun,
+        ptrdiff_t * myCLT, ptrdiff_t * myCLE,
+        unsigned char * Pprev, unsigned char * Pnext,
+        struct crstruct * d)
+{
+    if(nrun == 1) {
+        void * base = (char*) mybase + runoffset[0] * d->size;
+        _histogram(P, Plength, base, runnmemb[0], myCLT, myCLE, d);
+        if(Pprev)
+            _histogram_neighbours(Plength, base, runnmemb[0], myCLT, myCLE, Pprev, Pnext, d);
+        return;
+    }
 
-    /* group comm == seg comm */
+    ptrdiff_t * runCLT = malloc(sizeof(ptrdiff_t) * nrun * (Plength + 2));
+    ptrdiff_t * runCLE = malloc(sizeof(ptrdiff_t) * nrun * (Plength + 2));
 
-    void * mysegmentbase = NULL;
-    void * myoutsegmentbase = NULL;
-    size_t mysegmentnmemb;
-    size_t myoutsegmentnmemb;
+    _counts_runs(P, Plength, mybase, runoffset, runnmemb, nrun, runCLT, runCLE, myCLT, myCLE, d);
+    if(Pprev)
+        _neighbours_runs(Plength, mybase, runoffset, runnmemb, nrun, runCLT, runCLE, Pprev, Pnext, d);
 
-    int groupsize;
-    int grouprank;
-    MPI_Comm_size(segmenter->Group, &groupsize);
-    MPI_Comm_rank(segmenter->Group, &grouprank);
+    free(runCLE);
+    free(runCLT);
+}
 
-    MPI_Allreduce(&mynmemb, &mysegmentnmemb, 1, MPI_TYPE_PTRDIFF, MPI_SUM, segmenter->Group);
-    MPI_Allreduce(&myoutnmemb, &myoutsegmentnmemb, 1, MPI_TYPE_PTRDIFF, MPI_SUM, segmenter->Group);
+/* with MPSORT_ENABLE_INCREMENTAL at most 1 / MPSORT_INCREMENTAL_MAXFRAC of the local array
+ * is moved aside by the adaptive local sort; otherwise it is radix sorted */
+#define MPSORT_INCREMENTAL_MAXFRAC 8
 
-    if (groupsize > 1) {
-        if(grouprank == segmenter->group_leader_rank) {
-            mysegmentbase = MPIU_Malloc("mysegment", elsize, mysegmentnmemb);
-            myoutsegmentbase = MPIU_Malloc("outsegment", elsize, myoutsegmentnmemb);
-        }
-        MPIU_Gather(segmenter->Group, segmenter->group_leader_rank, mybase, mysegmentbase, mynmemb, elsize, NULL);
-    } else {
-        mysegmentbase = mybase;
-        myoutsegmentbase = myoutbase;
+/* subtract one from a radix of an unsigned integer, saturating at zero */
+static void
+_radix_uint_decrement(unsigned char * r, size_t rsize)
+{
+    uint16_t u2;
+    uint32_t u4;
+    uint64_t u8;
+    switch(rsize) {
+        case 2: memcpy(&u2, r, 2); if(u2 > 0) u2 --; memcpy(r, &u2, 2); break;
+        case 4: memcpy(&u4, r, 4); if(u4 > 0) u4 --; memcpy(r, &u4, 4); break;
+        case 8: memcpy(&u8, r, 8); if(u8 > 0) u8 --; memcpy(r, &u8, 8); break;
     }
+}
 
-    /* only do sorting on the group leaders for each segment */
-    if(segmenter->is_group_leader) {
+/*
+ * Bracket the splitters with the splitters of the last sort.
+ *
+ * The counts of the last splitters are computed once; a splitter that still
+ * satisfies CLT < C <= CLE is accepted as is. Otherwise the last splitter
+ * bounds the solution from one side. If the local array is a single sorted run
+ * and the radix is an integer, the other side is bounded by the item
+ * C - CLE (or CLT - C + 1) items beyond the last splitter on each rank:
+ * the solution is at most (at least) the smallest (largest) of these items.
+ * Thus when few items have crossed the splitters, the bracket is narrow.
+ * */
+static void
+_find_P_brackets_by_last_splitters(unsigned char * P, ptrdiff_t * C,
+        struct piter * pi, void * mybase,
+        const size_t * runoffset, const size_t * runnmemb, int nrun,
+        struct crstruct * d,
+        struct crmpistruct * o)
+{
+    const int Plength = o->NTask - 1;
+    int i;
 
-        struct crstruct d;
-        struct crmpistruct o;
+    int valid = _mpsort_mpi_last_splitters.P != NULL
+             && _mpsort_mpi_last_splitters.rsize == d->rsize
+             && _mpsort_mpi_last_splitters.NTask == o->NTask;
 
-        _setup_radix_sort(&d, mysegmentbase, mysegmentnmemb, elsize, radix, rsize, arg);
+    /* the ranks may disagree if they have not taken part in the same sorts. */
+    MPI_Allreduce(MPI_IN_PLACE, &valid, 1, MPI_INT, MPI_LAND, o->comm);
 
-        _setup_mpsort_mpi(&o, &d, myoutsegmentbase, myoutsegmentnmemb, segmenter->Leaders, line, file);
+    if(!valid || Plength == 0) return;
 
-        mpsort_mpi_histogram_sort(d, o, tmr, line, file);
+    unsigned char * Plast = _mpsort_mpi_last_splitters.P;
+    ptrdiff_t myCLT[Plength + 2];
+    ptrdiff_t myCLE[Plength + 2];
+    ptrdiff_t CLT[Plength + 2];
+    ptrdiff_t CLE[Plength + 2];
 
-        _destroy_mpsort_mpi(&o);
-    }
+    _histogram_runs(Plast, Plength, mybase, runoffset, runnmemb, nrun, myCLT, myCLE, NULL, NULL, d);
 
-    if(groupsize > 1) {
-        MPIU_Scatter(segmenter->Group, segmenter->group_leader_rank, myoutsegmentbase, myoutbase, myoutnmemb, elsize, NULL);
-    }
+    MPI_Allreduce(myCLT, CLT, Plength + 2, MPI_TYPE_PTRDIFF, MPI_SUM, o->comm);
+    MPI_Allreduce(myCLE, CLE, Plength + 2, MPI_TYPE_PTRDIFF, MPI_SUM, o->comm);
 
-    {
-        int ntmr;
-        if(segmenter->is_group_leader)
-            ntmr = (mpsort_mpi_find_ntimers(tmr) + 1);
+    int bound = nrun == 1 && o->MPI_TYPE_RADIX_UINT != MPI_DATATYPE_NULL;
 
-        MPI_Bcast(&ntmr, 1, MPI_INT, segmenter->group_leader_rank, segmenter->Group);
-        MPI_Bcast(tmr, sizeof(tmr[0]) * ntmr, MPI_BYTE, segmenter->group_leader_rank, segmenter->Group);
-    }
+    unsigned char Pbound[d->rsize * (Plength + 1)];
 
-    if(grouprank == segmenter->group_leader_rank) {
-        if(mysegmentbase != mybase)
-            MPIU_Free(mysegmentbase);
-        if(myoutsegmentbase != myoutbase)
-            MPIU_Free(myoutsegmentbase);
+    for(i = 0; i < Plength; i ++) {
+        unsigned char * Pi = &Plast[i * d->rsize];
+        unsigned char * Pb = &Pbound[i * d->rsize];
+        if(CLT[i + 1] < C[i + 1] && C[i + 1] <= CLE[i + 1]) {
+            memcpy(&P[i * d->rsize], Pi, d->rsize);
+            pi->stable[i] = 1;
+            memset(Pb, 0, d->rsize);
+        } else if(CLT[i + 1] >= C[i + 1]) {
+            /* the largest item at least CLT - C + 1 items before the splitter */
+            ptrdiff_t k = myCLT[i + 1] - (CLT[i + 1] - C[i + 1] + 1);
+            if(k >= 0 && k < (ptrdiff_t) o->mynmemb) {
+                d->radix((char*) mybase + k * d->size, Pb, d->arg);
+            } else {
+                memset(Pb, 0, d->rsize);
+            }
+        } else {
+            /* the smallest item at least C - CLE items after the splitter */
+            ptrdiff_t k = myCLE[i + 1] + (C[i + 1] - CLE[i + 1]) - 1;
+            if(k >= 0 && k < (ptrdiff_t) o->mynmemb) {
+                d->radix((char*) mybase + k * d->size, Pb, d->arg);
+            } else {
+                memset(Pb, -1, d->rsize);
+            }
+        }
     }
 
-    MPIU_Segmenter_destroy(segmenter);
+    if(bound) {
+        /* reduce both directions at once; the items below the splitter are bit-flipped,
+         * such that MIN finds the largest of them. */
+        for(i = 0; i < Plength; i ++) {
+            if(CLT[i + 1] >= C[i + 1]) {
+                size_t j;
+                for(j = 0; j < d->rsize; j ++) Pbound[i * d->rsize + j] ^= 0xff;
+            }
+        }
+        MPI_Allreduce(MPI_IN_PLACE, Pbound, Plength, o->MPI_TYPE_RADIX_UINT, MPI_MIN, o->comm);
+        for(i = 0; i < Plength; i ++) {
+            if(CLT[i + 1] >= C[i + 1]) {
+                size_t j;
+                for(j = 0; j < d->rsize; j ++) Pbound[i * d->rsize + j] ^= 0xff;
+                /* the item may be the solution, but Pleft shall be less than the solution */
+                _radix_uint_decrement(&Pbound[i * d->rsize], d->rsize);
+            }
+        }
+    }
 
-    uint64_t sum2 = checksum(myoutbase, elsize * myoutnmemb, comm);
-    if (sum1 != sum2) {
-        fprintf(stderr, "MPSort: Data changed after sorting; checksum mismatch. "
-                        "Caller site: %s:%d\n",
-                        file, line);
-        MPI_Abort(comm, -1);
+    for(i = 0; i < Plength; i ++) {
+        unsigned char * Pi = &Plast[i * d->rsize];
+        unsigned char * Pb = &Pbound[i * d->rsize];
+        unsigned char * Pleft = &pi->Pleft[i * d->rsize];
+        unsigned char * Pright = &pi->Pright[i * d->rsize];
+        if(pi->stable[i]) continue;
+        /* only narrow the bracket, which may come from the sampling */
+        if(CLT[i + 1] >= C[i + 1]) {
+            if(d->compar(Pi, Pright, d->rsize) < 0) {
+                memcpy(Pright, Pi, d->rsize);
+                pi->CLTright[i] = CLT[i + 1];
+            }
+            if(bound && d->compar(Pb, Pleft, d->rsize) > 0 && d->compar(Pb, Pright, d->rsize) <= 0) {
+                memcpy(Pleft, Pb, d->rsize);
+                pi->CLEleft[i] = -1;
+            }
+        } else {
+            if(d->compar(Pi, Pleft, d->rsize) > 0) {
+                memcpy(Pleft, Pi, d->rsize);
+                pi->CLEleft[i] = CLE[i + 1];
+            }
+            if(bound && d->compar(Pb, Pright, d->rsize) < 0 && d->compar(Pb, Pleft, d->rsize) >= 0) {
+                memcpy(Pright, Pb, d->rsize);
+                pi->CLTright[i] = -1;
+            }
+        }
     }
 }
 
@@ -348,10 +1715,10 @@ mpsort_mpi_histogram_sort(struct crstruct d, struct crmpistruct o, struct TIMER
     ptrdiff_t myCLE[o.NTask + 1]; /* counts of less than or equal to P */
     ptrdiff_t CLE[o.NTask + 1];
 
-    int SendCount[o.NTask];
-    int SendDispl[o.NTask];
-    int RecvCount[o.NTask];
-    int RecvDispl[o.NTask];
+    ptrdiff_t SendCount[o.NTask];
+    ptrdiff_t SendDispl[o.NTask];
+    ptrdiff_t RecvCount[o.NTask];
+    ptrdiff_t RecvDispl[o.NTask];
 
     ptrdiff_t myT_CLT[o.NTask];
     ptrdiff_t myT_CLE[o.NTask];
@@ -365,14 +1732,32 @@ mpsort_mpi_histogram_sort(struct crstruct d, struct crmpistruct o, struct TIMER
 
     (tmr->time = MPI_Wtime(), strcpy(tmr->name, "START"), tmr++);
 
-    /* and sort the local array */
-    radix_sort(d.base, d.nmemb, d.size, d.radix, d.rsize, d.arg);
+    /* with MPSORT_ENABLE_PIPELINE the local array is sorted in runs; the runs are merged
+     * by a second thread while the splitters are searched with the histograms of the runs. */
+    int pipeline = _mpsort_mpi_can_pipeline(&o);
+    int nrun = pipeline ? MPSORT_PIPELINE_NRUN : 1;
+    size_t runoffset[MPSORT_PIPELINE_NRUN];
+    size_t runnmemb[MPSORT_PIPELINE_NRUN];
+    char * merged = NULL;
+
+    for(i = 0; i < nrun; i ++) {
+        runoffset[i] = o.mynmemb * i / nrun;
+        runnmemb[i] = o.mynmemb * (i + 1) / nrun - runoffset[i];
+        /* and sort the local array */
+        if((o.options & MPSORT_ENABLE_INCREMENTAL)) {
+            _radix_sort_nearly_sorted(&d, (char*) d.base + runoffset[i] * d.size, runnmemb[i],
+                MPSORT_INCREMENTAL_MAXFRAC);
+        } else {
+            radix_sort((char*) d.base + runoffset[i] * d.size, runnmemb[i], d.size, d.radix, d.rsize, d.arg);
+        }
+    }
 
-    MPI_Barrier(o.comm);
+    if(!pipeline)
+        MPI_Barrier(o.comm);
 
     (tmr->time = MPI_Wtime(), strcpy(tmr->name, "FirstSort"), tmr++);
 
-    _find_Pmax_Pmin_C(o.mybase, o.mynmemb, o.nmemb, o.myoutnmemb, Pmax, Pmin, C, &d, &o);
+    _find_Pmax_Pmin_C(o.mybase, runoffset, runnmemb, nrun, o.nmemb, o.myoutnmemb, Pmax, Pmin, C, &d, &o);
 
     (tmr->time = MPI_Wtime(), strcpy(tmr->name, "PmaxPmin"), tmr++);
 
@@ -382,18 +1767,100 @@ mpsort_mpi_histogram_sort(struct crstruct d, struct crmpistruct o, struct TIMER
 
     piter_init(&pi, Pmin, Pmax, o.NTask - 1, &d);
 
+    if((o.options & MPSORT_ENABLE_SPLITTER_SAMPLING)) {
+        _find_P_brackets_by_sampling(C, pi.Pleft, pi.Pright, pi.CLEleft, pi.CLTright, &d, &o);
+        (tmr->time = MPI_Wtime(), strcpy(tmr->name, "Sample"), tmr++);
+    }
+
+    if((o.options & MPSORT_ENABLE_INCREMENTAL)) {
+        _find_P_brackets_by_last_splitters(P, C, &pi, o.mybase, runoffset, runnmemb, nrun, &d, &o);
+        /* no search if all of the last splitters are still good */
+        done = piter_all_done(&pi);
+        (tmr->time = MPI_Wtime(), strcpy(tmr->name, "LastSplitters"), tmr++);
+    }
+
+    /* the sampled brackets come with bounds of the counts; interpolating inside them
+     * takes a few rounds where bisecting the remaining bits of the radix would take many. */
+    if((o.options & (MPSORT_ENABLE_INTERPOLATION_SEARCH | MPSORT_ENABLE_SPLITTER_SAMPLING))) {
+        piter_enable_interpolation(&pi, C);
+    }
+
+    int mergefailed = 0;
+    ptrdiff_t * runCLT = NULL;
+    ptrdiff_t * runCLE = NULL;
+    if(pipeline) {
+        merged = MPIU_Malloc("merged", d.size, o.mynmemb);
+        if(merged == NULL && o.mynmemb > 0) {
+            _mpsort_mpi_out_of_memory("merge buffer", o.comm, line, file);
+        }
+        runCLT = malloc(sizeof(ptrdiff_t) * nrun * (o.NTask + 1));
+        runCLE = malloc(sizeof(ptrdiff_t) * nrun * (o.NTask + 1));
+    }
+
+    /* the first thread searches the splitters, and is the only one calling MPI;
+     * without a second thread the runs are merged first. */
+#pragma omp parallel num_threads(2) if(pipeline && _mpsort_mpi_thread_funneled())
+    {
+#ifdef _OPENMP
+    int tid = omp_get_thread_num();
+    int nthreads = omp_get_num_threads();
+#else
+    int tid = 0;
+    int nthreads = 1;
+#endif
+    if(pipeline && tid == nthreads - 1) {
+        struct crstruct dmerge = d;
+        /* the threads of the merge would compete with the splitter search */
+        if(nthreads > 1) dmerge.nthreads = 1;
+        mergefailed = _radix_merge(d.base, runoffset, runnmemb, nrun, merged, &dmerge);
+    }
+    if(tid == 0)
     while(!done) {
         iter ++;
         piter_bisect(&pi, P);
 
-        _histogram(P, o.NTask - 1, o.mybase, o.mynmemb, myCLT, myCLE, &d);
-
-        MPI_Allreduce(myCLT, CLT, o.NTask + 1,
-                MPI_TYPE_PTRDIFF, MPI_SUM, o.comm);
-        MPI_Allreduce(myCLE, CLE, o.NTask + 1,
-                MPI_TYPE_PTRDIFF, MPI_SUM, o.comm);
+#if MPI_VERSION >= 3
+        if(pipeline) {
+            /* the neighbours of the splitters are found while the counts are reduced */
+            MPI_Request requests[4];
+            int nrequests = 2;
+            _counts_runs(P, o.NTask - 1, o.mybase, runoffset, runnmemb, nrun,
+                    runCLT, runCLE, myCLT, myCLE, &d);
+            MPI_Iallreduce(myCLT, CLT, o.NTask + 1,
+                    MPI_TYPE_PTRDIFF, MPI_SUM, o.comm, &requests[0]);
+            MPI_Iallreduce(myCLE, CLE, o.NTask + 1,
+                    MPI_TYPE_PTRDIFF, MPI_SUM, o.comm, &requests[1]);
+            if(pi.interpolate) {
+                _neighbours_runs(o.NTask - 1, o.mybase, runoffset, runnmemb, nrun,
+                        runCLT, runCLE, pi.Pprev, pi.Pnext, &d);
+                MPI_Iallreduce(MPI_IN_PLACE, pi.Pprev, o.NTask - 1,
+                        o.MPI_TYPE_RADIX_UINT, MPI_MAX, o.comm, &requests[2]);
+                MPI_Iallreduce(MPI_IN_PLACE, pi.Pnext, o.NTask - 1,
+                        o.MPI_TYPE_RADIX_UINT, MPI_MIN, o.comm, &requests[3]);
+                nrequests = 4;
+            }
+            MPI_Waitall(nrequests, requests, MPI_STATUSES_IGNORE);
+        } else
+#endif
+        {
+            _histogram_runs(P, o.NTask - 1, o.mybase, runoffset, runnmemb, nrun, myCLT, myCLE,
+                    pi.interpolate ? pi.Pprev : NULL, pi.interpolate ? pi.Pnext : NULL, &d);
+
+            MPI_Allreduce(myCLT, CLT, o.NTask + 1,
+                    MPI_TYPE_PTRDIFF, MPI_SUM, o.comm);
+            MPI_Allreduce(myCLE, CLE, o.NTask + 1,
+                    MPI_TYPE_PTRDIFF, MPI_SUM, o.comm);
+
+            if(pi.interpolate) {
+                MPI_Allreduce(MPI_IN_PLACE, pi.Pprev, o.NTask - 1,
+                        o.MPI_TYPE_RADIX_UINT, MPI_MAX, o.comm);
+                MPI_Allreduce(MPI_IN_PLACE, pi.Pnext, o.NTask - 1,
+                        o.MPI_TYPE_RADIX_UINT, MPI_MIN, o.comm);
+            }
+        }
 
-        (iter>10?tmr--:0, tmr->time = MPI_Wtime(), sprintf(tmr->name, "bisect%04d", iter), tmr++);
+        /* a timer per iteration; the iterations beyond the room in _TIMERS share the last timer. */
+        (iter>400?tmr--:0, tmr->time = MPI_Wtime(), sprintf(tmr->name, "bisect%04d", iter), tmr++);
 
         piter_accept(&pi, P, C, CLT, CLE);
 #if 0
@@ -435,9 +1902,39 @@ mpsort_mpi_histogram_sort(struct crstruct d, struct crmpistruct o, struct TIMER
 #endif
         done = piter_all_done(&pi);
     }
+    }
 
     piter_destroy(&pi);
 
+    if((o.options & MPSORT_ENABLE_INCREMENTAL)) {
+        _mpsort_mpi_last_splitters.P = realloc(_mpsort_mpi_last_splitters.P, d.rsize * o.NTask);
+        memcpy(_mpsort_mpi_last_splitters.P, P, d.rsize * (o.NTask - 1));
+        _mpsort_mpi_last_splitters.rsize = d.rsize;
+        _mpsort_mpi_last_splitters.NTask = o.NTask;
+    }
+
+    if(mergefailed) {
+        _mpsort_mpi_out_of_memory("merge tree", o.comm, line, file);
+    }
+
+    if(pipeline) {
+        free(runCLE);
+        free(runCLT);
+        if(d.size > sizeof(size_t)) {
+            /* large items are sent from the merged runs and received into myoutbase,
+             * which is thus free to be d.base; no copy back. */
+            o.mybase = merged;
+        } else {
+            /* small items are received into a buffer; do not keep both */
+            memcpy(d.base, merged, d.size * o.mynmemb);
+            MPIU_Free(merged);
+            merged = NULL;
+        }
+        (tmr->time = MPI_Wtime(), strcpy(tmr->name, "FirstMerge"), tmr++);
+    }
+
+    _mpsort_mpi_stats.niter = iter;
+
     _histogram(P, o.NTask - 1, o.mybase, o.mynmemb, myCLT, myCLE, &d);
 
     (tmr->time = MPI_Wtime(), strcpy(tmr->name, "findP"), tmr++);
@@ -484,8 +1981,8 @@ mpsort_mpi_histogram_sort(struct crstruct d, struct crmpistruct o, struct TIMER
         SendCount[i] = myC[i + 1] - myC[i];
     }
 
-    MPI_Alltoall(SendCount, 1, MPI_INT,
-            RecvCount, 1, MPI_INT, o.comm);
+    MPI_Alltoall(SendCount, 1, MPI_TYPE_PTRDIFF,
+            RecvCount, 1, MPI_TYPE_PTRDIFF, o.comm);
 
     SendDispl[0] = 0;
     RecvDispl[0] = 0;
@@ -508,6 +2005,9 @@ mpsort_mpi_histogram_sort(struct crstruct d, struct crmpistruct o, struct TIMER
                         file, line);
         MPI_Abort(o.comm, -1);
     }
+
+    _mpsort_mpi_stats.bytes_sent += (o.mynmemb - SendCount[o.ThisTask]) * d.size;
+    _mpsort_mpi_stats.bytes_recv += (o.myoutnmemb - RecvCount[o.ThisTask]) * d.size;
 #if 0
     {
         int k;
@@ -568,42 +2068,349 @@ mpsort_mpi_histogram_sort(struct crstruct d, struct crmpistruct o, struct TIMER
         }
     }
 #endif
-    if(o.myoutbase == o.mybase)
-        buffer = (char *) MPIU_Malloc("buffer", d.size, o.myoutnmemb);
-    else
-        buffer = o.myoutbase;
-
     enum MPIU_AlltoallvSparsePolicy policy = AUTO;
-    if (mpsort_mpi_has_options(MPSORT_DISABLE_SPARSE_ALLTOALLV)) {
+    if ((o.options & MPSORT_DISABLE_SPARSE_ALLTOALLV)) {
         policy = DISABLED;
     }
-    if (mpsort_mpi_has_options(MPSORT_REQUIRE_SPARSE_ALLTOALLV)) {
+    if ((o.options & MPSORT_REQUIRE_SPARSE_ALLTOALLV)) {
         policy = REQUIRED;
     }
+    if ((o.options & MPSORT_REQUIRE_HIERARCHICAL_ALLTOALLV)) {
+        policy = HIERARCHICAL;
+    }
+
+    /* without a separate output the received runs are merged from a buffer into myoutbase;
+     * with one, large items are received into myoutbase and merged in place with
+     * a permutation, which is smaller than a buffer. */
+    int direct = o.mybase != o.myoutbase && d.size > sizeof(size_t);
+
+    if(_mpsort_mpi_max_buffer_bytes == 0 && !direct) {
+        buffer = (char *) MPIU_Malloc("buffer", d.size, o.myoutnmemb);
+        if(buffer == NULL && o.myoutnmemb > 0) {
+            _mpsort_mpi_out_of_memory("receive buffer", o.comm, line, file);
+        }
 
-    MPIU_Alltoallv(
-            o.mybase, SendCount, SendDispl, o.MPI_TYPE_DATA,
-            buffer, RecvCount, RecvDispl, o.MPI_TYPE_DATA,
-            o.comm, policy);
+        MPIU_Alltoallv(
+                o.mybase, SendCount, SendDispl, o.MPI_TYPE_DATA,
+                buffer, RecvCount, RecvDispl, o.MPI_TYPE_DATA,
+                o.comm, policy);
 
-    if(o.myoutbase == o.mybase) {
-        memcpy(o.myoutbase, buffer, o.myoutnmemb * d.size);
+        if(!pipeline)
+            MPI_Barrier(o.comm);
+        (tmr->time = MPI_Wtime(), strcpy(tmr->name, "Exchange"), tmr++);
+
+        /* every sender has sorted its data in FirstSort, so the data from each
+         * sender is a sorted run; merge the runs instead of sorting again. */
+        {
+            size_t runoffset[o.NTask];
+            size_t runnmemb[o.NTask];
+            for(i = 0; i < o.NTask; i ++) {
+                runoffset[i] = RecvDispl[i];
+                runnmemb[i] = RecvCount[i];
+            }
+            if(0 != _radix_merge(buffer, runoffset, runnmemb, o.NTask, o.myoutbase, &d)) {
+                _mpsort_mpi_out_of_memory("merge tree", o.comm, line, file);
+            }
+        }
         MPIU_Free(buffer);
+    } else {
+        /* no full size buffer: the runs arrive in pieces in myoutbase,
+         * or as a whole if myoutbase is separate, and are merged in place. */
+        struct piece * pieces;
+        int npieces;
+        /* the exchange in place is a different collective; take it only if every rank can. */
+        int inplace = o.mybase == o.myoutbase && o.mynmemb == o.myoutnmemb;
+        MPI_Allreduce(MPI_IN_PLACE, &inplace, 1, MPI_INT, MPI_MIN, o.comm);
+        if(inplace) {
+            npieces = _exchange_in_place(&d, &o, SendCount, SendDispl, RecvCount,
+                        policy, _mpsort_mpi_max_buffer_bytes, &pieces, line, file);
+        } else {
+            /* a rank sorting in place among ranks that do not sends from a copy */
+            char * sendbase = o.mybase;
+            if(o.mybase == o.myoutbase) {
+                sendbase = (char *) MPIU_Malloc("sendbuffer", d.size, o.mynmemb);
+                if(sendbase == NULL && o.mynmemb > 0) {
+                    _mpsort_mpi_out_of_memory("send buffer", o.comm, line, file);
+                }
+                memcpy(sendbase, o.mybase, o.mynmemb * d.size);
+            }
+            MPIU_Alltoallv(
+                    sendbase, SendCount, SendDispl, o.MPI_TYPE_DATA,
+                    o.myoutbase, RecvCount, RecvDispl, o.MPI_TYPE_DATA,
+                    o.comm, policy);
+            if(sendbase != o.mybase) {
+                MPIU_Free(sendbase);
+            }
+            npieces = o.NTask;
+            pieces = malloc(sizeof(struct piece) * npieces);
+            for(i = 0; i < o.NTask; i ++) {
+                pieces[i].source = i;
+                pieces[i].offset = 0;
+                pieces[i].pos = RecvDispl[i];
+                pieces[i].nmemb = RecvCount[i];
+            }
+        }
+
+        if(!pipeline)
+            MPI_Barrier(o.comm);
+        (tmr->time = MPI_Wtime(), strcpy(tmr->name, "Exchange"), tmr++);
+
+        if(0 != _merge_pieces_in_place(&d, o.myoutbase, o.myoutnmemb, pieces, npieces)) {
+            _mpsort_mpi_out_of_memory("merge permutation", o.comm, line, file);
+        }
+        free(pieces);
     }
 
-    MPI_Barrier(o.comm);
-    (tmr->time = MPI_Wtime(), strcpy(tmr->name, "Exchange"), tmr++);
+    _mpsort_mpi_stats.sparse = MPIU_Alltoallv_was_sparse();
 
-    radix_sort(o.myoutbase, o.myoutnmemb, d.size, d.radix, d.rsize, d.arg);
+    if(merged) {
+        MPIU_Free(merged);
+    }
 
-    MPI_Barrier(o.comm);
+    if(!pipeline)
+        MPI_Barrier(o.comm);
     (tmr->time = MPI_Wtime(), strcpy(tmr->name, "SecondSort"), tmr++);
 
     (tmr->time = MPI_Wtime(), strcpy(tmr->name, "END"), tmr++);
     return 0;
 }
 
-static void _find_Pmax_Pmin_C(void * mybase, size_t mynmemb,
+/* a growing array of pieces */
+struct piece_list {
+    struct piece * p;
+    int n;
+    int size;
+};
+
+static void _piece_list_append(struct piece_list * l, int source, ptrdiff_t offset, ptrdiff_t pos, ptrdiff_t nmemb) {
+    if(l->n == l->size) {
+        l->size = l->size * 2 + 16;
+        l->p = realloc(l->p, sizeof(struct piece) * l->size);
+    }
+    l->p[l->n].source = source;
+    l->p[l->n].offset = offset;
+    l->p[l->n].pos = pos;
+    l->p[l->n].nmemb = nmemb;
+    l->n ++;
+}
+
+/*
+ * The exchange when the output replaces the input, in rounds that
+ * receive at most max_buffer_bytes into a staging buffer.
+ *
+ * Every receiver grants each of its senders a share of the free staging
+ * space; the senders send the granted items directly from mybase.
+ * The items sent in a round leave holes in mybase, which are then
+ * filled with the staged items. Items that do not fit into the holes
+ * stay staged for the next round. There is always a rank with free
+ * staging space and pending receives, since the total number of holes
+ * equals the total number of staged items.
+ *
+ * The piece that stays on this rank is not moved.
+ * Returns the number of pieces stored in *pieces (free with free).
+ * */
+static int _exchange_in_place(
+        struct crstruct * d,
+        struct crmpistruct * o,
+        ptrdiff_t * SendCount,
+        ptrdiff_t * SendDispl,
+        ptrdiff_t * RecvCount,
+        enum MPIU_AlltoallvSparsePolicy policy,
+        size_t max_buffer_bytes,
+        struct piece ** pieces,
+        const int line, const char * file)
+{
+    const int NTask = o->NTask;
+    const int ThisTask = o->ThisTask;
+    char * mybase = o->mybase;
+
+    ptrdiff_t nstaging = max_buffer_bytes / d->size;
+    if(nstaging < 1) nstaging = 1;
+    if(nstaging > (ptrdiff_t) o->myoutnmemb) nstaging = o->myoutnmemb;
+
+    char * staging = MPIU_Malloc("staging", d->size, nstaging);
+
+    ptrdiff_t sent[NTask];
+    ptrdiff_t recvd[NTask];
+    ptrdiff_t grant[NTask];
+    ptrdiff_t allowed[NTask];
+    ptrdiff_t sdispl[NTask];
+    ptrdiff_t rdispl[NTask];
+
+    struct piece_list placed = {NULL, 0, 0};
+    /* pos of staged is in staging; pos of holes is in mybase. */
+    struct piece_list staged = {NULL, 0, 0};
+    struct piece_list holes = {NULL, 0, 0};
+    int staged_head = 0;
+    int holes_head = 0;
+    ptrdiff_t nstaged = 0;
+
+    int i;
+    int round;
+
+    for(i = 0; i < NTask; i ++) {
+        sent[i] = 0;
+        recvd[i] = 0;
+    }
+    _piece_list_append(&placed, ThisTask, 0, SendDispl[ThisTask], SendCount[ThisTask]);
+    sent[ThisTask] = SendCount[ThisTask];
+    recvd[ThisTask] = RecvCount[ThisTask];
+
+    for(round = 0; ; round ++) {
+        ptrdiff_t capacity = nstaging - nstaged;
+        int nsources = 0;
+        for(i = 0; i < NTask; i ++) {
+            grant[i] = 0;
+            if(RecvCount[i] > recvd[i]) nsources ++;
+        }
+        /* a fair share to every sender first, the rest to who asks; rotate the start for fairness. */
+        if(nsources > 0) {
+            ptrdiff_t share = capacity / nsources;
+            int k;
+            for(k = 0; k < 2 * NTask; k ++) {
+                int j = (ThisTask + round + k) % NTask;
+                ptrdiff_t want = RecvCount[j] - recvd[j] - grant[j];
+                if(k < NTask && want > share) want = share;
+                if(want > capacity) want = capacity;
+                grant[j] += want;
+                capacity -= want;
+            }
+        }
+
+        ptrdiff_t status[2] = {0, 0};
+        for(i = 0; i < NTask; i ++) {
+            status[0] += SendCount[i] - sent[i] + RecvCount[i] - recvd[i];
+            status[1] += grant[i];
+        }
+        MPI_Allreduce(MPI_IN_PLACE, status, 2, MPI_TYPE_PTRDIFF, MPI_SUM, o->comm);
+
+        /* all done */
+        if(status[0] == 0) break;
+
+        if(status[1] == 0) {
+            if(ThisTask == 0) {
+                fprintf(stderr, "MPSort: the bounded exchange can not make progress. "
+                            "Caller site: %s:%d\n",
+                            file, line);
+            }
+            MPI_Abort(o->comm, -1);
+        }
+
+        MPI_Alltoall(grant, 1, MPI_TYPE_PTRDIFF,
+                allowed, 1, MPI_TYPE_PTRDIFF, o->comm);
+
+        ptrdiff_t offset = nstaged;
+        for(i = 0; i < NTask; i ++) {
+            sdispl[i] = SendDispl[i] + sent[i];
+            rdispl[i] = offset;
+            offset += grant[i];
+        }
+
+        MPIU_Alltoallv(
+                mybase, allowed, sdispl, o->MPI_TYPE_DATA,
+                staging, grant, rdispl, o->MPI_TYPE_DATA,
+                o->comm, policy);
+
+        for(i = 0; i < NTask; i ++) {
+            if(grant[i] > 0) {
+                _piece_list_append(&staged, i, recvd[i], rdispl[i], grant[i]);
+                recvd[i] += grant[i];
+                nstaged += grant[i];
+            }
+            if(allowed[i] > 0) {
+                _piece_list_append(&holes, i, 0, sdispl[i], allowed[i]);
+                sent[i] += allowed[i];
+            }
+        }
+
+        /* fill the holes */
+        while(staged_head < staged.n && holes_head < holes.n) {
+            struct piece * s = &staged.p[staged_head];
+            struct piece * h = &holes.p[holes_head];
+            ptrdiff_t n = s->nmemb < h->nmemb ? s->nmemb : h->nmemb;
+
+            memcpy(mybase + h->pos * d->size, staging + s->pos * d->size, n * d->size);
+            _piece_list_append(&placed, s->source, s->offset, h->pos, n);
+
+            s->offset += n;
+            s->pos += n;
+            s->nmemb -= n;
+            h->pos += n;
+            h->nmemb -= n;
+            nstaged -= n;
+            if(s->nmemb == 0) staged_head ++;
+            if(h->nmemb == 0) holes_head ++;
+        }
+
+        /* move the items still staged to the beginning of staging */
+        if(staged_head < staged.n) {
+            ptrdiff_t start = staged.p[staged_head].pos;
+            memmove(staging, staging + start * d->size, nstaged * d->size);
+            for(i = staged_head; i < staged.n; i ++) {
+                staged.p[i].pos -= start;
+            }
+        }
+    }
+
+    free(holes.p);
+    free(staged.p);
+    MPIU_Free(staging);
+
+    *pieces = placed.p;
+    return placed.n;
+}
+
+static int _piece_compar(const void * p1, const void * p2) {
+    const struct piece * a = p1;
+    const struct piece * b = p2;
+    if(a->source != b->source) return (a->source > b->source) - (a->source < b->source);
+    return (a->offset > b->offset) - (a->offset < b->offset);
+}
+
+/*
+ * Each piece is sorted, since it is a part of a sorted run; merge
+ * them in order of (source, offset), like the whole runs, into a permutation,
+ * then permute base in place.
+ * */
+static int _merge_pieces_in_place(
+        struct crstruct * d,
+        void * base, size_t nmemb,
+        struct piece * pieces, int npieces)
+{
+    int i;
+    int err = -1;
+    size_t * runoffset = malloc(sizeof(size_t) * npieces);
+    size_t * runnmemb = malloc(sizeof(size_t) * npieces);
+    size_t * perm = MPIU_Malloc("perm", sizeof(size_t), nmemb);
+
+    if(!runoffset || !runnmemb || (!perm && nmemb > 0)) {
+        MPIU_Free(perm);
+        free(runnmemb);
+        free(runoffset);
+        return -1;
+    }
+
+    qsort(pieces, npieces, sizeof(struct piece), _piece_compar);
+
+    for(i = 0; i < npieces; i ++) {
+        runoffset[i] = pieces[i].pos;
+        runnmemb[i] = pieces[i].nmemb;
+    }
+
+    err = _radix_merge_permutation(base, runoffset, runnmemb, npieces, perm, d);
+    if(err == 0) {
+        _radix_permute(base, perm, nmemb, d->size);
+    }
+
+    MPIU_Free(perm);
+    free(runnmemb);
+    free(runoffset);
+    return err;
+}
+
+/* the runs of mybase are sorted; usually there is only one. */
+static void _find_Pmax_Pmin_C(void * mybase,
+        const size_t * runoffset, const size_t * runnmemb, int nrun,
         size_t nmemb,
         size_t myoutnmemb,
         unsigned char * Pmax, unsigned char * Pmin,
@@ -615,17 +2422,28 @@ static void _find_Pmax_Pmin_C(void * mybase, size_t mynmemb,
 
     unsigned char myPmax[d->rsize];
     unsigned char myPmin[d->rsize];
+    unsigned char tmp[d->rsize];
 
     size_t eachnmemb[o->NTask];
     size_t eachoutnmemb[o->NTask];
     unsigned char eachPmax[d->rsize * o->NTask];
     unsigned char eachPmin[d->rsize * o->NTask];
+    size_t mynmemb = 0;
     int i;
 
-    if(mynmemb > 0) {
-        d->radix((char*) mybase + (mynmemb - 1) * d->size, myPmax, d->arg);
-        d->radix(mybase, myPmin, d->arg);
-    } else {
+    for(i = 0; i < nrun; i ++) {
+        if(runnmemb[i] == 0) continue;
+        d->radix((char*) mybase + (runoffset[i] + runnmemb[i] - 1) * d->size, tmp, d->arg);
+        if(mynmemb == 0 || d->compar(tmp, myPmax, d->rsize) > 0) {
+            memcpy(myPmax, tmp, d->rsize);
+        }
+        d->radix((char*) mybase + runoffset[i] * d->size, tmp, d->arg);
+        if(mynmemb == 0 || d->compar(tmp, myPmin, d->rsize) < 0) {
+            memcpy(myPmin, tmp, d->rsize);
+        }
+        mynmemb += runnmemb[i];
+    }
+    if(mynmemb == 0) {
         memset(myPmin, 0, d->rsize);
         memset(myPmax, 0, d->rsize);
     }
@@ -660,6 +2478,142 @@ static void _find_Pmax_Pmin_C(void * mybase, size_t mynmemb,
     }
 }
 
+/* a sample is its radix, followed by the changes of the count bounds when it is passed */
+struct sample_tail {
+    ptrdiff_t dCLE;
+    ptrdiff_t dCLT;
+};
+
+static void _sample_radix(const void * ptr, void * radix, void * arg) {
+    memcpy(radix, ptr, *(size_t *) arg);
+}
+
+/*
+ * Bracket the splitters with a regular sample of the local sorted arrays.
+ *
+ * Every rank contributes m sorted keys (at local index k_0 < k_1 < ...),
+ * which are gathered to all ranks and sorted. For any key x, the samples give
+ *
+ *  CLE(x) >= sum over ranks of (the largest k_j + 1 with key_j <= x),
+ *  CLT(x) <= sum over ranks of (the smallest k_j with key_j >= x, or nmemb).
+ *
+ * Pright[i] is the smallest sample with the lower bound of CLE >= C[i + 1],
+ * and Pleft[i] is the largest sample with the upper bound of CLT < C[i + 1],
+ * hence the solution of the splitter stays in [Pleft, Pright].
+ * Splitters without a bracketing sample keep Pmin / Pmax.
+ *
+ * CLEleft and CLTright receive the bounds at the bracket, as estimates of the counts.
+ * */
+static void _find_P_brackets_by_sampling(
+        ptrdiff_t * C,
+        unsigned char * Pleft, unsigned char * Pright,
+        ptrdiff_t * CLEleft, ptrdiff_t * CLTright,
+        struct crstruct * d,
+        struct crmpistruct * o) {
+
+    const size_t headsize = (d->rsize + 7) & ~((size_t) 7);
+    const size_t recsize = headsize + sizeof(struct sample_tail);
+    const int Plength = o->NTask - 1;
+
+    int m = 16384 / o->NTask;
+    if(m < 8) m = 8;
+    if(m > 256) m = 256;
+    if((size_t) m > o->mynmemb) m = o->mynmemb;
+
+    int eachm[o->NTask];
+    int recvcounts[o->NTask];
+    int recvdispls[o->NTask];
+    int i, j;
+
+    MPI_Allgather(&m, 1, MPI_INT, eachm, 1, MPI_INT, o->comm);
+
+    size_t nsamples = 0;
+    for(i = 0; i < o->NTask; i ++) {
+        recvcounts[i] = eachm[i] * recsize;
+        recvdispls[i] = nsamples * recsize;
+        nsamples += eachm[i];
+    }
+
+    char * mysamples = MPIU_Malloc("mysamples", recsize, m + 1);
+    char * samples = MPIU_Malloc("samples", recsize, nsamples + 1);
+    /* the padding of the radix is compared */
+    memset(mysamples, 0, recsize * (m + 1));
+
+    for(j = 0; j < m; j ++) {
+        ptrdiff_t k = o->mynmemb * (2 * j + 1) / (2 * m);
+        ptrdiff_t kprev = j > 0 ? (ptrdiff_t) (o->mynmemb * (2 * j - 1) / (2 * m)) : -1;
+        ptrdiff_t knext = j < m - 1 ? (ptrdiff_t) (o->mynmemb * (2 * j + 3) / (2 * m)) : (ptrdiff_t) o->mynmemb;
+        struct sample_tail tail;
+        tail.dCLE = k - kprev;
+        tail.dCLT = knext - k;
+        d->radix((char*) o->mybase + k * d->size, mysamples + j * recsize, d->arg);
+        memcpy(mysamples + j * recsize + headsize, &tail, sizeof(tail));
+    }
+
+    MPI_Allgatherv(mysamples, m * recsize, MPI_BYTE,
+            samples, recvcounts, recvdispls, MPI_BYTE, o->comm);
+
+    MPIU_Free(mysamples);
+
+    radix_sort(samples, nsamples, recsize, _sample_radix, d->rsize, &d->rsize);
+
+    /* the bounds before any sample is passed; the passed samples
+     * will account for the rest of the items */
+    ptrdiff_t LB_CLE = 0;
+    ptrdiff_t UB_CLT = o->nmemb;
+    size_t s;
+    for(s = 0; s < nsamples; s ++) {
+        struct sample_tail tail;
+        memcpy(&tail, samples + s * recsize + headsize, sizeof(tail));
+        UB_CLT -= tail.dCLT;
+    }
+
+    int ileft = 0;
+    int iright = 0;
+    size_t g = 0;
+    /* LB_CLE after the previous group */
+    ptrdiff_t LB_CLE_prev = 0;
+    while(g < nsamples) {
+        char * key = samples + g * recsize;
+        size_t end;
+        /* all samples equal to key form a group */
+        for(end = g + 1; end < nsamples; end ++) {
+            if(d->compar(samples + end * recsize, key, d->rsize) != 0) break;
+        }
+
+        /* UB_CLT is the bound of CLT(key); the previous group is the last that qualifies */
+        for(; ileft < Plength && UB_CLT >= C[ileft + 1]; ileft ++) {
+            if(g > 0) {
+                memcpy(&Pleft[ileft * d->rsize], samples + (g - 1) * recsize, d->rsize);
+                CLEleft[ileft] = LB_CLE_prev;
+            }
+        }
+
+        ptrdiff_t UB_CLT_before = UB_CLT;
+        for(s = g; s < end; s ++) {
+            struct sample_tail tail;
+            memcpy(&tail, samples + s * recsize + headsize, sizeof(tail));
+            LB_CLE += tail.dCLE;
+            UB_CLT += tail.dCLT;
+        }
+
+        /* LB_CLE is the bound of CLE(key) */
+        for(; iright < Plength && LB_CLE >= C[iright + 1]; iright ++) {
+            memcpy(&Pright[iright * d->rsize], key, d->rsize);
+            CLTright[iright] = UB_CLT_before;
+        }
+        LB_CLE_prev = LB_CLE;
+        g = end;
+    }
+    /* every sample qualifies for the rest of the splitters */
+    for(; ileft < Plength && nsamples > 0; ileft ++) {
+        memcpy(&Pleft[ileft * d->rsize], samples + (nsamples - 1) * recsize, d->rsize);
+        CLEleft[ileft] = LB_CLE_prev;
+    }
+
+    MPIU_Free(samples);
+}
+
 static int
 _solve_for_layout_mpi (
         int NTask,
@@ -742,6 +2696,32 @@ static void _mpsort_mpi_parse_env()
         mpsort_mpi_set_options(MPSORT_REQUIRE_GATHER_SORT );
     if(getenv("MPSORT_REQUIRE_SPARSE_ALLTOALLV"))
         mpsort_mpi_set_options(MPSORT_REQUIRE_SPARSE_ALLTOALLV);
+    if(getenv("MPSORT_ENABLE_SPLITTER_SAMPLING"))
+        mpsort_mpi_set_options(MPSORT_ENABLE_SPLITTER_SAMPLING);
+    if(getenv("MPSORT_ENABLE_INTERPOLATION_SEARCH"))
+        mpsort_mpi_set_options(MPSORT_ENABLE_INTERPOLATION_SEARCH);
+    if(getenv("MPSORT_ENABLE_KEY_INDEX_SORT"))
+        mpsort_mpi_set_options(MPSORT_ENABLE_KEY_INDEX_SORT);
+    if(getenv("MPSORT_DISABLE_CHECKSUM"))
+        mpsort_mpi_set_options(MPSORT_DISABLE_CHECKSUM);
+    if(getenv("MPSORT_ENABLE_FAST_CHECKSUM"))
+        mpsort_mpi_set_options(MPSORT_ENABLE_FAST_CHECKSUM);
+    if(getenv("MPSORT_ENABLE_CHECK_SORTED"))
+        mpsort_mpi_set_options(MPSORT_ENABLE_CHECK_SORTED);
+    if(getenv("MPSORT_ENABLE_PIPELINE"))
+        mpsort_mpi_set_options(MPSORT_ENABLE_PIPELINE);
+    if(getenv("MPSORT_ENABLE_INCREMENTAL"))
+        mpsort_mpi_set_options(MPSORT_ENABLE_INCREMENTAL);
+    if(getenv("MPSORT_ENABLE_STABLE"))
+        mpsort_mpi_set_options(MPSORT_ENABLE_STABLE);
+    if(getenv("MPSORT_DISABLE_SHARED_MEMORY_GATHER"))
+        mpsort_mpi_set_options(MPSORT_DISABLE_SHARED_MEMORY_GATHER);
+    if(getenv("MPSORT_REQUIRE_HIERARCHICAL_ALLTOALLV"))
+        mpsort_mpi_set_options(MPSORT_REQUIRE_HIERARCHICAL_ALLTOALLV);
+    if(getenv("MPSORT_RANKS_PER_NODE"))
+        MPIU_Set_ranks_per_node(atoi(getenv("MPSORT_RANKS_PER_NODE")));
+    if(getenv("MPSORT_MAX_BUFFER_BYTES"))
+        mpsort_mpi_set_max_buffer_bytes(strtoull(getenv("MPSORT_MAX_BUFFER_BYTES"), NULL, 10));
 }
 
 void
@@ -765,3 +2745,17 @@ mpsort_mpi_unset_options(int options)
     _mpsort_mpi_options &= ~options;
 
 }
+
+void
+mpsort_mpi_set_max_buffer_bytes(size_t bytes)
+{
+    _mpsort_mpi_parse_env();
+    _mpsort_mpi_max_buffer_bytes = bytes;
+}
+
+size_t
+mpsort_mpi_get_max_buffer_bytes()
+{
+    _mpsort_mpi_parse_env();
+    return _mpsort_mpi_max_buffer_bytes;
+}
@@ -3,6 +3,15 @@ void radix_sort(void * base, size_t nmemb, size_t size,
         size_t rsize,
         void * arg);
 
+/* Number of threads used by the local sorts, histograms and merges
+ * (including those inside mpsort_mpi). nthreads <= 0 uses all threads
+ * available to OpenMP. The default is 1, or the environment variable
+ * MPSORT_NTHREADS if set. Without OpenMP the sorts are always serial. */
+void mpsort_set_nthreads(int nthreads);
+/* back to the default, MPSORT_NTHREADS or 1 */
+void mpsort_unset_nthreads();
+int mpsort_get_nthreads();
+
 #ifdef _OPENMP
 /* openmp support */
 void mpsort_omp(void * base, size_t nmemb, size_t size,
@@ -18,11 +27,44 @@ void mpsort_omp(void * base, size_t nmemb, size_t size,
 #define MPSORT_DISABLE_GATHER_SORT (1 << 3)
 #define MPSORT_REQUIRE_GATHER_SORT (1 << 4)
 #define MPSORT_REQUIRE_SPARSE_ALLTOALLV (1 << 6)
+/* bracket the splitters with a regular sample, then interpolate inside the brackets */
+#define MPSORT_ENABLE_SPLITTER_SAMPLING (1 << 7)
+/* interpolate the splitters with the counts instead of bisecting */
+#define MPSORT_ENABLE_INTERPOLATION_SEARCH (1 << 8)
+/* sort (radix, rank, offset) tuples, then move each item once to its destination */
+#define MPSORT_ENABLE_KEY_INDEX_SORT (1 << 9)
+/* skip the checksum of the input and the output */
+#define MPSORT_DISABLE_CHECKSUM (1 << 10)
+/* checksum with a hash of 64-bit words instead of the sum of bytes */
+#define MPSORT_ENABLE_FAST_CHECKSUM (1 << 11)
+/* check that the output is globally sorted */
+#define MPSORT_ENABLE_CHECK_SORTED (1 << 12)
+/* exchange in two levels: aggregate within each node, then between the nodes */
+#define MPSORT_REQUIRE_HIERARCHICAL_ALLTOALLV (1 << 13)
+/* gather the small ranks of a node with MPIU_Gather instead of a shared memory window */
+#define MPSORT_DISABLE_SHARED_MEMORY_GATHER (1 << 14)
+/* sort the local array in runs, and merge them in a second thread while the splitters are searched */
+#define MPSORT_ENABLE_PIPELINE (1 << 15)
+/* for nearly sorted data: sort the local array adaptively,
+ * and start the splitter search from the splitters of the previous sort */
+#define MPSORT_ENABLE_INCREMENTAL (1 << 16)
+/* break the ties of the radix by the origin of the items, keeping the order of the input;
+ * implies the key-index sort */
+#define MPSORT_ENABLE_STABLE (1 << 17)
 
 void mpsort_mpi_set_options(int options);
 int mpsort_mpi_has_options(int options);
 void mpsort_mpi_unset_options(int options);
 
+/* Bound the buffers of the exchange to about bytes per rank; 0 (the default) for no bound.
+ * The items are exchanged in rounds, and received in place or straight into a separate output;
+ * the merge of the received runs, and a plan applied in place, use 8 more bytes per item.
+ * The plans and the key-index sort hold 16 bytes per item for the plan besides,
+ * and the key-index sort sorts (radix, rank, offset) tuples with the same bound.
+ * Also set by the environment variable MPSORT_MAX_BUFFER_BYTES. */
+void mpsort_mpi_set_max_buffer_bytes(size_t bytes);
+size_t mpsort_mpi_get_max_buffer_bytes();
+
 void mpsort_mpi_impl(void * base, size_t nmemb, size_t elsize,
         void (*radix)(const void * ptr, void * radix, void * arg),
         size_t rsize,
@@ -46,8 +88,92 @@ void mpsort_mpi_newarray_impl(void * base, size_t nmemb,
     mpsort_mpi_newarray_impl(base, nmemb, out, outnmemb, elsize, \
     radix, rsize, arg, comm, __LINE__, __FILE__)
 
+/* A plan records where each item goes in a sort by the radix,
+ * to reorder other arrays of the same length the same way.
+ * outnmemb is the number of items on this rank after the sort.
+ * Apply moves the items of base (nmemb items) to out (outnmemb items);
+ * apply_inverse moves them back. base and out can be the same if
+ * nmemb == outnmemb. The plan uses comm, which shall outlive the plan. */
+typedef struct mpsort_mpi_plan mpsort_mpi_plan;
+
+mpsort_mpi_plan * mpsort_mpi_plan_create_impl(const void * base, size_t nmemb,
+        size_t outnmemb,
+        size_t elsize,
+        void (*radix)(const void * ptr, void * radix, void * arg),
+        size_t rsize,
+        void * arg, MPI_Comm comm,
+        const int line, const char * file);
+
+#define mpsort_mpi_plan_create(base, nmemb, outnmemb, elsize, \
+    radix, rsize, arg, comm) \
+    mpsort_mpi_plan_create_impl(base, nmemb, outnmemb, elsize, \
+    radix, rsize, arg, comm, __LINE__, __FILE__)
+
+void mpsort_mpi_plan_apply(mpsort_mpi_plan * plan,
+        const void * base, void * out, size_t elsize);
+void mpsort_mpi_plan_apply_inverse(mpsort_mpi_plan * plan,
+        const void * base, void * out, size_t elsize);
+size_t mpsort_mpi_plan_get_nmemb(mpsort_mpi_plan * plan);
+size_t mpsort_mpi_plan_get_outnmemb(mpsort_mpi_plan * plan);
+void mpsort_mpi_plan_free(mpsort_mpi_plan * plan);
+
+/* The items at the global ranks of the distributed array sorted by the radix,
+ * without moving the array. ranks and the nranks items written to out are the
+ * same on all ranks; 0 <= ranks[i] < the total number of items.
+ * Unless the local array is sorted already, it is sorted in a copy, which costs
+ * a local sort and the memory of the local array. */
+void mpsort_mpi_select_impl(const void * base, size_t nmemb,
+        size_t elsize,
+        void (*radix)(const void * ptr, void * radix, void * arg),
+        size_t rsize,
+        void * arg,
+        const ptrdiff_t * ranks, int nranks,
+        void * out,
+        MPI_Comm comm,
+        const int line, const char * file);
+
+#define mpsort_mpi_select(base, nmemb, elsize, \
+    radix, rsize, arg, ranks, nranks, out, comm) \
+    mpsort_mpi_select_impl(base, nmemb, elsize, \
+    radix, rsize, arg, ranks, nranks, out, comm, __LINE__, __FILE__)
+
+/* The global index in the input of the items of the stably sorted array,
+ * distributed with outnmemb indices on this rank, without moving the array. */
+void mpsort_mpi_argsort_impl(const void * base, size_t nmemb,
+        size_t elsize,
+        void (*radix)(const void * ptr, void * radix, void * arg),
+        size_t rsize,
+        void * arg,
+        ptrdiff_t * out, size_t outnmemb,
+        MPI_Comm comm,
+        const int line, const char * file);
+
+#define mpsort_mpi_argsort(base, nmemb, elsize, \
+    radix, rsize, arg, out, outnmemb, comm) \
+    mpsort_mpi_argsort_impl(base, nmemb, elsize, \
+    radix, rsize, arg, out, outnmemb, comm, __LINE__, __FILE__)
+
 void mpsort_mpi_report_last_run();
 
+/* Counters of the last sort (or plan creation) on this rank. */
+struct mpsort_mpi_stats {
+    int niter;          /* iterations of the splitter search */
+    int sparse;         /* 1 if the exchange used the sparse alltoallv */
+    int ngroups;        /* number of groups of the gather sort; the number of ranks if no gathering */
+    int groupsize;      /* number of ranks in the group of this rank */
+    size_t bytes_sent;  /* bytes sent to other ranks by the gather, the exchange and the scatter */
+    size_t bytes_recv;  /* bytes received from other ranks */
+    size_t peak_memory; /* peak of the temporary memory allocated with MPIU_Malloc */
+    int nthreads;       /* threads of the local sorts */
+};
+
+void mpsort_mpi_get_last_run_stats(struct mpsort_mpi_stats * stats);
+
+/* Phases of the last sort, in order; returns the name and sets the elapsed seconds of phase i.
+ * The splitter search has a phase per iteration. */
+int mpsort_mpi_get_last_run_nphases();
+const char * mpsort_mpi_get_last_run_phase(int i, double * elapsed);
+
 #ifdef __INTEL_COMPILER
 #warning MPSORT: detected an Intel Compiler.
 #warning MPSORT: As of Oct 27 2019, icc frequently produces buggier code than gcc when interfacing with MPI and multithreading.
@@ -1,9 +1,17 @@
 from .version import __version__
 
 from .binding import sort as _sort
+from .binding import plan as _plan
+from .binding import SortPlan
+from .binding import last_run_stats
+from .binding import select as _select
+from .binding import argsort as _argsort
+from .binding import radix_compare_item as _radix_compare_item
+from .binding import _lock, _isort_submit, _isort_wait
 
 import numpy
-from numpy.lib.recfunctions import append_fields
+import threading
+from numpy.lib.recfunctions import append_fields, repack_fields
 
 try:
     unicode = unicode
@@ -20,21 +28,27 @@ else:
     bytes = str
     basestring = basestring
 
-def sort(source, orderby=None, out=None, comm=None, tuning=[]):
+def sort(source, orderby=None, out=None, comm=None, tuning=[], nthreads=None,
+        max_buffer_bytes=None, weights=None):
     """
         Sort source array with orderby as the key.
         Store result to out.
 
         Parameters
         ----------
-        source : array, 1d, distributed
+        source : array, 1d, distributed, or a list or dict of columns.
+            Columns are arrays of the same partition, ordered together
+            by orderby without an interleaved temporary.
 
-        orderby : array, 1d, distributed or string.
-            Only integer types are supported.
+        orderby : array, 1d, distributed, string or list of strings.
+            Integer and float types are supported; a structured orderby
+            is ordered by its first field, then the second and so on.
             must be on the same partition as that of source.
-            If orderby is string, it refers to the field in source.
+            If orderby is string, it refers to the field in source,
+            or the column of a dict source. A list of strings refers to
+            several fields in source, the first being the most significant.
 
-        out : array, 1d distributed
+        out : array, 1d distributed, or a list or dict of columns.
             the total length must be the same as source.
             the itemsize must be the same as source
             if None, the sort is in-place.
@@ -44,10 +58,37 @@ def sort(source, orderby=None, out=None, comm=None, tuning=[]):
             'DISABLE_GATHER_SORT'
             'REQUIRE_GATHER_SORT'
             'REQUIRE_SPARSE_ALLTOALLV'
+            'ENABLE_SPLITTER_SAMPLING'
+            'ENABLE_INTERPOLATION_SEARCH'
+            'ENABLE_KEY_INDEX_SORT'
+            'DISABLE_CHECKSUM'
+            'ENABLE_FAST_CHECKSUM'
+            'ENABLE_CHECK_SORTED'
+            'REQUIRE_HIERARCHICAL_ALLTOALLV'
+            'DISABLE_SHARED_MEMORY_GATHER'
+            'ENABLE_PIPELINE'
+            'ENABLE_INCREMENTAL'
+            'ENABLE_STABLE'
+
+        nthreads : int or None
+            number of OpenMP threads per rank; None for the environment
+            variable MPSORT_NTHREADS or 1, 0 or negative for all available threads.
+
+        max_buffer_bytes : int or None
+            bound the memory of the exchange to about this many bytes
+            per rank, plus 8 bytes per item, and 16 more for a plan.
+            None for no bound.
+
+        weights : array, 1d, distributed, string or None.
+            the cost of each item, non-negative, on the same partition as source;
+            a string refers to the field in source, or the column of a dict source.
+            If given, the output partition balances the summed weights of the
+            ranks instead of the number of items, the sort is stable, and out
+            must be None.
 
         Returns
         -------
-            out
+            out; with weights, new arrays (or columns) on the weighted partition.
 
         Remarks
         -------
@@ -55,9 +96,22 @@ def sort(source, orderby=None, out=None, comm=None, tuning=[]):
 
     """
 
+    _isort_wait()
     key = orderby
-    if isinstance(key, basestring):
-        return _sort(source, key, out, comm=comm, tuning=tuning)
+    if weights is not None:
+        if out is not None:
+            raise ValueError("out must be None with weights; the output partition is computed")
+        return _sort_weighted(source, key, weights, comm=comm, tuning=tuning, nthreads=nthreads,
+                max_buffer_bytes=max_buffer_bytes)
+
+    if isinstance(source, (list, tuple, dict)):
+        return _sort_columns(source, key, out, comm=comm, tuning=tuning, nthreads=nthreads,
+                max_buffer_bytes=max_buffer_bytes)
+
+    if isinstance(key, basestring) or (isinstance(key, (list, tuple))
+        and all(isinstance(name, basestring) for name in key)):
+        return _sort(source, key, out, comm=comm, tuning=tuning, nthreads=nthreads,
+                max_buffer_bytes=max_buffer_bytes)
 
     if key is None:
         D, I = 'DD'
@@ -75,15 +129,737 @@ def sort(source, orderby=None, out=None, comm=None, tuning=[]):
 
     if out is None:
         out = source
-        _sort(data1, orderby=I, comm=comm, tuning=tuning)
+        _sort(data1, orderby=I, comm=comm, tuning=tuning, nthreads=nthreads,
+                max_buffer_bytes=max_buffer_bytes)
         out[...] = data1[D][...]
     else:
         data2 = numpy.empty(len(out), dtype=data1.dtype)
-        _sort(data1, orderby=I, out=data2, comm=comm, tuning=tuning)
+        _sort(data1, orderby=I, out=data2, comm=comm, tuning=tuning, nthreads=nthreads,
+                max_buffer_bytes=max_buffer_bytes)
         out[...] = data2[D][...]
 
     return out
 
+class SortRequest(object):
+    """
+        A sort started by :func:`isort`.
+
+        Attributes
+        ----------
+        stats : dict or None
+            :func:`last_run_stats` of the sort, once it has finished.
+    """
+    def __init__(self):
+        self._done = threading.Event()
+        self._result = None
+        self._error = None
+        self.stats = None
+
+    def _run(self, args, kwargs):
+        try:
+            # no other sort runs between the sort and its statistics
+            with _lock:
+                self._result = sort(*args, **kwargs)
+                self.stats = last_run_stats()
+        except BaseException as e:
+            self._error = e
+        finally:
+            kwargs['comm'].Free()
+            self._done.set()
+
+    def test(self):
+        """ Returns True if the sort has finished, without waiting. """
+        return self._done.is_set()
+
+    def wait(self):
+        """
+            Wait for the sort to finish.
+
+            Returns
+            -------
+                out, as returned by :func:`sort`. An exception raised by
+                the sort is raised here.
+        """
+        self._done.wait()
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+def isort(source, orderby=None, out=None, comm=None, tuning=[], nthreads=None,
+        max_buffer_bytes=None):
+    """
+        Start sorting source in the background; see :func:`sort` for the arguments.
+
+        Returns
+        -------
+            a :class:`SortRequest`; request.test() tells if the sort has finished,
+            request.wait() waits for it and returns out.
+
+        Remarks
+        -------
+            source, orderby and out shall not be used until the request is finished.
+
+            The sorts run one by one on a worker thread, on a duplicate of comm,
+            thus every rank shall call isort in the same order. A blocking sort,
+            plan, select or SortPlan.apply started while requests are pending
+            waits for them.
+
+            The worker thread calls MPI beside the calling thread, which requires
+            MPI.THREAD_MULTIPLE; with a lower thread level the sort finishes
+            before isort returns.
+    """
+    from mpi4py import MPI
+
+    if comm is None:
+        comm = MPI.COMM_WORLD
+
+    request = SortRequest()
+    args = (source, orderby, out)
+    kwargs = dict(comm=comm.Dup(), tuning=tuning, nthreads=nthreads,
+            max_buffer_bytes=max_buffer_bytes)
+
+    if MPI.Query_thread() < MPI.THREAD_MULTIPLE:
+        request._run(args, kwargs)
+        return request
+
+    _isort_submit(lambda: request._run(args, kwargs))
+    return request
+
+def _sort_columns(source, orderby, out, comm, tuning, nthreads, max_buffer_bytes):
+    """ Sort the columns of source with a plan of orderby; see sort. """
+    if isinstance(source, dict):
+        names = list(source.keys())
+        if isinstance(orderby, basestring):
+            orderby = source[orderby]
+        if out is None:
+            out = source
+        columns = [source[name] for name in names]
+        outcolumns = [out[name] for name in names]
+    else:
+        if out is None:
+            out = source
+        columns = list(source)
+        outcolumns = list(out)
+        if len(outcolumns) != len(columns):
+            raise ValueError("number of columns mismatch %d != %d" % (len(outcolumns), len(columns)))
+
+    if orderby is None or isinstance(orderby, basestring):
+        raise ValueError("orderby must be an array or a column of a dict source")
+
+    if len(outcolumns) > 0:
+        outsize = len(outcolumns[0])
+    else:
+        outsize = None
+
+    p = plan(orderby, outsize=outsize, comm=comm, tuning=tuning, nthreads=nthreads,
+            max_buffer_bytes=max_buffer_bytes)
+
+    for column, outcolumn in zip(columns, outcolumns):
+        p.apply(column, out=outcolumn)
+
+    return out
+
+def _sort_weighted(source, orderby, weights, comm, tuning, nthreads, max_buffer_bytes):
+    """ Sort source to a partition of equal summed weights; see sort. """
+    if comm is None:
+        from mpi4py import MPI
+        comm = MPI.COMM_WORLD
+
+    if isinstance(source, dict):
+        columns = list(source.values())
+    elif isinstance(source, (list, tuple)):
+        columns = list(source)
+    else:
+        columns = [source]
+
+    # the key and the weights, as in sort.
+    if orderby is None:
+        key, fields = columns[0], None
+    elif isinstance(orderby, basestring) and isinstance(source, dict):
+        key, fields = source[orderby], None
+    elif isinstance(orderby, basestring) or (isinstance(orderby, (list, tuple))
+        and all(isinstance(name, basestring) for name in orderby)):
+        key, fields = columns[0], orderby
+    else:
+        key, fields = orderby, None
+
+    if isinstance(weights, basestring):
+        weights = source[weights]
+    weights = numpy.asarray(weights, dtype='f8')
+    if comm.allreduce(len(weights) != len(key)):
+        raise ValueError("weights must be on the same partition as source")
+    if comm.allreduce(bool((weights < 0).any())):
+        raise ValueError("weights must be non-negative")
+
+    key = _key(numpy.asarray(key), fields)
+    tuning = list(tuning) + ['ENABLE_STABLE']
+
+    # the weights in the stable order of the keys, on the partition of the input.
+    data = numpy.empty(len(key), dtype=[('K', key.dtype, key.shape[1:]), ('W', 'f8')])
+    data['K'] = key
+    data['W'] = weights
+    _sort(data, 'K', comm=comm, tuning=tuning, nthreads=nthreads,
+            max_buffer_bytes=max_buffer_bytes)
+    w = data['W']
+
+    # an item goes to the rank where the middle of its weight falls
+    # in the weighted prefix sum of the sorted items.
+    cumw = numpy.cumsum(w)
+    offset = comm.exscan(cumw[-1] if len(cumw) else 0.0)
+    if comm.rank == 0 or offset is None:
+        offset = 0.0
+    total = comm.allreduce(cumw[-1] if len(cumw) else 0.0)
+    if total > 0:
+        middle = (offset + cumw - 0.5 * w) / total
+        dest = numpy.minimum(numpy.int64(middle * comm.size), comm.size - 1)
+    else:
+        total = comm.allreduce(len(w))
+        start = comm.scan(len(w)) - len(w)
+        dest = (start + numpy.arange(len(w))) * comm.size // max(total, 1)
+    sizes = comm.allreduce(numpy.bincount(dest, minlength=comm.size))
+    del data, w
+
+    # the same stable order moves the columns once, to the weighted partition.
+    p = plan(key, outsize=sizes[comm.rank], comm=comm, tuning=tuning, nthreads=nthreads,
+            max_buffer_bytes=max_buffer_bytes)
+    result = [p.apply(column) for column in columns]
+
+    if isinstance(source, dict):
+        return dict(zip(source.keys(), result))
+    if isinstance(source, (list, tuple)):
+        return result
+    return result[0]
+
+def plan(orderby, outsize=None, comm=None, tuning=[], nthreads=None,
+        max_buffer_bytes=None):
+    """
+        Plan a sort by orderby, to reorder several arrays of
+        the same partition as orderby in the same way.
+
+        Parameters
+        ----------
+        orderby : array, 1d, distributed.
+            Integer, float and structured types are supported, as in :func:`sort`.
+
+        outsize : int or None
+            the local length after the sort; None for len(orderby).
+
+        comm, tuning, nthreads, max_buffer_bytes :
+            as in :func:`sort`.
+
+        Returns
+        -------
+            a :class:`SortPlan`; plan.apply(source, out=None) returns source
+            ordered by orderby; plan.apply(array, inverse=True) moves back.
+
+        Remarks
+        -------
+            orderby can be flatiter.
+
+    """
+    key = numpy.ascontiguousarray(orderby)
+    return _plan(key, None, outsize=outsize, comm=comm, tuning=tuning,
+            nthreads=nthreads, max_buffer_bytes=max_buffer_bytes)
+
+def select(array, ranks, comm, orderby=None, tuning=[], nthreads=None):
+    """
+        The items at global ranks of a distributed array, as if it were sorted,
+        without sorting or moving the array.
+
+        Parameters
+        ----------
+        array : array, 1d, distributed.
+            Integer, float and structured types are supported, as in :func:`sort`.
+
+        ranks : int or list of int, collective.
+            Positions in the sorted array; negative ranks count from the end.
+            e.g. the quantile q is at rank int(q * (N - 1)) of N items.
+
+        orderby : string, list of strings or None
+            the fields of array to order by; None for array itself.
+
+        Returns
+        -------
+            the items at ranks, on all ranks; an item if ranks is an int.
+
+        Remarks
+        -------
+            Unless the local array is sorted already, it is sorted in a
+            temporary copy, which costs a local sort and its memory.
+
+    """
+    _isort_wait()
+    total = comm.allreduce(len(array))
+
+    r = numpy.array(ranks, dtype='intp')
+    scalar = r.ndim == 0
+    r = r.ravel()
+    r = numpy.where(r < 0, r + total, r)
+    if ((r < 0) | (r >= total)).any():
+        raise IndexError("ranks are out of range for %d items" % total)
+
+    result = _select(numpy.ascontiguousarray(array), r, orderby=orderby, comm=comm,
+            tuning=tuning, nthreads=nthreads)
+
+    if scalar:
+        return result[0]
+    return result
+
+def topk(array, k, comm, orderby=None, out=None, tuning=[], nthreads=None):
+    """
+        The k largest items of a distributed array; only these items are moved.
+
+        Parameters
+        ----------
+        array : array, 1d, distributed.
+            Integer, float and structured types are supported, as in :func:`sort`.
+
+        k : int, collective.
+
+        orderby : string, list of strings or None
+            the fields of array to order by; None for array itself.
+
+        out : array, 1d, distributed, or None
+            the total length must be k. If None, the k items are spread
+            evenly over the ranks.
+
+        Returns
+        -------
+            out, the last k items of the sorted array, sorted.
+
+    """
+    _isort_wait()
+    total = comm.allreduce(len(array))
+
+    if k < 0 or k > total:
+        raise ValueError("k must be between 0 and %d" % total)
+
+    array = numpy.ascontiguousarray(array)
+
+    if out is None:
+        out = numpy.empty(k * (comm.rank + 1) // comm.size - k * comm.rank // comm.size,
+                dtype=array.dtype)
+
+    winners = numpy.zeros(len(array), dtype='?')
+    if k > 0:
+        threshold = _select(array, [total - k], orderby=orderby, comm=comm,
+                tuning=tuning, nthreads=nthreads)
+        order = _radix_compare_item(array, threshold, orderby=orderby)
+        winners[...] = order > 0
+
+        # the items equal to the threshold that are needed, in the order of the ranks
+        equal = (order == 0).nonzero()[0]
+        need = k - comm.allreduce(int(winners.sum()))
+        start = comm.scan(len(equal)) - len(equal)
+        winners[equal[:max(0, min(len(equal), need - start))]] = True
+
+    sort(array[winners], orderby=orderby, out=out, comm=comm, tuning=tuning, nthreads=nthreads)
+    return out
+
+def argsort(key, comm, orderby=None, out=None, tuning=[], nthreads=None):
+    """
+        The global indices that stably sort a distributed array, without moving
+        the array; ties are in the order of the ranks, then of the items.
+
+        Parameters
+        ----------
+        key : array, 1d, distributed.
+            Integer, float and structured types are supported, as in :func:`sort`.
+
+        orderby : string, list of strings or None
+            the fields of key to order by; None for key itself.
+
+        out : array, 1d, distributed, or None
+            the total length must be the same as key. If None, on the same
+            partition as key.
+
+        Returns
+        -------
+            out, the global index into key of each item of the sorted array,
+            e.g. for :func:`take`.
+
+    """
+    key = numpy.ascontiguousarray(key)
+
+    if out is None:
+        out = numpy.empty(len(key), dtype='intp')
+
+    if out.dtype == numpy.dtype('intp') and out.flags['C_CONTIGUOUS']:
+        result = out
+    else:
+        result = numpy.empty(len(out), dtype='intp')
+
+    _argsort(key, result, orderby=orderby, comm=comm, tuning=tuning, nthreads=nthreads)
+
+    if result is not out:
+        out[...] = result
+    return out
+
+def unique(key, comm, return_counts=False, presorted=False, tuning=[], nthreads=None):
+    """
+        The unique keys of a distributed array.
+
+        Parameters
+        ----------
+        key : array, 1d, distributed.
+
+        return_counts : bool
+            also return the number of items of each key.
+
+        presorted : bool
+            key is already globally sorted; otherwise a sorted copy is made.
+
+        Returns
+        -------
+            the sorted unique keys, distributed; each key is on the rank where
+            its run of equal keys starts. The counts, if return_counts.
+
+    """
+    if presorted:
+        sortedkey = key
+    else:
+        sortedkey = numpy.empty_like(key)
+        sort(key, out=sortedkey, comm=comm, tuning=tuning, nthreads=nthreads)
+
+    ukey, counts, _ = _reduce_runs(sortedkey, None, None, comm)
+    if return_counts:
+        return ukey, counts
+    return ukey
+
+def reduceat(key, values, op, comm, presorted=False, tuning=[], nthreads=None):
+    """
+        Reduce values over the items of equal keys of a distributed array.
+
+        Parameters
+        ----------
+        key : array, 1d, distributed.
+
+        values : array, distributed, on the partition of key.
+
+        op : numpy.ufunc, e.g. numpy.add, numpy.maximum.
+
+        presorted : bool
+            key is already globally sorted and values ordered by key;
+            otherwise sorted copies are made.
+
+        Returns
+        -------
+            the sorted unique keys and the reduced values, distributed;
+            each key is on the rank where its run of equal keys starts.
+
+    """
+    if presorted:
+        sortedkey, sortedvalues = key, values
+    else:
+        sortedkey = numpy.empty_like(key)
+        sortedvalues = numpy.empty_like(values)
+        sort([key, values], orderby=key, out=[sortedkey, sortedvalues], comm=comm,
+                tuning=tuning, nthreads=nthreads)
+
+    ukey, _, reduced = _reduce_runs(sortedkey, sortedvalues, op, comm)
+    return ukey, reduced
+
+def regroup(source, orderby, comm):
+    """
+        Move the boundaries of a sorted distributed array such that
+        items of equal keys never straddle ranks. A run crossing a boundary
+        goes to the rank where it starts.
+
+        Parameters
+        ----------
+        source : array, 1d, distributed, or a list of columns, sorted by orderby.
+
+        orderby : array, 1d, distributed, string, list of strings or None.
+            as in :func:`sort`; None for source itself.
+
+        Returns
+        -------
+            new arrays of source on the new partition.
+
+    """
+    if isinstance(source, (list, tuple)):
+        columns = list(source)
+    else:
+        columns = [source]
+
+    if orderby is None:
+        key = columns[0]
+    elif isinstance(orderby, basestring) or (isinstance(orderby, (list, tuple))
+        and all(isinstance(name, basestring) for name in orderby)):
+        key = columns[0][orderby]
+    else:
+        key = orderby
+
+    n = len(key)
+    starts = _run_starts(key)
+
+    # the start of each rank, and the first boundary between runs at or after it.
+    info = comm.allgather((n, key[:1], key[-1:], len(starts), starts[1:2]))
+    offset = numpy.cumsum([0] + [i[0] for i in info])
+
+    cuts = []
+    last = None
+    for r, (nr, first, lastr, nruns, second) in enumerate(info):
+        if nr == 0:
+            cuts.append(None)
+            continue
+        if last is None or (first != last).any():
+            cuts.append(offset[r])
+        elif nruns > 1:
+            cuts.append(offset[r] + second[0])
+        else:
+            cuts.append(None)
+        last = lastr
+
+    newstart = offset[-1]
+    for r in range(comm.rank, comm.size):
+        if cuts[r] is not None:
+            newstart = cuts[r]
+            break
+    newstarts = comm.allgather(newstart)
+    newend = newstarts[comm.rank + 1] if comm.rank + 1 < comm.size else offset[-1]
+
+    result = []
+    for column in columns:
+        out = numpy.empty((newend - newstart,) + column.shape[1:], dtype=column.dtype)
+        result.append(take(column, numpy.arange(newstart, newend, dtype='intp'), comm, out=out))
+
+    if isinstance(source, (list, tuple)):
+        return result
+    return result[0]
+
+def _run_starts(key):
+    """ The offsets of the runs of equal items in a sorted local array. """
+    if len(key) == 0:
+        return numpy.zeros(0, dtype='intp')
+    flag = numpy.empty(len(key), dtype='?')
+    flag[0] = True
+    flag[1:] = key[1:] != key[:-1]
+    return flag.nonzero()[0]
+
+def _reduce_runs(key, values, op, comm):
+    """ Reduce the runs of equal keys of a sorted distributed array.
+        A run crossing ranks is reduced onto the rank where it starts.
+    """
+    starts = _run_starts(key)
+    ukey = key[starts]
+    counts = numpy.diff(numpy.append(starts, len(key)))
+    if values is not None and len(starts) > 0:
+        reduced = op.reduceat(values, starts, axis=0)
+    elif values is not None:
+        reduced = values[:0].copy()
+    else:
+        reduced = None
+
+    # the first run of each rank may continue the last run of a previous rank.
+    info = comm.allgather((len(key), key[:1], key[-1:], len(starts), counts[:1],
+        None if reduced is None else reduced[:1]))
+
+    keep = numpy.ones(len(starts), dtype='?')
+    owner = None
+    last = None
+    for r, (n, first, lastr, nruns, count, partial) in enumerate(info):
+        if n == 0:
+            continue
+        if last is not None and (first == last).all():
+            if r == comm.rank:
+                keep[0] = False
+            if owner == comm.rank:
+                counts[-1] += count[0]
+                if reduced is not None:
+                    reduced[-1] = op(reduced[-1], partial[0])
+            if nruns > 1:
+                owner = r
+        else:
+            owner = r
+        last = lastr
+
+    if reduced is not None:
+        reduced = reduced[keep]
+    return ukey[keep], counts[keep], reduced
+
+def sort_external(source, out, comm, orderby=None, memory=1024 * 1024 * 1024, scratch=None,
+        tuning=[], nthreads=None):
+    """
+        Sort an array that does not fit in memory, e.g. a numpy.memmap,
+        into out, with a bound on the memory per rank.
+
+        The local source is sorted in chunks into runs on a scratch file;
+        the runs are then merged in rounds, where each round selects the
+        next piece of the output of every rank from the runs and sorts it
+        with :func:`sort`. The pieces of a round are made small enough that
+        no rank loads more than a chunk from its runs.
+
+        Parameters
+        ----------
+        source : array, 1d, distributed, usually a numpy.memmap.
+
+        out : array, 1d, distributed, usually a numpy.memmap.
+            the total length must be the same as source.
+
+        orderby : string, list of strings or None
+            the fields of source to order by; None for source itself.
+
+        memory : int
+            bytes of memory per rank for the items; the scratch file is
+            as large as the local source.
+
+        scratch : string or None
+            the directory of the scratch file; None for the default temporary
+            directory.
+
+        Returns
+        -------
+            out
+
+    """
+    import tempfile
+    import shutil
+    from mpi4py import MPI
+
+    _isort_wait()
+    total = comm.allreduce(len(source))
+    if total != comm.allreduce(len(out)):
+        raise ValueError("total size of source and out is different")
+
+    chunksize = max(1, memory // (4 * source.dtype.itemsize))
+
+    tmpdir = tempfile.mkdtemp(dir=scratch)
+    try:
+        runs = _scratch(tmpdir + '/runs', source.dtype, len(source))
+        if orderby is None:
+            keys = runs
+        else:
+            keys = _scratch(tmpdir + '/keys', _key(source[:0], orderby).dtype, len(source))
+
+        # sorted runs of the local items, and their keys.
+        for start in range(0, len(source), chunksize):
+            chunk = numpy.array(source[start:start + chunksize])
+            sort(chunk, orderby=orderby, comm=MPI.COMM_SELF, tuning=tuning, nthreads=nthreads)
+            runs[start:start + len(chunk)] = chunk
+            if orderby is not None:
+                keys[start:start + len(chunk)] = _key(chunk, orderby)
+
+        runs = [runs[start:start + chunksize] for start in range(0, len(source), chunksize)]
+        keys = [keys[start:start + chunksize] for start in range(0, len(source), chunksize)]
+
+        outsizes = numpy.array(comm.allgather(len(out)), dtype='intp')
+        outstarts = numpy.cumsum(outsizes) - outsizes
+
+        done = 0
+        lopos = _select_runs(keys, outstarts, total, comm)
+        step = chunksize
+        while done < outsizes.max():
+            # the pieces of the output of all ranks in this round; a rank loads the items
+            # of the pieces from its runs, which may be many more than a piece if the
+            # keys are clustered, thus the pieces shrink until every rank fits its chunk.
+            while True:
+                lo = outstarts + numpy.minimum(done, outsizes)
+                hi = outstarts + numpy.minimum(done + step, outsizes)
+                hipos = _select_runs(keys, hi, total, comm)
+                load = comm.allreduce(int((hipos - lopos).sum()), op=MPI.MAX)
+                if load <= chunksize or step == 1:
+                    break
+                step = max(1, step * chunksize // load)
+
+            items = [run[lopos[r, k]:hipos[r, k]]
+                    for r in range(comm.size)
+                    for k, run in enumerate(runs)]
+            items = numpy.concatenate(items) if len(items) else source[:0].copy()
+
+            result = numpy.empty(hi[comm.rank] - lo[comm.rank], dtype=source.dtype)
+            sort(items, orderby=orderby, out=result, comm=comm, tuning=tuning, nthreads=nthreads)
+            out[lo[comm.rank] - outstarts[comm.rank]:hi[comm.rank] - outstarts[comm.rank]] = result
+
+            done += step
+            lopos = hipos
+            step = chunksize
+
+        del runs, keys
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+    return out
+
+def _key(array, orderby):
+    """ The key of array ordered by orderby, with packed fields. """
+    if orderby is None:
+        return array
+    return repack_fields(array[orderby])
+
+def _scratch(filename, dtype, size):
+    """ A scratch array of size items on a file. """
+    array = numpy.memmap(filename, mode='w+', dtype=dtype, shape=(max(1, size),))
+    return array[:size]
+
+def _select_runs(keys, targets, total, comm):
+    """ The offsets that split the sorted runs of keys of all ranks at
+        the global ranks in targets; ties are split in the order of ranks
+        and runs. Returns an array of (len(targets), len(keys)).
+    """
+    ntargets = len(targets)
+    nruns = len(keys)
+    lengths = numpy.array([len(key) for key in keys], dtype='intp')
+
+    lo = numpy.zeros((ntargets, nruns), dtype='intp')
+    hi = numpy.tile(lengths, (ntargets, 1))
+    clt = numpy.zeros((ntargets, nruns), dtype='intp')
+    cle = numpy.zeros((ntargets, nruns), dtype='intp')
+    done = numpy.asarray(targets) >= total
+    # every item is before the end of the array.
+    clt[done] = lengths
+    cle[done] = lengths
+
+    while not done.all():
+        # propose the middle of the largest window of each target,
+        # weighted by the number of items left in the windows.
+        weight = numpy.where(done, 0, (hi - lo).sum(axis=1))
+        proposals = []
+        for t in range(ntargets):
+            if weight[t] == 0:
+                proposals.append(None)
+                continue
+            k = (hi[t] - lo[t]).argmax()
+            proposals.append(keys[k][(lo[t, k] + hi[t, k]) // 2:][:1].copy())
+
+        allproposals = comm.allgather(proposals)
+        allweights = comm.allgather(weight)
+
+        for t in range(ntargets):
+            if done[t]:
+                continue
+            candidates = [(w[t], p[t]) for w, p in zip(allweights, allproposals) if w[t] > 0]
+            values = numpy.concatenate([p for w, p in candidates])
+            w = numpy.array([w for w, p in candidates])
+            order = numpy.argsort(values, kind='stable')
+            median = order[numpy.searchsorted(numpy.cumsum(w[order]), w.sum() // 2, side='right').clip(max=len(order) - 1)]
+            pivot = values[median:median + 1]
+            for k, key in enumerate(keys):
+                clt[t, k] = numpy.searchsorted(key, pivot, side='left')[0]
+                cle[t, k] = numpy.searchsorted(key, pivot, side='right')[0]
+
+        active = ~done
+        CLT = comm.allreduce(numpy.where(active, clt.sum(axis=1), 0))
+        CLE = comm.allreduce(numpy.where(active, cle.sum(axis=1), 0))
+
+        for t in range(ntargets):
+            if done[t]:
+                continue
+            if targets[t] < CLT[t]:
+                hi[t] = numpy.minimum(hi[t], clt[t])
+            elif targets[t] >= CLE[t]:
+                lo[t] = numpy.maximum(lo[t], cle[t])
+            else:
+                done[t] = True
+
+    # split the ties of the pivot in the order of ranks and runs.
+    eq = cle - clt
+    need = numpy.asarray(targets) - comm.allreduce(clt.sum(axis=1))
+    before = comm.allgather(eq.sum(axis=1))
+    need = need - sum(before[:comm.rank], numpy.zeros(ntargets, dtype='intp'))
+    need = need[:, None] - (numpy.cumsum(eq, axis=1) - eq)
+    return clt + numpy.clip(need, 0, eq)
+
 def globalrange(array, comm):
     """
         The start and end of local chunk in the global array
@@ -141,12 +917,7 @@ def permute(source, argindex, comm, out=None):
     if out is None:
         out = numpy.empty(len(argindex), guess_dtype(source))
 
-    originind = globalindices(argindex, comm)
-    originind2 = numpy.empty(len(source), dtype=originind.dtype)
-
-    sort(originind, orderby=argindex, out=originind2, comm=comm)
-    sort(source, orderby=originind2, out=out, comm=comm)
-    return out
+    return take(source, argindex, comm, out=out)
 
 def histogram(array, bins, comm, right=False):
     """
@@ -177,28 +948,54 @@ def take(source, argindex, comm, out=None):
         source[argindex] distributed as argindex. argindex does not have to
         be a permutation, nor unique.
 
-    """
-    nlocal = len(source)
-    start, end = globalrange(source, comm)
-
-    # find number of selections made from my rank
-    bins = comm.allgather(end)
-    h = histogram(argindex, bins, comm)
-    # nactive has number of selected objects from this rank.
-    nactive = h[comm.rank]
+        The rank holding each selection is computed from the partition of
+        source; the indices are sent there and the items sent back, with
+        one Alltoallv each way.
 
+    """
     if out is None:
         out = numpy.empty(len(argindex), guess_dtype(source))
 
-    originind = globalindices(argindex, comm)
+    if comm.allreduce(len(out) != len(argindex)):
+        # bring argindex to the partition of out first.
+        argindex = take(argindex, globalindices(out, comm), comm)
 
-    myargindex = numpy.empty(nactive, dtype=guess_dtype(argindex))
-    myoriginind = numpy.empty(nactive, dtype=originind.dtype)
+    start, end = globalrange(source, comm)
+    bins = numpy.array(comm.allgather(end), dtype='intp')
 
-    sort(originind, orderby=argindex, out=myoriginind, comm=comm)
-    sort(argindex, orderby=argindex, out=myargindex, comm=comm)
+    argindex = numpy.asarray(argindex, dtype='intp')
+    if comm.allreduce(bool(((argindex < 0) | (argindex >= bins[-1])).any())):
+        raise IndexError("argindex is out of range for %d items" % bins[-1])
 
-    myresult = source[myargindex - start]
+    # bucket the indices by the rank holding them.
+    dest = numpy.searchsorted(bins, argindex, side='right')
+    sendcounts = numpy.bincount(dest, minlength=comm.size)
+    order = numpy.argsort(dest, kind='stable')
 
-    sort(myresult, orderby=myoriginind, out=out, comm=comm)
+    request, recvcounts = _alltoallv(argindex[order], sendcounts, comm)
+    reply, _ = _alltoallv(source[request - start], recvcounts, comm)
+    out[order] = reply
     return out
+
+def _alltoallv(array, sendcounts, comm):
+    """ Exchange the items of array; sendcounts[i] items go to rank i,
+        in order. Returns the received items and the received counts.
+    """
+    from mpi4py import MPI
+
+    array = numpy.ascontiguousarray(array)
+    sendcounts = numpy.array(sendcounts, dtype='intp')
+    recvcounts = numpy.array(comm.alltoall(list(sendcounts)), dtype='intp')
+
+    result = numpy.empty((recvcounts.sum(),) + array.shape[1:], dtype=array.dtype)
+    itemsize = array.dtype.itemsize * int(numpy.prod(array.shape[1:], dtype='intp'))
+
+    # items of any size, counted in items to avoid overflowing the byte counts.
+    datatype = MPI.BYTE.Create_contiguous(itemsize).Commit()
+    try:
+        comm.Alltoallv(
+            (array.reshape(-1).view('u1'), (sendcounts, numpy.cumsum(sendcounts) - sendcounts), datatype),
+            (result.reshape(-1).view('u1'), (recvcounts, numpy.cumsum(recvcounts) - recvcounts), datatype))
+    finally:
+        datatype.Free()
+    return result, recvcounts
@@ -0,0 +1,183 @@
+"""
+    Benchmarks of the python interface of mpsort.
+
+    Run with mpirun, once per number of ranks, and collect the results:
+
+    .. code::
+
+        for n in 1 2 4 8; do
+            mpirun -n $n python -m mpsort.bench --scaling strong --size 10000000 >> results.jsonl
+        done
+
+    Each configuration writes one line of JSON per repeat on the first rank,
+    with the elapsed seconds and the seconds of the phases of the sort (the
+    maximum over the ranks), such that the results of runs of different
+    versions or number of ranks can be compared phase by phase.
+
+"""
+import numpy
+import json
+import sys
+import time
+import argparse
+from itertools import product
+
+import mpsort
+
+TUNINGS = [
+    'DISABLE_SPARSE_ALLTOALLV',
+    'REQUIRE_SPARSE_ALLTOALLV',
+    'REQUIRE_GATHER_SORT',
+    'DISABLE_GATHER_SORT',
+    'ENABLE_SPLITTER_SAMPLING',
+    'ENABLE_INTERPOLATION_SEARCH',
+    'ENABLE_KEY_INDEX_SORT',
+    'DISABLE_CHECKSUM',
+    'ENABLE_FAST_CHECKSUM',
+    'ENABLE_CHECK_SORTED',
+    'REQUIRE_HIERARCHICAL_ALLTOALLV',
+    'DISABLE_SHARED_MEMORY_GATHER',
+    'ENABLE_PIPELINE',
+    'ENABLE_INCREMENTAL',
+    'ENABLE_STABLE',
+]
+
+DISTRIBUTIONS = ['uniform', 'normal', 'duplicates', 'sorted', 'reversed', 'nearly-sorted']
+
+OPERATIONS = ['sort', 'permute', 'take']
+
+def make_keys(distribution, dtype, size, comm, seed=0):
+    """ Local keys of a distribution; the keys of the ranks together
+        form the global array. """
+    rng = numpy.random.RandomState(seed + comm.rank)
+    dtype = numpy.dtype(dtype)
+    if dtype.kind == 'f':
+        scale = 1.0
+    else:
+        scale = float(numpy.iinfo(dtype).max // 2)
+
+    if distribution == 'uniform':
+        keys = rng.uniform(size=size)
+    elif distribution == 'normal':
+        # most of the keys are near the middle of the range.
+        keys = (rng.normal(size=size) * 0.01 + 0.5).clip(0, 1)
+    elif distribution == 'duplicates':
+        keys = rng.randint(0, 16, size=size) / 16.
+    elif distribution in ('sorted', 'reversed', 'nearly-sorted'):
+        start = comm.scan(size) - size
+        total = comm.allreduce(size)
+        keys = (numpy.arange(start, start + size) + 0.5) / max(total, 1)
+        if distribution == 'reversed':
+            keys = 1 - keys
+        elif distribution == 'nearly-sorted':
+            swap = rng.randint(0, max(size, 1), size=(size // 100, 2))
+            keys[swap[:, 0]], keys[swap[:, 1]] = keys[swap[:, 1]], keys[swap[:, 0]]
+    else:
+        raise ValueError("unknown distribution %s" % distribution)
+
+    return numpy.array(keys * scale, dtype=dtype)
+
+def make_records(keys, record_bytes):
+    """ Records of record_bytes with the key in front; keys if record_bytes is
+        not larger than the key. """
+    if record_bytes <= keys.dtype.itemsize:
+        return keys
+    records = numpy.zeros(len(keys), dtype=[('key', keys.dtype),
+            ('payload', ('u1', record_bytes - keys.dtype.itemsize))])
+    records['key'] = keys
+    return records
+
+def run(operation, data, comm, tuning):
+    """ Run an operation once; returns the elapsed seconds and the phases. """
+    comm.barrier()
+    t0 = time.time()
+    phases = {}
+    if operation == 'sort':
+        orderby = 'key' if data.dtype.names else None
+        out = numpy.empty_like(data)
+        mpsort.sort(data, orderby=orderby, out=out, comm=comm, tuning=tuning)
+        phases = mpsort.last_run_stats()['phases']
+    elif operation in ('permute', 'take'):
+        total = comm.allreduce(len(data))
+        if operation == 'permute':
+            # reverses the array, such that all items move.
+            start = comm.scan(len(data)) - len(data)
+            argindex = total - 1 - numpy.arange(start, start + len(data))
+            mpsort.permute(data, argindex, comm)
+        else:
+            rng = numpy.random.RandomState(comm.rank)
+            argindex = rng.randint(0, max(total, 1), size=len(data))
+            mpsort.take(data, argindex, comm)
+    else:
+        raise ValueError("unknown operation %s" % operation)
+
+    elapsed = max(comm.allgather(time.time() - t0))
+
+    # the ranks may run different phases, e.g. in the gather sort.
+    allphases = {}
+    for rankphases in comm.allgather(phases):
+        for name, value in rankphases.items():
+            allphases[name] = max(allphases.get(name, 0), value)
+    return elapsed, allphases
+
+def main(argv=None, comm=None, stream=None):
+    """ Run the benchmarks of the arguments in argv; returns the results
+        as a list of dicts. The first rank writes them as lines of JSON to stream. """
+    from mpi4py import MPI
+
+    if comm is None:
+        comm = MPI.COMM_WORLD
+    if stream is None:
+        stream = sys.stdout
+
+    parser = argparse.ArgumentParser(prog='python -m mpsort.bench', description=__doc__,
+            formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scaling', choices=['weak', 'strong'], default='weak',
+            help='size is the items per rank (weak) or the total items (strong)')
+    parser.add_argument('--size', type=int, default=1000000)
+    parser.add_argument('--operation', nargs='+', choices=OPERATIONS, default=['sort'])
+    parser.add_argument('--dtype', nargs='+', default=['i8'],
+            help='dtypes of the key')
+    parser.add_argument('--record-bytes', nargs='+', type=int, default=[0],
+            help='bytes of a record holding the key; 0 for the key alone')
+    parser.add_argument('--distribution', nargs='+', choices=DISTRIBUTIONS, default=['uniform'])
+    parser.add_argument('--tuning', nargs='+', default=None,
+            help='tuning options to run one at a time, besides no options; default all')
+    parser.add_argument('--repeat', type=int, default=3)
+    ns = parser.parse_args(argv)
+
+    if ns.scaling == 'weak':
+        size = ns.size
+    else:
+        size = ns.size * (comm.rank + 1) // comm.size - ns.size * comm.rank // comm.size
+
+    tunings = [[]] + [[t] for t in (TUNINGS if ns.tuning is None else ns.tuning)]
+
+    results = []
+    for operation, dtype, record_bytes, distribution in product(
+            ns.operation, ns.dtype, ns.record_bytes, ns.distribution):
+        data = make_records(make_keys(distribution, dtype, size, comm), record_bytes)
+        for tuning in (tunings if operation == 'sort' else [[]]):
+            for i in range(ns.repeat):
+                elapsed, phases = run(operation, data, comm, tuning)
+                result = dict(
+                    operation=operation,
+                    nranks=comm.size,
+                    scaling=ns.scaling,
+                    size=ns.size,
+                    dtype=numpy.dtype(dtype).str,
+                    itemsize=data.dtype.itemsize,
+                    distribution=distribution,
+                    tuning=tuning,
+                    repeat=i,
+                    elapsed=elapsed,
+                    phases=phases,
+                )
+                results.append(result)
+                if comm.rank == 0:
+                    stream.write(json.dumps(result) + '\n')
+                    stream.flush()
+    return results
+
+if __name__ == '__main__':
+    main()
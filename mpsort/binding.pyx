@@ -1,126 +1,366 @@
 #cython: embedsignature=True
 cimport numpy
 cimport libmpi as MPI
-from cpython.mem cimport PyMem_Malloc, PyMem_Realloc, PyMem_Free
+from cpython.mem cimport PyMem_RawMalloc, PyMem_RawFree
 from libc.stddef cimport ptrdiff_t
-from libc.stdint cimport uint64_t, int64_t, uint32_t, int32_t
+from libc.stdint cimport uint64_t, int64_t, uint32_t, int32_t, uint16_t, uint8_t
 from libc.string cimport memcpy
 from libc.stdlib cimport abort
 from libc.stddef cimport ptrdiff_t
 import numpy
+import sys
+import threading
+import queue
 from mpi4py import MPI as pyMPI
 
+# the options, timers and statistics of the library are global;
+# sorts from several threads (e.g. mpsort.isort) take turns.
+# The lock is reentrant, such that a caller can hold it over a sort and its statistics.
+_lock = threading.RLock()
+_nthreads_set = False
+
+# the requests of mpsort.isort run one by one, in order, on a single worker thread.
+# A sort from any other thread first waits for them, since every rank shall run
+# the sorts in the same order; otherwise the worker of one rank and the caller
+# of another would each wait for a collective the other has not entered.
+_isort_queue = None
+_isort_thread = None
+_isort_lock = threading.Lock()
+
+def _isort_worker():
+    while True:
+        func = _isort_queue.get()
+        try:
+            func()
+        finally:
+            _isort_queue.task_done()
+
+def _isort_submit(func):
+    """ Run func on the worker thread of isort, after the functions submitted before. """
+    global _isort_queue, _isort_thread
+    with _isort_lock:
+        if _isort_queue is None:
+            _isort_queue = queue.Queue()
+            _isort_thread = threading.Thread(target=_isort_worker, name='mpsort.isort')
+            _isort_thread.daemon = True
+            _isort_thread.start()
+    _isort_queue.put(func)
+
+def _isort_wait():
+    """ Wait for the pending requests of isort, unless called by the worker;
+        called before the first collective of a sort, select, plan or apply. """
+    if _isort_queue is not None and threading.current_thread() is not _isort_thread:
+        _isort_queue.join()
+
 cdef extern from "mpsort.h":
     int MPSORT_DISABLE_SPARSE_ALLTOALLV
     int MPSORT_DISABLE_GATHER_SORT
     int MPSORT_REQUIRE_GATHER_SORT
     int MPSORT_REQUIRE_SPARSE_ALLTOALLV
+    int MPSORT_ENABLE_SPLITTER_SAMPLING
+    int MPSORT_ENABLE_INTERPOLATION_SEARCH
+    int MPSORT_ENABLE_KEY_INDEX_SORT
+    int MPSORT_DISABLE_CHECKSUM
+    int MPSORT_ENABLE_FAST_CHECKSUM
+    int MPSORT_ENABLE_CHECK_SORTED
+    int MPSORT_REQUIRE_HIERARCHICAL_ALLTOALLV
+    int MPSORT_DISABLE_SHARED_MEMORY_GATHER
+    int MPSORT_ENABLE_PIPELINE
+    int MPSORT_ENABLE_INCREMENTAL
+    int MPSORT_ENABLE_STABLE
 
     void mpsort_mpi_set_options(int options)
     void mpsort_mpi_unset_options(int options)
+    void mpsort_set_nthreads(int nthreads)
+    void mpsort_unset_nthreads()
+    void mpsort_mpi_set_max_buffer_bytes(size_t bytes)
     void mpsort_mpi_newarray(void * base, size_t nmemb, 
             void * outbase, size_t outnmemb,
             size_t size,
-            void (*radix)(void * ptr, void * radix, void * arg),
+            void (*radix)(void * ptr, void * radix, void * arg) noexcept nogil,
             size_t rsize, 
-            void * arg, MPI.MPI_Comm comm)
+            void * arg, MPI.MPI_Comm comm) nogil
+
+    ctypedef struct mpsort_mpi_plan:
+        pass
+
+    struct mpsort_mpi_stats:
+        int niter
+        int sparse
+        int ngroups
+        int groupsize
+        size_t bytes_sent
+        size_t bytes_recv
+        size_t peak_memory
+        int nthreads
+
+    void mpsort_mpi_get_last_run_stats(mpsort_mpi_stats * stats)
+    int mpsort_mpi_get_last_run_nphases()
+    const char * mpsort_mpi_get_last_run_phase(int i, double * elapsed)
+
+    mpsort_mpi_plan * mpsort_mpi_plan_create(const void * base, size_t nmemb,
+            size_t outnmemb,
+            size_t size,
+            void (*radix)(void * ptr, void * radix, void * arg) noexcept nogil,
+            size_t rsize,
+            void * arg, MPI.MPI_Comm comm) nogil
+    void mpsort_mpi_plan_apply(mpsort_mpi_plan * plan,
+            const void * base, void * out, size_t size) nogil
+    void mpsort_mpi_plan_apply_inverse(mpsort_mpi_plan * plan,
+            const void * base, void * out, size_t size) nogil
+    void mpsort_mpi_plan_free(mpsort_mpi_plan * plan)
+
+    void mpsort_mpi_select(const void * base, size_t nmemb,
+            size_t size,
+            void (*radix)(void * ptr, void * radix, void * arg) noexcept nogil,
+            size_t rsize,
+            void * arg,
+            const ptrdiff_t * ranks, int nranks,
+            void * out, MPI.MPI_Comm comm) nogil
+
+    void mpsort_mpi_argsort(const void * base, size_t nmemb,
+            size_t size,
+            void (*radix)(void * ptr, void * radix, void * arg) noexcept nogil,
+            size_t rsize,
+            void * arg,
+            ptrdiff_t * out, size_t outnmemb,
+            MPI.MPI_Comm comm) nogil
 
 # Use the Python memory allocator for large allocations.
+# The raw allocator does not need the GIL, which is released during the sort.
 #
 cdef extern from "mp-mpiu.h":
-    ctypedef void * (*mpiu_malloc_func)(const char * name, size_t size, const char * file, const int line, void * userdata) except? NULL
-    ctypedef void (*mpiu_free_func)(void * ptr, const char * file, const int line, void * userdata) except*
+    ctypedef void * (*mpiu_malloc_func)(const char * name, size_t size, const char * file, const int line, void * userdata) noexcept nogil
+    ctypedef void (*mpiu_free_func)(void * ptr, const char * file, const int line, void * userdata) noexcept nogil
     void MPIU_SetMalloc(mpiu_malloc_func malloc, mpiu_free_func free, void * userdata)
 
-cdef void * pymalloc(const char * name, size_t size, const char * file, const int line, void * userdata) except? NULL:
-    return PyMem_Malloc(size)
+cdef void * pymalloc(const char * name, size_t size, const char * file, const int line, void * userdata) noexcept nogil:
+    return PyMem_RawMalloc(size)
 
-cdef void pyfree(void * ptr, const char * file, const int line, void * userdata) except*:
-    PyMem_Free(ptr)
+cdef void pyfree(void * ptr, const char * file, const int line, void * userdata) noexcept nogil:
+    PyMem_RawFree(ptr)
 
 MPIU_SetMalloc(pymalloc, pyfree, NULL)
 
 # how to build the radix:
+#
+# The radix is an unsigned integer of the native byte order, rsize bytes long.
+# Each field is transformed to an unsigned integer of its own width that
+# preserves the order: the sign bit of signed integers is flipped;
+# negative floats are inverted and the sign bit of positive floats is set.
+# The fields are placed by significance: the first field of orderby is the most
+# significant; the latter elements in a row of a field are more significant.
+#
+cdef enum:
+    RADIX_UNSIGNED = 0
+    RADIX_SIGNED = 1
+    RADIX_FLOAT = 2
+    MAX_RADIX_FIELDS = 32
+
+cdef struct RadixField:
+    ptrdiff_t offset
+    ptrdiff_t radix_offset
+    ptrdiff_t radix_stride
+    int nmemb
+    int width
+    int kind
+
 cdef struct RadixData:
     void (*radix_func)(const void * ptr, void * radix, void * arg) noexcept nogil
-    ptrdiff_t radix_offset
+    RadixField fields[MAX_RADIX_FIELDS]
+    int nfields
     int elsize
-    int radix_nmemb
+    size_t rsize
 
 cdef radix_data_init(RadixData * self, numpy.dtype dtype, radixkey):
-    cdef numpy.dtype radixdtype
+    cdef RadixField * f
 
     self.elsize = dtype.itemsize
+    self.radix_func = radix_func_fields
 
-    if radixkey is not None:
-        radixdtype, self.radix_offset = dtype.fields[radixkey]
+    if radixkey is None:
+        keys = [(dtype, 0)]
+    elif isinstance(radixkey, (list, tuple)):
+        keys = [dtype.fields[name][:2] for name in radixkey]
     else:
-        radixdtype, self.radix_offset = dtype, 0
+        keys = [dtype.fields[radixkey][:2]]
+
+    # from the most significant to the least significant.
+    scalars = []
+    for radixdtype, offset in keys:
+        _radix_scalars(scalars, radixdtype, offset, radixkey)
+
+    if len(scalars) == 0:
+        raise ValueError("data[%s] has no fields" % (radixkey,))
+    if len(scalars) > MAX_RADIX_FIELDS:
+        raise ValueError("data[%s] has more than %d fields" % (radixkey, MAX_RADIX_FIELDS))
+
+    self.nfields = len(scalars)
+    self.rsize = sum([width * nmemb for offset, width, nmemb, kind in scalars])
+
+    # lay out from the least significant
+    radix_offset = 0
+    for i, (offset, width, nmemb, kind) in enumerate(reversed(scalars)):
+        f = &self.fields[i]
+        f.offset = offset
+        f.width = width
+        f.nmemb = nmemb
+        f.kind = kind
+        if sys.byteorder == 'little':
+            f.radix_offset = radix_offset
+            f.radix_stride = width
+        else:
+            f.radix_offset = self.rsize - radix_offset - width
+            f.radix_stride = -width
+        radix_offset += width * nmemb
+
+cdef _radix_scalars(list scalars, radixdtype, offset, radixkey):
+    """ append (offset, width, nmemb, kind) of the scalar fields of radixdtype
+        to scalars, the most significant first. """
+    if radixdtype.names is not None:
+        for name in radixdtype.names:
+            subdtype, suboffset = radixdtype.fields[name][:2]
+            _radix_scalars(scalars, subdtype, offset + suboffset, radixkey)
+        return
 
     if len(radixdtype.shape) == 0:
-        self.radix_nmemb = 1
+        nmemb = 1
     elif len(radixdtype.shape) == 1:
-        self.radix_nmemb = radixdtype.shape[0]
+        nmemb = radixdtype.shape[0]
     else:
-        raise ValueError("data[%s] is not 1d nor 2d %s" % (radixkey))
-
-    #print 'radix offset =', self.radix_offset
-    #print 'radix nmemb =', self.radix_nmemb
-    #print 'radix dtype.shape = ', radixdtype.shape
-    if radixdtype.base == numpy.dtype('u8'):
-        self.radix_func = radix_func_u8
-    elif radixdtype.base == numpy.dtype('i8'):
-        self.radix_func = radix_func_i8
-    elif radixdtype.base == numpy.dtype('u4'):
-        self.radix_func = radix_func_u4
-    elif radixdtype.base == numpy.dtype('i4'):
-        self.radix_func = radix_func_i4
+        raise ValueError("data[%s] is not 1d nor 2d" % (radixkey,))
+
+    base = radixdtype.base
+    if base.kind in 'ub' and base.itemsize in (1, 2, 4, 8):
+        kind = RADIX_UNSIGNED
+    elif base.kind == 'i' and base.itemsize in (1, 2, 4, 8):
+        kind = RADIX_SIGNED
+    elif base.kind == 'f' and base.itemsize in (2, 4, 8):
+        kind = RADIX_FLOAT
     else:
-        raise TypeError("data[%s] is not u8 or i8" % (radixkey))
+        raise TypeError("data[%s] of %s is not an integer or a float" % (radixkey, base))
+
+    scalars.append((offset, base.itemsize, nmemb, kind))
+
+cdef inline void radix_transform(const char * ptr, char * rptr, int width, int kind) noexcept nogil:
+    cdef uint8_t v1
+    cdef uint16_t v2
+    cdef uint32_t v4
+    cdef uint64_t v8
+    if width == 8:
+        memcpy(&v8, ptr, 8)
+        if kind == RADIX_SIGNED:
+            v8 ^= (<uint64_t> 1) << 63
+        elif kind == RADIX_FLOAT:
+            if v8 >> 63:
+                v8 = ~v8
+            else:
+                v8 ^= (<uint64_t> 1) << 63
+        memcpy(rptr, &v8, 8)
+    elif width == 4:
+        memcpy(&v4, ptr, 4)
+        if kind == RADIX_SIGNED:
+            v4 ^= (<uint32_t> 1) << 31
+        elif kind == RADIX_FLOAT:
+            if v4 >> 31:
+                v4 = ~v4
+            else:
+                v4 ^= (<uint32_t> 1) << 31
+        memcpy(rptr, &v4, 4)
+    elif width == 2:
+        memcpy(&v2, ptr, 2)
+        if kind == RADIX_SIGNED:
+            v2 ^= <uint16_t> 0x8000
+        elif kind == RADIX_FLOAT:
+            if v2 >> 15:
+                v2 = ~v2
+            else:
+                v2 ^= <uint16_t> 0x8000
+        memcpy(rptr, &v2, 2)
+    else:
+        v1 = (<const uint8_t *> ptr)[0]
+        if kind == RADIX_SIGNED:
+            v1 ^= <uint8_t> 0x80
+        rptr[0] = <char> v1
 
-cdef void radix_func_u8(const void * ptr, void * radix, void * arg) noexcept nogil:
-    cdef RadixData *radixdata = <RadixData*> arg
-    cdef char * rptr = <char*>radix
-    cdef char * cptr = <char*> ptr
-    cdef uint64_t value
-    for i in range(radixdata.radix_nmemb):
-        value = (<uint64_t *> (cptr + radixdata.radix_offset))[i]
-        memcpy(rptr, &value, 8)
-        rptr += 8
-
-cdef void radix_func_i8(const void * ptr, void * radix, void * arg) noexcept nogil:
-    cdef RadixData *radixdata = <RadixData*> arg
-    cdef char * rptr = <char*>radix
-    cdef char * cptr = <char*> ptr
-    cdef uint64_t value
-    for i in range(radixdata.radix_nmemb):
-        value = (<int64_t *> (cptr + radixdata.radix_offset))[i]
-        value += <uint64_t> 9223372036854775808uL
-        memcpy(rptr, &value, 8)
-        rptr += 8
-
-cdef void radix_func_u4(const void * ptr, void * radix, void * arg) noexcept nogil:
-    cdef RadixData *radixdata = <RadixData*> arg
-    cdef char * rptr = <char*>radix
-    cdef char * cptr = <char*> ptr
-    cdef uint64_t value
-    for i in range(radixdata.radix_nmemb):
-        value = (<uint32_t *> (cptr + radixdata.radix_offset))[i]
-        memcpy(rptr, &value, 8)
-        rptr += 8
-
-cdef void radix_func_i4(const void * ptr, void * radix, void * arg) noexcept nogil:
+cdef void radix_func_fields(const void * ptr, void * radix, void * arg) noexcept nogil:
     cdef RadixData *radixdata = <RadixData*> arg
     cdef char * rptr = <char*>radix
-    cdef char * cptr = <char*> ptr
-    cdef uint64_t value
-    for i in range(radixdata.radix_nmemb):
-        value = (<int32_t *> (cptr + radixdata.radix_offset))[i]
-        value += <uint64_t> 9223372036854775808uL
-        memcpy(rptr, &value, 8)
-        rptr += 8
-
-def sort(numpy.ndarray data, orderby=None, numpy.ndarray out=None, comm=None, tuning=[]):
+    cdef const char * cptr = <const char*> ptr
+    cdef RadixField * f
+    cdef int i, j
+    for i in range(radixdata.nfields):
+        f = &radixdata.fields[i]
+        for j in range(f.nmemb):
+            radix_transform(cptr + f.offset + j * f.width,
+                    rptr + f.radix_offset + j * f.radix_stride,
+                    f.width, f.kind)
+
+cdef MPI.MPI_Comm _mpicomm(comm) except *:
+    if comm is pyMPI.COMM_WORLD:
+        return MPI.MPI_COMM_WORLD
+    if isinstance(comm, pyMPI.Comm):
+        if hasattr(pyMPI, '_addressof'):
+            return (<MPI.MPI_Comm*> (<numpy.intp_t>
+                    pyMPI._addressof(comm))) [0]
+        else:
+            raise ValueError("only comm=None is supported, "
+                    + " update mpi4py to a version with MPI._addressof")
+    else:
+        raise ValueError("only MPI.Comm objects are supported")
+
+cdef _set_tuning(tuning, nthreads, max_buffer_bytes):
+    # hope that GIL ensures nobody will mess with the options
+
+    mpsort_mpi_unset_options(-1)
+
+    if 'DISABLE_SPARSE_ALLTOALLV' in tuning:
+        mpsort_mpi_set_options(MPSORT_DISABLE_SPARSE_ALLTOALLV)
+    if 'DISABLE_GATHER_SORT' in tuning:
+        mpsort_mpi_set_options(MPSORT_DISABLE_GATHER_SORT)
+    if 'REQUIRE_GATHER_SORT' in tuning:
+        mpsort_mpi_set_options(MPSORT_REQUIRE_GATHER_SORT)
+    if 'REQUIRE_SPARSE_ALLTOALLV' in tuning:
+        mpsort_mpi_set_options(MPSORT_REQUIRE_SPARSE_ALLTOALLV)
+    if 'ENABLE_SPLITTER_SAMPLING' in tuning:
+        mpsort_mpi_set_options(MPSORT_ENABLE_SPLITTER_SAMPLING)
+    if 'ENABLE_INTERPOLATION_SEARCH' in tuning:
+        mpsort_mpi_set_options(MPSORT_ENABLE_INTERPOLATION_SEARCH)
+    if 'ENABLE_KEY_INDEX_SORT' in tuning:
+        mpsort_mpi_set_options(MPSORT_ENABLE_KEY_INDEX_SORT)
+    if 'DISABLE_CHECKSUM' in tuning:
+        mpsort_mpi_set_options(MPSORT_DISABLE_CHECKSUM)
+    if 'ENABLE_FAST_CHECKSUM' in tuning:
+        mpsort_mpi_set_options(MPSORT_ENABLE_FAST_CHECKSUM)
+    if 'ENABLE_CHECK_SORTED' in tuning:
+        mpsort_mpi_set_options(MPSORT_ENABLE_CHECK_SORTED)
+    if 'REQUIRE_HIERARCHICAL_ALLTOALLV' in tuning:
+        mpsort_mpi_set_options(MPSORT_REQUIRE_HIERARCHICAL_ALLTOALLV)
+    if 'DISABLE_SHARED_MEMORY_GATHER' in tuning:
+        mpsort_mpi_set_options(MPSORT_DISABLE_SHARED_MEMORY_GATHER)
+    if 'ENABLE_PIPELINE' in tuning:
+        mpsort_mpi_set_options(MPSORT_ENABLE_PIPELINE)
+    if 'ENABLE_INCREMENTAL' in tuning:
+        mpsort_mpi_set_options(MPSORT_ENABLE_INCREMENTAL)
+    if 'ENABLE_STABLE' in tuning:
+        mpsort_mpi_set_options(MPSORT_ENABLE_STABLE)
+
+    # None keeps the setting of the C library, MPSORT_NTHREADS or 1 by default;
+    # only undo the nthreads of an earlier call from here.
+    global _nthreads_set
+    if nthreads is not None:
+        mpsort_set_nthreads(nthreads)
+        _nthreads_set = True
+    elif _nthreads_set:
+        mpsort_unset_nthreads()
+        _nthreads_set = False
+
+    if max_buffer_bytes is None:
+        max_buffer_bytes = 0
+    mpsort_mpi_set_max_buffer_bytes(max_buffer_bytes)
+
+def sort(numpy.ndarray data, orderby=None, numpy.ndarray out=None, comm=None, tuning=[], nthreads=None,
+        max_buffer_bytes=None):
     """
         Parallel sort of distributed data set `data' over MPI Communicator `comm',
         ordered by key given in 'orderby'.
@@ -130,12 +370,15 @@ def sort(numpy.ndarray data, orderby=None, numpy.ndarray out=None, comm=None, tu
         data : numpy.ndarray
             the input data; must be C_contiguous numpy arrays,
 
-        orderby : string or indices
+        orderby : string, list of strings or indices
 
-            data[orderby] must be of integer types.
+            data[orderby] must be of integer or float types.
             data[orderby] can be 2d, in which case the latter elements in a row has
             more significance.
 
+            if orderby is a list of fields, or data[orderby] is a structured
+            type, the first field has the most significance.
+
             if orderby is None, use data itself.
 
         out : numpy.ndarray or None
@@ -149,9 +392,35 @@ def sort(numpy.ndarray data, orderby=None, numpy.ndarray out=None, comm=None, tu
             'DISABLE_GATHER_SORT'
             'REQUIRE_GATHER_SORT'
             'REQUIRE_SPARSE_ALLTOALLV'
+            'ENABLE_SPLITTER_SAMPLING'
+            'ENABLE_INTERPOLATION_SEARCH'
+            'ENABLE_KEY_INDEX_SORT'
+            'DISABLE_CHECKSUM'
+            'ENABLE_FAST_CHECKSUM'
+            'ENABLE_CHECK_SORTED'
+            'REQUIRE_HIERARCHICAL_ALLTOALLV'
+            'DISABLE_SHARED_MEMORY_GATHER'
+            'ENABLE_PIPELINE'
+            'ENABLE_INCREMENTAL'
+            'ENABLE_STABLE'
+
+        nthreads : int or None
+            number of OpenMP threads used by the local sort, histogram and merge
+            on each rank; None for the environment variable MPSORT_NTHREADS or 1,
+            0 or negative for all available threads.
+
+        max_buffer_bytes : int or None
+            bound the memory of the exchange to about this many bytes per rank,
+            plus 8 bytes per item; the exchange runs in several rounds and
+            the output is placed in place. Plans, including those of
+            'ENABLE_KEY_INDEX_SORT', move the items in rounds too, and hold
+            16 more bytes per item for the plan. None for no bound.
     """
     cdef RadixData radixdata
     cdef MPI.MPI_Comm mpicomm
+    cdef void * database
+    cdef void * outbase
+    cdef size_t nmemb, outnmemb, elsize, rsize
 
     # assert you can access the orderby columns.
     key = data[orderby]
@@ -167,18 +436,9 @@ def sort(numpy.ndarray data, orderby=None, numpy.ndarray out=None, comm=None, tu
 
     if comm is None:
         comm = pyMPI.COMM_WORLD
-        mpicomm = MPI.MPI_COMM_WORLD
-    else:
-        if isinstance(comm, pyMPI.Comm):
-            if hasattr(pyMPI, '_addressof'):
-                mpicomm = (<MPI.MPI_Comm*> (<numpy.intp_t>
-                        pyMPI._addressof(comm))) [0]
-            else:
-                raise ValueError("only comm=None is supported, "
-                        + " update mpi4py to a version with MPI._addressof")
-        else:
-            raise ValueError("only MPI.Comm objects are supported")
+    mpicomm = _mpicomm(comm)
 
+    _isort_wait()
     Ntot = comm.allreduce(len(data))
     Ntotout = comm.allreduce(len(out))
 
@@ -190,21 +450,409 @@ def sort(numpy.ndarray data, orderby=None, numpy.ndarray out=None, comm=None, tu
 
     radix_data_init(&radixdata, data.dtype, orderby)
 
-    # hope that GIL ensures nobody will mess with the options
+    database = data.data
+    outbase = out.data
+    nmemb = len(data)
+    outnmemb = len(out)
+    elsize = data.dtype.itemsize
+    rsize = radixdata.rsize
 
-    mpsort_mpi_unset_options(-1)
+    with _lock:
+        _set_tuning(tuning, nthreads, max_buffer_bytes)
+        with nogil:
+            mpsort_mpi_newarray(database, nmemb,
+                    outbase, outnmemb,
+                    elsize, radixdata.radix_func,
+                    rsize, <void*>&radixdata, mpicomm)
 
-    if 'DISABLE_SPARSE_ALLTOALLV' in tuning:
-        mpsort_mpi_set_options(MPSORT_DISABLE_SPARSE_ALLTOALLV)
-    if 'DISABLE_GATHER_SORT' in tuning:
-        mpsort_mpi_set_options(MPSORT_DISABLE_GATHER_SORT)
-    if 'REQUIRE_GATHER_SORT' in tuning:
-        mpsort_mpi_set_options(MPSORT_REQUIRE_GATHER_SORT)
-    if 'REQUIRE_SPARSE_ALLTOALLV' in tuning:
-        mpsort_mpi_set_options(MPSORT_REQUIRE_SPARSE_ALLTOALLV)
 
-    mpsort_mpi_newarray(data.data, len(data),
-            out.data, len(out),
-            data.dtype.itemsize, radixdata.radix_func,
-            radixdata.radix_nmemb * 8, <void*>&radixdata, mpicomm)
+def select(numpy.ndarray data, ranks, orderby=None, comm=None, tuning=[], nthreads=None):
+    """
+        The items at global ranks of distributed data, as if it were
+        sorted by orderby, without moving data.
+
+        Parameters
+        ----------
+        data : numpy.ndarray
+            the input data; see :func:`sort`.
+
+        ranks : array of integers
+            the positions in the sorted data, 0 <= ranks < total size;
+            must be the same on all ranks.
+
+        orderby, comm, tuning, nthreads :
+            see :func:`sort`.
+
+        Returns
+        -------
+        numpy.ndarray of the items of data at ranks, the same on all ranks.
+    """
+    cdef RadixData radixdata
+    cdef MPI.MPI_Comm mpicomm
+    cdef numpy.ndarray cranks
+    cdef numpy.ndarray out
+    cdef void * database
+    cdef void * outbase
+    cdef ptrdiff_t * ranksbase
+    cdef size_t nmemb, elsize, rsize
+    cdef int nranks
+
+    # assert you can access the orderby columns.
+    key = data[orderby]
+
+    if not data.flags['C_CONTIGUOUS']:
+        raise ValueError("data must be C_CONTIGUOUS")
+
+    if comm is None:
+        comm = pyMPI.COMM_WORLD
+    mpicomm = _mpicomm(comm)
+
+    _isort_wait()
+    Ntot = comm.allreduce(len(data))
+
+    cranks = numpy.array(ranks, dtype='intp').ravel()
+    if ((cranks < 0) | (cranks >= Ntot)).any():
+        raise ValueError("ranks are out of range [0, %d)" % Ntot)
+
+    out = numpy.empty(len(cranks), dtype=data.dtype)
+
+    radix_data_init(&radixdata, data.dtype, orderby)
+
+    database = data.data
+    outbase = out.data
+    ranksbase = <ptrdiff_t*> cranks.data
+    nranks = len(cranks)
+    nmemb = len(data)
+    elsize = data.dtype.itemsize
+    rsize = radixdata.rsize
+
+    with _lock:
+        _set_tuning(tuning, nthreads, None)
+        with nogil:
+            mpsort_mpi_select(database, nmemb,
+                    elsize, radixdata.radix_func,
+                    rsize, <void*>&radixdata,
+                    ranksbase, nranks, outbase, mpicomm)
+
+    return out
+
+def argsort(numpy.ndarray data, numpy.ndarray out, orderby=None, comm=None, tuning=[], nthreads=None):
+    """
+        The global indices of the items of distributed data in the order of
+        a stable sort by orderby, without moving data.
+
+        Parameters
+        ----------
+        data : numpy.ndarray
+            the input data; see :func:`sort`.
+
+        out : numpy.ndarray of intp
+            the output indices; the total size must be the same as data.
+
+        orderby, comm, tuning, nthreads :
+            see :func:`sort`.
+    """
+    cdef RadixData radixdata
+    cdef MPI.MPI_Comm mpicomm
+    cdef void * database
+    cdef ptrdiff_t * outbase
+    cdef size_t nmemb, outnmemb, elsize, rsize
+
+    # assert you can access the orderby columns.
+    key = data[orderby]
+
+    if not data.flags['C_CONTIGUOUS']:
+        raise ValueError("data must be C_CONTIGUOUS")
+
+    if not out.flags['C_CONTIGUOUS'] or out.dtype != numpy.dtype('intp'):
+        raise ValueError("out must be C_CONTIGUOUS of intp")
+
+    if comm is None:
+        comm = pyMPI.COMM_WORLD
+    mpicomm = _mpicomm(comm)
+
+    _isort_wait()
+    Ntot = comm.allreduce(len(data))
+    Ntotout = comm.allreduce(len(out))
+
+    if Ntot != Ntotout:
+        raise ValueError("total size of array changed %d != %d" % (Ntot, Ntotout))
+
+    radix_data_init(&radixdata, data.dtype, orderby)
+
+    database = data.data
+    outbase = <ptrdiff_t*> out.data
+    nmemb = len(data)
+    outnmemb = len(out)
+    elsize = data.dtype.itemsize
+    rsize = radixdata.rsize
+
+    with _lock:
+        _set_tuning(tuning, nthreads, None)
+        with nogil:
+            mpsort_mpi_argsort(database, nmemb,
+                    elsize, radixdata.radix_func,
+                    rsize, <void*>&radixdata,
+                    outbase, outnmemb, mpicomm)
+
+cdef int radix_compare(const unsigned char * r1, const unsigned char * r2, size_t rsize, bint little) noexcept nogil:
+    cdef size_t i, j
+    for j in range(rsize):
+        i = rsize - 1 - j if little else j
+        if r1[i] != r2[i]:
+            return 1 if r1[i] > r2[i] else -1
+    return 0
+
+def radix_compare_item(numpy.ndarray data, numpy.ndarray item, orderby=None):
+    """
+        Compares the items of data with item[0] in the order of :func:`sort`.
+
+        Returns
+        -------
+        numpy.ndarray of int8, -1, 0 or 1 if the item of data is ordered before,
+        the same as, or after item[0].
+    """
+    cdef RadixData radixdata
+    cdef numpy.ndarray result
+    cdef numpy.ndarray radix
+    cdef numpy.ndarray ref
+    cdef char * database
+    cdef unsigned char * radixbase
+    cdef unsigned char * refbase
+    cdef signed char * resultbase
+    cdef size_t i, nmemb, elsize
+    cdef bint little = sys.byteorder == 'little'
+
+    data = numpy.ascontiguousarray(data)
+    item = numpy.ascontiguousarray(item, dtype=data.dtype)
+
+    radix_data_init(&radixdata, data.dtype, orderby)
+
+    radix = numpy.empty(radixdata.rsize, dtype='u1')
+    ref = numpy.empty(radixdata.rsize, dtype='u1')
+    result = numpy.empty(len(data), dtype='i1')
+
+    radixdata.radix_func(item.data, ref.data, &radixdata)
+
+    database = data.data
+    radixbase = <unsigned char*> radix.data
+    refbase = <unsigned char*> ref.data
+    resultbase = <signed char*> result.data
+    nmemb = len(data)
+    elsize = data.dtype.itemsize
+
+    with nogil:
+        for i in range(nmemb):
+            radixdata.radix_func(database + i * elsize, radixbase, &radixdata)
+            resultbase[i] = radix_compare(radixbase, refbase, radixdata.rsize, little)
+
+    return result
+
+def last_run_stats():
+    """
+        Statistics of the last sort or plan on this rank.
+
+        Returns
+        -------
+        dict:
+            'phases' : dict of the elapsed seconds of each phase, in order;
+                the splitter search has a phase per iteration ('bisect0001', ...).
+            'niter' : iterations of the splitter search.
+            'sparse' : True if the exchange used the sparse alltoallv.
+            'ngroups' : number of groups of the gather sort.
+            'groupsize' : number of ranks in the group of this rank.
+            'bytes_sent', 'bytes_recv' : bytes exchanged with other ranks.
+            'peak_memory' : peak bytes of the temporary buffers.
+            'nthreads' : threads of the local sorts.
+    """
+    cdef mpsort_mpi_stats stats
+    cdef double elapsed
+
+    mpsort_mpi_get_last_run_stats(&stats)
+
+    phases = {}
+    for i in range(mpsort_mpi_get_last_run_nphases()):
+        name = mpsort_mpi_get_last_run_phase(i, &elapsed)
+        phases[name.decode()] = elapsed
+
+    return dict(
+        phases=phases,
+        niter=stats.niter,
+        sparse=bool(stats.sparse),
+        ngroups=stats.ngroups,
+        groupsize=stats.groupsize,
+        bytes_sent=stats.bytes_sent,
+        bytes_recv=stats.bytes_recv,
+        peak_memory=stats.peak_memory,
+        nthreads=stats.nthreads,
+    )
+
+cdef class SortPlan:
+    """
+        Records where each item goes in a sort, to reorder other arrays
+        of the same partition in the same way, with a local gather and a single
+        Alltoallv per array.
+
+        Created by :func:`plan`.
+
+        Attributes
+        ----------
+        size : int
+            the local number of items before the sort.
+        outsize : int
+            the local number of items after the sort.
+        comm : MPIComm
+            the communicator.
+    """
+    cdef mpsort_mpi_plan * plan
+    cdef readonly object comm
+    cdef readonly size_t size
+    cdef readonly size_t outsize
+
+    def __dealloc__(self):
+        if self.plan != NULL:
+            mpsort_mpi_plan_free(self.plan)
+
+    def apply(self, data, out=None, inverse=False):
+        """
+            Reorder data as the sorted keys. This is collective.
+
+            Parameters
+            ----------
+            data : array_like, distributed
+                the local length must be `size` (`outsize` if inverse).
+
+            out : array_like or None
+                the output; the local length must be `outsize` (`size` if inverse).
+                if None, a new array is allocated.
+
+            inverse : bool
+                move the items back from the sorted to the original positions.
+
+            Returns
+            -------
+                out
+        """
+        cdef numpy.ndarray cdata
+        cdef numpy.ndarray cout
+        cdef void * database
+        cdef void * outbase
+        cdef size_t elsize
+
+        size, outsize = self.size, self.outsize
+        if inverse:
+            size, outsize = outsize, size
+
+        cdata = numpy.ascontiguousarray(data)
+
+        if out is None:
+            out = numpy.empty((outsize,) + numpy.shape(cdata)[1:], dtype=cdata.dtype)
+
+        if (isinstance(out, numpy.ndarray) and out.flags['C_CONTIGUOUS']
+            and out.dtype == cdata.dtype):
+            cout = out
+        else:
+            # flatiter, strided or of a different dtype; assigned at the end.
+            cout = numpy.empty((len(out),) + numpy.shape(cdata)[1:], dtype=cdata.dtype)
+
+        # all ranks shall agree before entering the exchange.
+        _isort_wait()
+        if self.comm.allreduce(len(cdata) != size):
+            raise ValueError("local size of data does not match the plan")
+        if self.comm.allreduce(len(cout) != outsize):
+            raise ValueError("local size of out does not match the plan")
+
+        elsize = cdata.dtype.itemsize * numpy.prod(numpy.shape(cdata)[1:], dtype='intp')
+
+        if cout.dtype.itemsize * numpy.prod(numpy.shape(cout)[1:], dtype='intp') != elsize:
+            raise ValueError("item size mismatch")
+
+        database = cdata.data
+        outbase = cout.data
+
+        with _lock:
+            if inverse:
+                with nogil:
+                    mpsort_mpi_plan_apply_inverse(self.plan, database, outbase, elsize)
+            else:
+                with nogil:
+                    mpsort_mpi_plan_apply(self.plan, database, outbase, elsize)
+
+        if cout is not out:
+            out[...] = cout
+
+        return out
+
+def plan(numpy.ndarray data, orderby=None, outsize=None, comm=None, tuning=[], nthreads=None,
+        max_buffer_bytes=None):
+    """
+        Plan a parallel sort of distributed data set `data' over MPI Communicator `comm',
+        ordered by key given in 'orderby', without moving the data.
+
+        Parameters
+        ----------
+        data : numpy.ndarray
+            the input data; must be C_contiguous numpy arrays,
+
+        orderby : string or indices
+            as in :func:`sort`.
+
+        outsize : int or None
+            the local number of items after the sort; None for len(data).
+
+        comm, tuning, nthreads, max_buffer_bytes :
+            as in :func:`sort`.
+
+        Returns
+        -------
+            a :class:`SortPlan`.
+    """
+    cdef RadixData radixdata
+    cdef MPI.MPI_Comm mpicomm
+    cdef SortPlan self
+    cdef mpsort_mpi_plan * cplan
+    cdef void * database
+    cdef size_t nmemb, outnmemb, elsize, rsize
+
+    # assert you can access the orderby columns.
+    key = data[orderby]
+
+    if not data.flags['C_CONTIGUOUS']:
+        raise ValueError("data must be C_CONTIGUOUS")
+
+    if outsize is None:
+        outsize = len(data)
+
+    if comm is None:
+        comm = pyMPI.COMM_WORLD
+    mpicomm = _mpicomm(comm)
+
+    _isort_wait()
+    Ntot = comm.allreduce(len(data))
+    Ntotout = comm.allreduce(outsize)
+
+    if Ntot != Ntotout:
+        raise ValueError("total size of array changed %d != %d" % (Ntot, Ntotout))
+
+    radix_data_init(&radixdata, data.dtype, orderby)
 
+    database = data.data
+    nmemb = len(data)
+    outnmemb = outsize
+    elsize = data.dtype.itemsize
+    rsize = radixdata.rsize
+
+    with _lock:
+        _set_tuning(tuning, nthreads, max_buffer_bytes)
+        with nogil:
+            cplan = mpsort_mpi_plan_create(database, nmemb,
+                    outnmemb, elsize, radixdata.radix_func,
+                    rsize, <void*>&radixdata, mpicomm)
+
+    self = SortPlan.__new__(SortPlan)
+    self.plan = cplan
+    self.comm = comm
+    self.size = nmemb
+    self.outsize = outnmemb
+
+    return self
@@ -1,6 +1,7 @@
 import mpsort
 import numpy
-from numpy.testing import assert_array_equal
+import os
+from numpy.testing import assert_array_equal, assert_allclose
 from itertools import product
 import pytest
 from mpi4py import MPI
@@ -82,12 +83,272 @@ def test_sort_u4(comm):
     s.sort()
     assert_array_equal(s, r)
 
+@pytest.mark.parametrize("comm", [MPI.COMM_WORLD,])
+@pytest.mark.parametrize("dtype", ['f2', 'f4', 'f8', 'u1', 'i1', 'u2', 'i2'])
+@pytest.mark.mpi
+def test_sort_dtypes(comm, dtype):
+    s = (numpy.random.random(size=1000) * 200 - 100).astype(dtype)
+    if s.dtype.kind == 'f':
+        s[:4] = [-numpy.inf, numpy.inf, -0.0, 0.0]
+
+    local = split(s, comm)
+    s = heal(local, comm)
+
+    mpsort.sort(local, orderby=None, out=None, comm=comm)
+
+    r = heal(local, comm)
+    s.sort()
+    assert_array_equal(s, r)
+
+@pytest.mark.parametrize("comm", [MPI.COMM_WORLD,])
+@pytest.mark.mpi
+def test_sort_fields(comm):
+    s = numpy.empty(1000, dtype=[
+        ('group', 'u4'),
+        ('mass', 'f4'),
+        ('value', 'i8')])
+
+    numpy.random.seed(1234)
+    s['group'] = numpy.random.randint(0, 10, size=len(s))
+    s['mass'] = numpy.random.random(size=len(s)) - 0.5
+    s['value'] = numpy.arange(len(s))
+
+    local = split(s, comm)
+    res = numpy.empty_like(local)
+    mpsort.sort(local, ['group', 'mass'], out=res, comm=comm)
+
+    r = heal(res, comm)
+    s.sort(order=['group', 'mass'])
+    assert_array_equal(s['group'], r['group'])
+    assert_array_equal(s['mass'], r['mass'])
+
+    # a structured key array
+    key = numpy.empty(len(local), dtype=[('group', 'u4'), ('mass', 'f4')])
+    key['group'] = local['group']
+    key['mass'] = local['mass']
+    mpsort.sort(local, key, out=res, comm=comm)
+
+    r = heal(res, comm)
+    assert_array_equal(s['group'], r['group'])
+    assert_array_equal(s['mass'], r['mass'])
+
+@pytest.mark.parametrize("comm", [MPI.COMM_WORLD,])
+@pytest.mark.mpi
+def test_sort_large(comm):
+    # large enough for the radix sort passes; many duplicates and a vector key.
+    s = numpy.empty(20000, dtype=[
+        ('vkey', ('u8', 2)),
+        ('value', 'i4')])
+
+    numpy.random.seed(1234)
+    s['vkey'][:, 0] = numpy.random.randint(0, 100, size=len(s))
+    s['vkey'][:, 1] = numpy.random.randint(0, 1 << 40, size=len(s)) % 7
+    s['value'] = numpy.arange(len(s))
+
+    local = split(s, comm)
+    res = numpy.empty_like(local)
+
+    mpsort.sort(local, 'vkey', out=res, comm=comm)
+
+    r = heal(res, comm)
+    ind = numpy.lexsort(s['vkey'].T)
+    assert_array_equal(s['vkey'][ind], r['vkey'])
+
+@pytest.mark.parametrize("comm", [MPI.COMM_WORLD,])
+@pytest.mark.mpi
+def test_sort_threads(comm):
+    s = numpy.empty(20000, dtype=[
+        ('key', 'u8'),
+        ('value', 'i4')])
+
+    numpy.random.seed(1234)
+    s['key'] = numpy.random.randint(0, 1000, size=len(s))
+    s['value'] = numpy.arange(len(s))
+
+    local = split(s, comm)
+    res = numpy.empty_like(local)
+
+    mpsort.sort(local, 'key', out=res, comm=comm, tuning=['DISABLE_GATHER_SORT'], nthreads=4)
+
+    r = heal(res, comm)
+    s.sort(order='key')
+    assert_array_equal(s['key'], r['key'])
+
+@pytest.mark.parametrize("comm", [MPI.COMM_WORLD,])
+@pytest.mark.mpi
+def test_sort_nthreads_default(comm):
+    s = numpy.arange(1000)[::-1].copy()
+    local = split(s, comm)
+
+    def nthreads(n):
+        mpsort.sort(local, comm=comm, nthreads=n)
+        return mpsort.last_run_stats()['nthreads']
+
+    default = int(os.environ.get('MPSORT_NTHREADS', 1))
+    available = nthreads(-1)
+    assert nthreads(0) == available
+    assert nthreads(3) == 3
+    # None does not keep the nthreads of an earlier call
+    assert nthreads(None) == (available if default <= 0 else default)
+    assert_array_equal(heal(local, comm), numpy.arange(1000))
+
+    if 'OMP_NUM_THREADS' in os.environ:
+        assert available == int(os.environ['OMP_NUM_THREADS'])
+    if available == 1:
+        pytest.skip("only one thread is available for nthreads=0")
+    assert nthreads(0) > 1
+
+@pytest.mark.parametrize("comm", [MPI.COMM_WORLD,])
+@pytest.mark.parametrize("inplace", [True, False])
+@pytest.mark.parametrize("tuning", [['DISABLE_GATHER_SORT'], [], ['ENABLE_KEY_INDEX_SORT']])
+@pytest.mark.mpi
+def test_sort_max_buffer_bytes(comm, inplace, tuning):
+    s = numpy.empty(5000, dtype=[
+        ('key', 'u8'),
+        ('value', 'i4')])
+
+    numpy.random.seed(1234)
+    s['key'] = numpy.random.randint(0, 100, size=len(s))
+    s['value'] = numpy.arange(len(s))
+
+    local = split(s, comm, 1000 + 200 * comm.rank)
+    s = heal(local, comm)
+    if inplace:
+        res = local
+    else:
+        res = numpy.empty(adjustsize(len(local), comm), dtype=local.dtype)
+
+    mpsort.sort(local, 'key', out=res, comm=comm, tuning=tuning, max_buffer_bytes=1024)
+
+    r = heal(res, comm)
+    s.sort(order='key', kind='stable')
+    assert_array_equal(s['key'], r['key'])
+    assert_array_equal(numpy.sort(s['value']), numpy.sort(r['value']))
+
+    # the plan moves the items in rounds as well, in place or not
+    p = mpsort.plan(res['value'], comm=comm, tuning=tuning, max_buffer_bytes=1024)
+    value = res['value'].copy()
+    if inplace:
+        p.apply(value, out=value)
+    else:
+        value = p.apply(value)
+    assert_array_equal(heal(value, comm), numpy.sort(s['value']))
+    p.apply(value, out=value, inverse=True)
+    assert_array_equal(value, res['value'])
+
+@pytest.mark.parametrize("comm", [MPI.COMM_WORLD,])
+@pytest.mark.parametrize("tuning", [[], ['ENABLE_STABLE'], ['ENABLE_KEY_INDEX_SORT'], ['REQUIRE_GATHER_SORT']])
+@pytest.mark.mpi
+def test_sort_max_buffer_bytes_groups(comm, tuning):
+    # the small ranks are gathered into groups and the large ones are alone;
+    # with a separate out no rank exchanges in place.
+    s = numpy.random.randint(0, 100000, size=3001 * comm.size).astype('i8')
+    local = split(s, comm, 1 if comm.rank < comm.size // 2 else 3000)
+    s = heal(local, comm)
+
+    out = numpy.empty_like(local)
+    mpsort.sort(local, out=out, comm=comm, tuning=tuning, max_buffer_bytes=64)
+    assert_array_equal(heal(out, comm), numpy.sort(s))
+
+    arg = mpsort.argsort(local, comm=comm, tuning=tuning)
+    assert_array_equal(s[heal(arg, comm)], numpy.sort(s))
+
+    p = mpsort.plan(local, comm=comm, tuning=tuning, max_buffer_bytes=64)
+    assert_array_equal(heal(p.apply(local), comm), numpy.sort(s))
+
+@pytest.mark.parametrize("comm", [MPI.COMM_WORLD,])
+@pytest.mark.mpi
+def test_last_run_stats(comm):
+    s = numpy.int64(numpy.random.random(size=1000) * 1000)
+    local = split(s, comm)
+
+    mpsort.sort(local, comm=comm, tuning=['DISABLE_GATHER_SORT', 'REQUIRE_SPARSE_ALLTOALLV'])
+    stats = mpsort.last_run_stats()
+
+    assert stats['niter'] > 0
+    assert stats['sparse']
+    assert stats['ngroups'] == comm.size
+    assert stats['groupsize'] == 1
+    assert stats['peak_memory'] > 0
+    assert 'Exchange' in stats['phases']
+    assert 'bisect%04d' % stats['niter'] in stats['phases']
+    assert comm.allreduce(stats['bytes_sent']) == comm.allreduce(stats['bytes_recv'])
+
+@pytest.mark.parametrize("comm", [MPI.COMM_WORLD,])
+@pytest.mark.mpi
+def test_gather_groups_across_nodes(comm):
+    # ranks with very few items are grouped; with one rank per node, across the nodes
+    s = numpy.int64(numpy.random.random(size=comm.size) * 1000)
+    local = split(s, comm)
+    s = heal(local, comm)
+
+    os.environ['MPSORT_RANKS_PER_NODE'] = '1'
+    try:
+        mpsort.sort(local, comm=comm)
+        stats = mpsort.last_run_stats()
+    finally:
+        os.environ['MPSORT_RANKS_PER_NODE'] = '0'
+        mpsort.sort(local.copy(), comm=comm)
+        del os.environ['MPSORT_RANKS_PER_NODE']
+
+    assert_array_equal(heal(local, comm), numpy.sort(s))
+    if comm.size > 1:
+        assert stats['groupsize'] > 1
+
+@pytest.mark.parametrize("comm", [MPI.COMM_WORLD,])
+@pytest.mark.parametrize("interpolate", [False, True])
+@pytest.mark.mpi
+def test_sort_pipeline_large_items(comm, interpolate):
+    # items larger than a size_t are sent from the merged runs
+    tuning = ['DISABLE_GATHER_SORT', 'ENABLE_PIPELINE']
+    if interpolate:
+        tuning.append('ENABLE_INTERPOLATION_SEARCH')
+    rng = numpy.random.RandomState(comm.rank)
+    local = numpy.zeros(adjustsize(1000, comm), dtype=[('key', 'u8'), ('value', ('u8', 2))])
+    local['key'] = rng.randint(0, 1000, size=len(local))
+    local['value'][:, 0] = local['key'] * 2
+    s = numpy.sort(heal(local, comm)['key'])
+
+    mpsort.sort(local, orderby='key', comm=comm, tuning=tuning)
+    r = heal(local, comm)
+    assert_array_equal(r['key'], s)
+    assert_array_equal(r['value'][:, 0], s * 2)
+
+@pytest.mark.parametrize("comm", [MPI.COMM_WORLD,])
+@pytest.mark.mpi
+def test_splitter_sampling_niter(comm):
+    # random 64-bit keys take 64 rounds of bisection
+    rng = numpy.random.RandomState(comm.rank)
+    local = rng.randint(0, 2 ** 63, size=10000, dtype='u8') * 2
+    s = numpy.sort(heal(local, comm))
+
+    mpsort.sort(local, comm=comm, tuning=['DISABLE_GATHER_SORT', 'ENABLE_SPLITTER_SAMPLING'])
+    assert_array_equal(heal(local, comm), s)
+    assert mpsort.last_run_stats()['niter'] <= 20
+
 TUNINGS = [
     [],
     ['DISABLE_SPARSE_ALLTOALLV'],
     ['REQUIRE_SPARSE_ALLTOALLV'],
     ['REQUIRE_GATHER_SORT'],
     ['DISABLE_GATHER_SORT'],
+    ['DISABLE_GATHER_SORT', 'ENABLE_SPLITTER_SAMPLING'],
+    ['DISABLE_GATHER_SORT', 'ENABLE_INTERPOLATION_SEARCH'],
+    ['ENABLE_KEY_INDEX_SORT'],
+    ['DISABLE_GATHER_SORT', 'ENABLE_KEY_INDEX_SORT'],
+    ['DISABLE_CHECKSUM'],
+    ['ENABLE_FAST_CHECKSUM', 'ENABLE_CHECK_SORTED'],
+    ['REQUIRE_HIERARCHICAL_ALLTOALLV'],
+    ['DISABLE_GATHER_SORT', 'REQUIRE_HIERARCHICAL_ALLTOALLV'],
+    ['ENABLE_KEY_INDEX_SORT', 'REQUIRE_HIERARCHICAL_ALLTOALLV'],
+    ['DISABLE_SHARED_MEMORY_GATHER'],
+    ['REQUIRE_GATHER_SORT', 'DISABLE_SHARED_MEMORY_GATHER'],
+    ['DISABLE_GATHER_SORT', 'ENABLE_PIPELINE'],
+    ['DISABLE_GATHER_SORT', 'ENABLE_PIPELINE', 'ENABLE_INTERPOLATION_SEARCH'],
+    ['DISABLE_GATHER_SORT', 'ENABLE_INCREMENTAL'],
+    ['DISABLE_GATHER_SORT', 'ENABLE_INCREMENTAL', 'ENABLE_PIPELINE'],
+    ['ENABLE_STABLE'],
+    ['DISABLE_GATHER_SORT', 'ENABLE_STABLE'],
 ]
 
 @pytest.mark.parametrize("comm", [MPI.COMM_WORLD,])
@@ -173,6 +434,279 @@ def test_sort_flatiter(comm):
     r = heal(res, comm)
     assert_array_equal(s, r)
 
+@pytest.mark.parametrize("comm", [MPI.COMM_WORLD,])
+@pytest.mark.mpi
+def test_sort_incremental(comm):
+    s = numpy.int64(numpy.random.random(size=10000) * 1000000)
+
+    local = split(s, comm)
+    tuning = ['DISABLE_GATHER_SORT', 'ENABLE_INCREMENTAL']
+    mpsort.sort(local, comm=comm, tuning=tuning)
+
+    # a few items move in every step
+    for step in range(3):
+        i = numpy.random.randint(0, len(local), size=len(local) // 100 + 1) if len(local) else []
+        local[i] += numpy.int64((numpy.random.random(size=len(i)) - 0.5) * 10000)
+        s = heal(local, comm)
+        mpsort.sort(local, comm=comm, tuning=tuning)
+        assert_array_equal(heal(local, comm), numpy.sort(s))
+        assert 'LastSplitters' in mpsort.last_run_stats()['phases']
+
+@pytest.mark.parametrize("comm", [MPI.COMM_WORLD,])
+@pytest.mark.mpi
+def test_isort(comm):
+    s = numpy.int32(numpy.random.random(size=1000) * 1000)
+
+    local = split(s, comm)
+    s = heal(local, comm)
+    local2 = local * 2
+
+    r1 = mpsort.isort(local, comm=comm)
+    r2 = mpsort.isort(local2, comm=comm, tuning=['DISABLE_GATHER_SORT'])
+
+    assert r2.wait() is local2
+    assert r1.test()
+    assert r1.wait() is local
+    assert_array_equal(heal(local, comm), numpy.sort(s))
+    assert_array_equal(heal(local2, comm), numpy.sort(s) * 2)
+    assert 'Exchange' in r2.stats['phases']
+
+@pytest.mark.parametrize("comm", [MPI.COMM_WORLD,])
+@pytest.mark.mpi
+def test_isort_and_sort(comm):
+    # a blocking sort, plan or apply waits for the pending requests on every rank,
+    # whichever thread of a rank gets to the library first
+    import time
+    s = numpy.int32(numpy.random.random(size=1000) * 1000)
+
+    local = split(s, comm)
+    s = heal(local, comm)
+    local2 = local * 2
+    local3 = local * 3
+    local4 = local * 4
+
+    r1 = mpsort.isort(local, comm=comm)
+    if comm.rank % 2 == 1:
+        time.sleep(0.1)
+    mpsort.sort(local2, comm=comm)
+    assert r1.test()
+
+    p = mpsort.plan(local3, comm=comm)
+    r2 = mpsort.isort(local3, comm=comm, tuning=['DISABLE_GATHER_SORT'])
+    if comm.rank % 2 == 0:
+        time.sleep(0.1)
+    value = p.apply(local4)
+    assert r2.test()
+
+    assert r1.wait() is local
+    assert r2.wait() is local3
+    assert_array_equal(heal(local, comm), numpy.sort(s))
+    assert_array_equal(heal(local2, comm), numpy.sort(s) * 2)
+    assert_array_equal(heal(local3, comm), numpy.sort(s) * 3)
+    assert_array_equal(heal(value, comm), numpy.sort(s) * 4)
+    assert 'Exchange' in r2.stats['phases']
+
+@pytest.mark.parametrize("comm", [MPI.COMM_WORLD,])
+@pytest.mark.parametrize("tuning", [[], ['DISABLE_GATHER_SORT']])
+@pytest.mark.mpi
+def test_stable_argsort(comm, tuning):
+    # few distinct keys, such that most items are ties
+    s = numpy.int32(numpy.random.random(size=1000) * 5 - 2)
+    local = split(s, comm)
+    s = heal(local, comm)
+    order = numpy.argsort(s, kind='stable')
+
+    d = numpy.empty(len(local), dtype=[('key', 'i4'), ('i', 'i8')])
+    d['key'] = local
+    d['i'] = mpsort.globalindices(local, comm)
+    mpsort.sort(d, orderby='key', comm=comm, tuning=tuning + ['ENABLE_STABLE'])
+    assert_array_equal(heal(d['i'], comm), order)
+
+    r = mpsort.argsort(local, comm, tuning=tuning)
+    assert len(r) == len(local)
+    assert_array_equal(heal(r, comm), order)
+
+    # on a different partition of the output
+    out = split(numpy.zeros(len(s), dtype='i8'), comm, localsize=len(s) if comm.rank == 0 else 0)
+    mpsort.argsort(local, comm, out=out, tuning=tuning)
+    assert_array_equal(heal(out, comm), order)
+    assert_array_equal(heal(mpsort.take(local, out, comm), comm), numpy.sort(s))
+
+@pytest.mark.parametrize("comm", [MPI.COMM_WORLD,])
+@pytest.mark.mpi
+def test_sort_weights(comm):
+    s = numpy.int32(numpy.random.random(size=1000) * 1000)
+    local = split(s, comm)
+    s = heal(local, comm)
+
+    # the small keys cost 100 times more
+    w = numpy.where(local < 100, 100., 1.)
+    r = mpsort.sort(local, weights=w, comm=comm)
+    assert_array_equal(heal(r, comm), numpy.sort(s))
+
+    cost = comm.allgather(numpy.where(r < 100, 100., 1.).sum())
+    assert max(cost) - min(cost) <= 100 + 1
+
+    d = numpy.empty(len(local), dtype=[('key', 'i4'), ('w', 'f8')])
+    d['key'] = local
+    d['w'] = w
+    r2 = mpsort.sort(d, orderby='key', weights='w', comm=comm)
+    assert_array_equal(r2['key'], r)
+
+    # the columns of a dict, in rounds of bounded memory
+    r3 = mpsort.sort({'key': local, 'w': w}, orderby='key', weights='w', comm=comm,
+            max_buffer_bytes=1024)
+    assert_array_equal(r3['key'], r)
+    assert_array_equal(r3['w'], numpy.where(r < 100, 100., 1.))
+
+    with pytest.raises(ValueError):
+        mpsort.sort(local, weights=-w, comm=comm)
+
+    # every rank raises if the weights of one rank are on another partition
+    with pytest.raises(ValueError):
+        mpsort.sort(local, weights=w if comm.rank > 0 else w[:-1], comm=comm)
+
+@pytest.mark.parametrize("comm", [MPI.COMM_WORLD,])
+@pytest.mark.parametrize("dtype", ['i4', 'f8'])
+@pytest.mark.mpi
+def test_select_topk(comm, dtype):
+    s = numpy.array(numpy.random.random(size=1000) * 100 - 50, dtype=dtype)
+
+    local = split(s, comm)
+    s = heal(local, comm)
+    sorted = numpy.sort(s)
+
+    ranks = [0, len(s) // 2, len(s) - 1, -1]
+    assert_array_equal(mpsort.select(local, ranks, comm=comm), sorted[ranks])
+    assert mpsort.select(local, 3, comm=comm) == sorted[3]
+    # a locally sorted array is used as is
+    assert_array_equal(mpsort.select(numpy.sort(local), ranks, comm=comm), sorted[ranks])
+
+    for k in [0, 7, len(s)]:
+        r = mpsort.topk(local, k, comm=comm)
+        assert_array_equal(heal(r, comm), sorted[len(s) - k:])
+
+    # the ranks of a record array and the records it selects
+    d = numpy.empty(len(local), dtype=[('key', dtype), ('i', 'i8')])
+    d['key'] = local
+    d['i'] = numpy.arange(len(local)) + comm.rank * 10000
+    r = mpsort.topk(d, 7, comm=comm, orderby='key')
+    r = heal(r, comm)
+    assert_array_equal(r['key'], sorted[-7:])
+    assert len(numpy.unique(r['i'])) == 7
+
+@pytest.mark.parametrize("comm", [MPI.COMM_WORLD,])
+@pytest.mark.mpi
+def test_unique_reduceat(comm):
+    s = numpy.int32(numpy.random.random(size=1000) * 20)
+    v = numpy.random.random(size=1000)
+
+    local = split(s, comm)
+    localv = split(v, comm)
+    s = heal(local, comm)
+    v = heal(localv, comm)
+    u, c = numpy.unique(s, return_counts=True)
+
+    key, counts = mpsort.unique(local, comm, return_counts=True)
+    assert_array_equal(heal(key, comm), u)
+    assert_array_equal(heal(counts, comm), c)
+
+    key, total = mpsort.reduceat(local, localv, numpy.add, comm)
+    assert_array_equal(heal(key, comm), u)
+    assert_allclose(heal(total, comm), [v[s == i].sum() for i in u])
+
+    mpsort.sort(local, comm=comm)
+    r = mpsort.regroup(local, None, comm)
+    assert_array_equal(heal(r, comm), numpy.sort(s))
+    first = comm.allgather(r[:1])
+    last = comm.allgather(r[-1:])
+    assert not any((first[i] == last[i - 1]).any() for i in range(1, comm.size))
+
+@pytest.mark.parametrize("comm", [MPI.COMM_WORLD,])
+@pytest.mark.mpi
+def test_sort_external(comm, tmp_path):
+    s = numpy.empty(1000, dtype=[('key', 'i8'), ('value', 'f8')])
+    s['key'] = numpy.random.random(size=1000) * 100
+    s['value'] = numpy.random.random(size=1000)
+
+    local = split(s, comm)
+    s = heal(local, comm)
+
+    source = numpy.memmap(str(tmp_path / 'source'), mode='w+', dtype=s.dtype, shape=len(local))
+    source[...] = local
+    out = numpy.memmap(str(tmp_path / 'out'), mode='w+', dtype=s.dtype,
+            shape=adjustsize(len(local), comm))
+
+    # about 20 items per chunk
+    mpsort.sort_external(source, out, comm, orderby='key', memory=1280, scratch=str(tmp_path))
+
+    r = heal(out, comm)
+    assert_array_equal(r['key'], numpy.sort(s['key']))
+    assert_array_equal(numpy.sort(r), numpy.sort(s))
+
+@pytest.mark.parametrize("comm", [MPI.COMM_WORLD,])
+@pytest.mark.mpi
+def test_sort_external_skewed(comm, tmp_path, monkeypatch):
+    # rank 0 holds the first items of the output of every rank
+    n = 60 * comm.size
+    j = numpy.arange(n * comm.size) % n
+    keys = numpy.arange(n * comm.size)
+    local = numpy.empty(n, dtype=[('key', 'i8'), ('value', 'f8')])
+    local['key'] = keys[j * comm.size // n == comm.rank]
+    local['value'] = local['key'] * 0.5
+
+    source = numpy.memmap(str(tmp_path / 'source'), mode='w+', dtype=local.dtype, shape=n)
+    source[...] = local
+    out = numpy.memmap(str(tmp_path / 'out'), mode='w+', dtype=local.dtype, shape=n)
+
+    sizes = []
+    sort = mpsort.sort
+    def recording_sort(source, *args, **kwargs):
+        if kwargs['comm'] is not MPI.COMM_SELF:
+            sizes.append(len(source))
+        return sort(source, *args, **kwargs)
+    monkeypatch.setattr(mpsort, 'sort', recording_sort)
+
+    # 20 items per chunk
+    mpsort.sort_external(source, out, comm, orderby='key', memory=1280, scratch=str(tmp_path))
+
+    r = heal(out, comm)
+    assert_array_equal(r['key'], keys)
+    assert_array_equal(r['value'], keys * 0.5)
+    assert max(sizes) <= 20
+
+@pytest.mark.parametrize("comm", [MPI.COMM_WORLD,])
+@pytest.mark.mpi
+def test_sort_columns(comm):
+    s = numpy.int32(numpy.random.random(size=1000) * 1000)
+    v = numpy.random.random(size=(1000, 3))
+
+    local = split(s, comm)
+    localv = split(v, comm)
+    s = heal(local, comm)
+    v = heal(localv, comm)
+    arg = numpy.argsort(s, kind='stable')
+
+    # as a list, with out columns on a different partition
+    size = adjustsize(local.size, comm)
+    res = numpy.zeros(size, dtype=local.dtype)
+    resv = numpy.zeros((size, 3))
+    resi = numpy.zeros(size, dtype='i8')
+    mpsort.sort([local, localv, mpsort.globalindices(local, comm)], orderby=local,
+            out=[res.flat, resv, resi], comm=comm)
+
+    i = heal(resi, comm)
+    assert_array_equal(heal(res, comm), s[arg])
+    assert_array_equal(s[i], s[arg])
+    assert_array_equal(heal(resv, comm), v[i])
+
+    # as a dict, in-place, ordered by one of the columns
+    columns = {'key': local.copy(), 'v': localv.copy()}
+    mpsort.sort(columns, orderby='key', comm=comm)
+
+    assert_array_equal(heal(columns['key'], comm), s[arg])
+    assert_array_equal(numpy.sort(heal(columns['v'], comm)[:, 0]), numpy.sort(v[:, 0]))
+
 @pytest.mark.parametrize("comm", [MPI.COMM_WORLD,])
 @pytest.mark.mpi
 def test_sort_struct(comm):
@@ -306,6 +840,66 @@ def test_take_out(comm):
     s = s[i]
     assert_array_equal(r, s)
 
+@pytest.mark.parametrize("comm", [MPI.COMM_WORLD,])
+@pytest.mark.mpi
+def test_take_repeated(comm):
+    s = numpy.arange(10) * 10
+    local = split(s, comm)
+    i = numpy.array([3, 3, 0, 9, 9, 9, 1, 5, 5, 2, 7, 7])
+    ind = split(i, comm)
+
+    res = mpsort.take(local, ind, comm)
+    r = heal(res, comm)
+    assert_array_equal(r, s[i])
+
+@pytest.mark.parametrize("comm", [MPI.COMM_WORLD,])
+@pytest.mark.mpi
+def test_take_columns(comm):
+    s = numpy.random.random(size=(100, 3))
+    local = split(s, comm)
+    s = heal(local, comm)
+    i = numpy.int64(numpy.random.random(size=150) * 100)
+    ind = split(i, comm)
+    i = heal(ind, comm)
+
+    res = mpsort.take(local, ind, comm)
+    assert_array_equal(heal(res, comm), s[i])
+
+    res = numpy.empty((adjustsize(len(ind), comm), 3))
+    mpsort.take(local, ind, comm, out=res)
+    assert_array_equal(heal(res, comm), s[i])
+
+    with pytest.raises(IndexError):
+        mpsort.take(local, ind + 100, comm)
+
+@pytest.mark.parametrize("comm", [MPI.COMM_WORLD,])
+@pytest.mark.mpi
+def test_plan(comm):
+    s = numpy.int64(numpy.random.random(size=1000) * 1000)
+    v = numpy.random.random(size=(1000, 3))
+    local = split(s, comm)
+    localv = split(v, comm)
+    s = heal(local, comm)
+    v = heal(localv, comm)
+
+    outsize = adjustsize(local.size, comm)
+    plan = mpsort.plan(local, outsize=outsize, comm=comm)
+    assert plan.size == local.size
+    assert plan.outsize == outsize
+
+    res = plan.apply(local)
+    resv = numpy.empty((outsize, 3))
+    plan.apply(localv, out=resv)
+
+    index = plan.apply(mpsort.globalindices(local, comm))
+    index = heal(index, comm)
+    s.sort()
+    assert_array_equal(heal(res, comm), s)
+    assert_array_equal(heal(resv, comm), v[index])
+
+    back = plan.apply(resv, inverse=True)
+    assert_array_equal(back, localv)
+
 def test_version():
     import mpsort
     assert hasattr(mpsort, "__version__")
@@ -555,3 +1149,22 @@ def test_issue7(comm12, tuning):
     assert_array_equal(R.flatten(), S.flatten())
     comm.barrier()
 
+@pytest.mark.parametrize("comm", [MPI.COMM_WORLD,])
+@pytest.mark.mpi
+def test_bench(comm):
+    import io
+    import json
+    from mpsort import bench
+
+    stream = io.StringIO()
+    results = bench.main(['--size', '1000', '--repeat', '1',
+            '--operation', 'sort', 'permute', 'take',
+            '--distribution', 'duplicates', 'nearly-sorted',
+            '--record-bytes', '0', '24',
+            '--tuning', 'DISABLE_GATHER_SORT'], comm=comm, stream=stream)
+
+    assert len(results) == 2 * 2 * (2 + 1 + 1)
+    assert 'Exchange' in results[1]['phases']
+    if comm.rank == 0:
+        lines = stream.getvalue().splitlines()
+        assert [json.loads(line) for line in lines] == results
@@ -5,6 +5,11 @@
 #include <time.h>
 #include <string.h>
 
+#ifdef _OPENMP
+#include <omp.h>
+#endif
+
+#include "mpsort.h"
 #include "internal.h"
 
 /*****
@@ -15,6 +20,36 @@
 #include "stdlib/msort.c"
 
 
+/* number of threads of the local sorts, if set by mpsort_set_nthreads. */
+static int _mpsort_nthreads = 1;
+static int _mpsort_nthreads_set = 0;
+
+void mpsort_set_nthreads(int nthreads)
+{
+    _mpsort_nthreads = nthreads;
+    _mpsort_nthreads_set = 1;
+}
+
+void mpsort_unset_nthreads()
+{
+    _mpsort_nthreads_set = 0;
+}
+
+int mpsort_get_nthreads()
+{
+    int nthreads = _mpsort_nthreads;
+    if(!_mpsort_nthreads_set) {
+        const char * env = getenv("MPSORT_NTHREADS");
+        nthreads = env ? atoi(env) : 1;
+    }
+#ifdef _OPENMP
+    if(nthreads <= 0) return omp_get_max_threads();
+    return nthreads;
+#else
+    return 1;
+#endif
+}
+
 /* implementation ; internal */
 static int _compute_and_compar_radix(const void * p1, const void * p2, void * arg) {
     struct crstruct * d = arg;
@@ -26,9 +61,210 @@ static int _compute_and_compar_radix(const void * p1, const void * p2, void * ar
 }
 
 
+/* below this many items the merge sort is faster than the byte-wise passes */
+#define RADIX_SORT_MIN_NMEMB 256
+
+static int _is_big_endian() {
+    /* Cheers stack overflow*/
+    union {
+        uint32_t i;
+        char c[4];
+    } be_detect = {0x01020304};
+    return be_detect.c[0] == 1;
+}
+
+/*
+ * LSD radix sort.
+ *
+ * The radix of every item is extracted exactly once into a side buffer
+ * of records (index, radix). The records are sorted by stable counting
+ * passes over the bytes of the radix, from the least significant byte
+ * to the most significant byte; passes where all items share the same
+ * byte value are skipped. Finally the payload is permuted once.
+ *
+ * The significance of the radix bytes follows the comparison functions:
+ * on a little endian machine byte 0 is the least significant.
+ *
+ * With d->nthreads > 1, each thread extracts, counts and scatters a
+ * contiguous block of the records; the per-thread counts of every pass
+ * give each thread its own offsets into the destination buffer.
+ *
+ * returns 0 on success, -1 if the temporary storage cannot be allocated.
+ * */
+static int _lsd_radix_sort(struct crstruct * d) {
+    const size_t nmemb = d->nmemb;
+    const size_t rsize = d->rsize;
+    const size_t recsize = sizeof(size_t) + ((rsize + 7) & ~((size_t) 7));
+    const int be = _is_big_endian();
+    const int nthreads = d->nthreads;
+
+    char * rec1 = malloc(nmemb * recsize);
+    char * rec2 = malloc(nmemb * recsize);
+    char * tmp = malloc(d->size);
+    /* counts of every byte value for every byte of the radix */
+    size_t * counts = calloc(rsize * 256, sizeof(size_t));
+    /* counts of one byte per thread */
+    size_t * tcounts = calloc(nthreads * 256, sizeof(size_t));
+    /* counts of every byte of the radix per thread, summed into counts */
+    size_t * allcounts = (nthreads > 1) ? calloc(nthreads * rsize * 256, sizeof(size_t)) : NULL;
+    if(!rec1 || !rec2 || !tmp || !counts || !tcounts || (nthreads > 1 && !allcounts)) {
+        free(rec1);
+        free(rec2);
+        free(tmp);
+        free(counts);
+        free(tcounts);
+        free(allcounts);
+        return -1;
+    }
+
+    char * sorted = rec1;
+
+#pragma omp parallel num_threads(nthreads) if(nthreads > 1)
+    {
+        int T = 1;
+        int t = 0;
+#ifdef _OPENMP
+        T = omp_get_num_threads();
+        t = omp_get_thread_num();
+#endif
+        const size_t lo = nmemb * t / T;
+        const size_t hi = nmemb * (t + 1) / T;
+        size_t * mycounts = tcounts + t * 256;
+        size_t * myallcounts = (T == 1) ? counts : allcounts + t * rsize * 256;
+
+        size_t i;
+        size_t b;
+        for(i = lo; i < hi; i ++) {
+            char * r = rec1 + i * recsize;
+            *(size_t *) r = i;
+            d->radix((char*) d->base + i * d->size, r + sizeof(size_t), d->arg);
+            const unsigned char * u = (unsigned char *) r + sizeof(size_t);
+            for(b = 0; b < rsize; b ++) {
+                myallcounts[b * 256 + u[b]] ++;
+            }
+        }
+        if(T > 1) {
+#pragma omp critical
+            for(i = 0; i < rsize * 256; i ++) {
+                counts[i] += myallcounts[i];
+            }
+#pragma omp barrier
+        }
+
+        char * src = rec1;
+        char * dst = rec2;
+        size_t pass;
+        for(pass = 0; pass < rsize; pass ++) {
+            /* from the least significant byte */
+            b = be ? rsize - 1 - pass : pass;
+            const size_t * c = counts + b * 256;
+            int v;
+            int trivial = 0;
+            for(v = 0; v < 256; v ++) {
+                if(c[v] == nmemb) {
+                    trivial = 1;
+                    break;
+                }
+            }
+            if(trivial) continue;
+
+            if(T == 1) {
+                memcpy(mycounts, c, 256 * sizeof(size_t));
+            } else {
+                /* the block of this thread changes after every pass */
+                memset(mycounts, 0, 256 * sizeof(size_t));
+                for(i = lo; i < hi; i ++) {
+                    mycounts[((unsigned char *) src)[i * recsize + sizeof(size_t) + b]] ++;
+                }
+#pragma omp barrier
+            }
+
+            /* offset of thread t for value v is after all items of smaller v,
+             * and after the items of value v from the threads before t. */
+            size_t offset[256];
+            size_t o = 0;
+            for(v = 0; v < 256; v ++) {
+                int t1;
+                for(t1 = 0; t1 < T; t1 ++) {
+                    if(t1 == t) offset[v] = o;
+                    o += tcounts[t1 * 256 + v];
+                }
+            }
+
+            for(i = lo; i < hi; i ++) {
+                const char * r = src + i * recsize;
+                unsigned char key = ((unsigned char *) r)[sizeof(size_t) + b];
+                memcpy(dst + (offset[key] ++) * recsize, r, recsize);
+            }
+            char * t2 = src;
+            src = dst;
+            dst = t2;
+#pragma omp barrier
+        }
+#pragma omp master
+        sorted = src;
+    }
+    free(counts);
+    free(tcounts);
+    free(allcounts);
+
+    /* sorted holds the sorted indices; permute the payload. */
+    char * spare = (sorted == rec1) ? rec2 : rec1;
+    char * payload = NULL;
+    if(recsize >= d->size) {
+        /* the spare record buffer is large enough to gather the payload */
+        payload = spare;
+    } else if(nthreads > 1) {
+        /* gathering is parallel, following the cycles is not */
+        payload = malloc(nmemb * d->size);
+    }
+
+    if(payload) {
+        ptrdiff_t i;
+#pragma omp parallel for num_threads(nthreads) if(nthreads > 1)
+        for(i = 0; i < (ptrdiff_t) nmemb; i ++) {
+            size_t k = *(size_t *) (sorted + i * recsize);
+            memcpy(payload + i * d->size, (char*) d->base + k * d->size, d->size);
+        }
+        memcpy(d->base, payload, nmemb * d->size);
+        if(payload != spare) free(payload);
+    } else {
+        /* follow the cycles of the permutation in place,
+         * Knuth vol. 3 (2nd ed.) exercise 5.2-10. */
+        size_t i;
+        for(i = 0; i < nmemb; i ++) {
+            size_t * pi = (size_t *) (sorted + i * recsize);
+            if(*pi == i) continue;
+            size_t j = i;
+            memcpy(tmp, (char*) d->base + i * d->size, d->size);
+            while(1) {
+                size_t * pj = (size_t *) (sorted + j * recsize);
+                size_t k = *pj;
+                *pj = j;
+                if(k == i) {
+                    memcpy((char*) d->base + j * d->size, tmp, d->size);
+                    break;
+                }
+                memcpy((char*) d->base + j * d->size, (char*) d->base + k * d->size, d->size);
+                j = k;
+            }
+        }
+    }
+    free(tmp);
+    free(rec1);
+    free(rec2);
+    return 0;
+}
+
 /****
  * sort by radix;
- * internally this uses qsort_r of glibc.
+ *
+ * large arrays are sorted with a LSD radix sort on the radix bytes;
+ * small arrays (and the case where the temporary storage for the
+ * radix sort is unavailable) fall back to the merge sort (qsort_r of glibc),
+ * which computes the radix for every comparison.
+ *
+ * Both algorithms are stable.
  *
  **** */
 
@@ -40,10 +276,402 @@ void radix_sort(void * base, size_t nmemb, size_t size,
     struct crstruct d;
     _setup_radix_sort(&d, base, nmemb, size, radix, rsize, arg);
 
+    if(nmemb >= RADIX_SORT_MIN_NMEMB) {
+        if(0 == _lsd_radix_sort(&d)) return;
+    }
+
     mpsort_qsort_r(d.base, d.nmemb, d.size, _compute_and_compar_radix, &d);
 }
 
 
+/*
+ * k-way merge with a loser tree.
+ *
+ * The runs are stored in base, run i starts at item runoffset[i] and has
+ * runnmemb[i] items; each run must be sorted. The merged items are
+ * written to out, which shall not overlap with base; or if out is NULL,
+ * the index of the merged items in base are written to perm.
+ *
+ * The radix of the head of each run is cached, such that the radix of
+ * every item is computed only once. Ties are broken by the run index,
+ * thus the merge is stable with respect to the order of the runs.
+ * */
+struct merge_tree {
+    struct crstruct * d;
+    unsigned char * keys; /* radix of the head of each run */
+    size_t * head; /* index of the head item of each run */
+    const size_t * end;
+    const char * base;
+};
+
+/* returns if run a shall be popped before run b */
+static int _merge_tree_beats(struct merge_tree * t, int a, int b) {
+    if(t->head[a] == t->end[a]) return 0;
+    if(t->head[b] == t->end[b]) return 1;
+    int c = t->d->compar(t->keys + a * t->d->rsize, t->keys + b * t->d->rsize, t->d->rsize);
+    return c < 0 || (c == 0 && a < b);
+}
+
+static void _merge_tree_load(struct merge_tree * t, int i) {
+    if(t->head[i] == t->end[i]) return;
+    t->d->radix(t->base + t->head[i] * t->d->size, t->keys + i * t->d->rsize, t->d->arg);
+}
+
+/* returns 0 on success, -1 if the loser tree cannot be allocated. */
+static int _radix_merge_serial(const void * base,
+        const size_t * runoffset,
+        const size_t * runnmemb,
+        int nrun,
+        void * out,
+        size_t * perm,
+        struct crstruct * d) {
+
+    if(nrun == 0) return 0;
+
+    struct merge_tree t;
+    size_t * end = malloc(sizeof(size_t) * nrun);
+    int * loser = malloc(sizeof(int) * nrun);
+    int * winner = malloc(sizeof(int) * 2 * nrun);
+    size_t nmemb = 0;
+    int i;
+
+    t.d = d;
+    t.base = base;
+    t.keys = malloc(d->rsize * nrun);
+    t.head = malloc(sizeof(size_t) * nrun);
+    t.end = end;
+
+    if(!end || !loser || !winner || !t.keys || !t.head) {
+        free(t.head);
+        free(t.keys);
+        free(winner);
+        free(loser);
+        free(end);
+        return -1;
+    }
+
+    for(i = 0; i < nrun; i ++) {
+        t.head[i] = runoffset[i];
+        end[i] = runoffset[i] + runnmemb[i];
+        nmemb += runnmemb[i];
+        _merge_tree_load(&t, i);
+    }
+
+    /* build the tree bottom up; leaf of run i is node nrun + i. */
+    for(i = 0; i < nrun; i ++) {
+        winner[nrun + i] = i;
+    }
+    for(i = nrun - 1; i >= 1; i --) {
+        int a = winner[2 * i];
+        int b = winner[2 * i + 1];
+        if(_merge_tree_beats(&t, a, b)) {
+            winner[i] = a;
+            loser[i] = b;
+        } else {
+            winner[i] = b;
+            loser[i] = a;
+        }
+    }
+    loser[0] = winner[1];
+
+    char * p = out;
+    size_t k;
+    for(k = 0; k < nmemb; k ++) {
+        int w = loser[0];
+        if(out) {
+            memcpy(p, t.base + t.head[w] * d->size, d->size);
+            p += d->size;
+        } else {
+            perm[k] = t.head[w];
+        }
+        t.head[w] ++;
+        _merge_tree_load(&t, w);
+
+        /* replay the matches from the leaf of w to the root */
+        int node = (w + nrun) >> 1;
+        while(node >= 1) {
+            if(_merge_tree_beats(&t, loser[node], w)) {
+                int tmp = loser[node];
+                loser[node] = w;
+                w = tmp;
+            }
+            node >>= 1;
+        }
+        loser[0] = w;
+    }
+
+    free(t.head);
+    free(t.keys);
+    free(winner);
+    free(loser);
+    free(end);
+    return 0;
+}
+
+/* index of the first item in [offset, offset + nmemb) of the sorted base that is not less than key */
+static size_t _lower_bound(const char * base, size_t offset, size_t nmemb,
+        const void * key, struct crstruct * d) {
+    unsigned char r[d->rsize];
+    size_t left = offset;
+    size_t right = offset + nmemb;
+    while(left < right) {
+        size_t mid = left + ((right - left) >> 1);
+        d->radix(base + mid * d->size, r, d->arg);
+        if(d->compar(r, key, d->rsize) < 0) {
+            left = mid + 1;
+        } else {
+            right = mid;
+        }
+    }
+    return left;
+}
+
+/*
+ * With d->nthreads > 1 the output is split into one part per thread,
+ * using pivots taken from the longest run; every run is cut at the pivots,
+ * and each thread merges the pieces of its part. Items equal to a pivot
+ * all go to the later part, hence the result is identical to a serial merge.
+ * */
+static int _radix_merge_parallel(const void * base,
+        const size_t * runoffset,
+        const size_t * runnmemb,
+        int nrun,
+        void * out,
+        size_t * perm,
+        struct crstruct * d) {
+
+    const int T = d->nthreads;
+    size_t nmemb = 0;
+    int longest = 0;
+    int r;
+    for(r = 0; r < nrun; r ++) {
+        nmemb += runnmemb[r];
+        if(runnmemb[r] > runnmemb[longest]) longest = r;
+    }
+
+    /* cut[j * nrun + r] is where part j starts in run r */
+    size_t * cut = NULL;
+    if(T > 1 && nrun > 1 && nmemb >= RADIX_SORT_MIN_NMEMB * (size_t) T) {
+        cut = malloc(sizeof(size_t) * (T + 1) * nrun);
+    }
+    if(cut == NULL) {
+        return _radix_merge_serial(base, runoffset, runnmemb, nrun, out, perm, d);
+    }
+    int j;
+    int failed = 0;
+
+#pragma omp parallel for num_threads(T)
+    for(j = 0; j <= T; j ++) {
+        int r1;
+        if(j == 0 || j == T) {
+            for(r1 = 0; r1 < nrun; r1 ++) {
+                cut[j * nrun + r1] = runoffset[r1] + (j == T ? runnmemb[r1] : 0);
+            }
+            continue;
+        }
+        unsigned char pivot[d->rsize];
+        d->radix((const char *) base + (runoffset[longest] + runnmemb[longest] * j / T) * d->size,
+                pivot, d->arg);
+        for(r1 = 0; r1 < nrun; r1 ++) {
+            cut[j * nrun + r1] = _lower_bound(base, runoffset[r1], runnmemb[r1], pivot, d);
+        }
+    }
+
+#pragma omp parallel for num_threads(T)
+    for(j = 0; j < T; j ++) {
+        size_t * offset = malloc(sizeof(size_t) * nrun);
+        size_t * n = malloc(sizeof(size_t) * nrun);
+        size_t start = 0;
+        int r1;
+        int err = -1;
+        if(offset && n) {
+            for(r1 = 0; r1 < nrun; r1 ++) {
+                offset[r1] = cut[j * nrun + r1];
+                n[r1] = cut[(j + 1) * nrun + r1] - offset[r1];
+                start += offset[r1] - runoffset[r1];
+            }
+            if(out) {
+                err = _radix_merge_serial(base, offset, n, nrun, (char*) out + start * d->size, NULL, d);
+            } else {
+                err = _radix_merge_serial(base, offset, n, nrun, NULL, perm + start, d);
+            }
+        }
+        if(err) {
+#pragma omp atomic write
+            failed = 1;
+        }
+        free(n);
+        free(offset);
+    }
+    free(cut);
+    return failed ? -1 : 0;
+}
+
+int _radix_merge(const void * base,
+        const size_t * runoffset,
+        const size_t * runnmemb,
+        int nrun,
+        void * out,
+        struct crstruct * d) {
+    return _radix_merge_parallel(base, runoffset, runnmemb, nrun, out, NULL, d);
+}
+
+int _radix_merge_permutation(const void * base,
+        const size_t * runoffset,
+        const size_t * runnmemb,
+        int nrun,
+        size_t * perm,
+        struct crstruct * d) {
+    return _radix_merge_parallel(base, runoffset, runnmemb, nrun, NULL, perm, d);
+}
+
+/*
+ * Moves item perm[i] of base to i, in place, by following the cycles of perm.
+ * perm is destroyed (it becomes the identity).
+ * */
+void _radix_permute(void * base, size_t * perm, size_t nmemb, size_t size) {
+    char * tmp = malloc(size);
+    char * p = base;
+    size_t i;
+    for(i = 0; i < nmemb; i ++) {
+        if(perm[i] == i) continue;
+        memcpy(tmp, p + i * size, size);
+        size_t j = i;
+        while(perm[j] != i) {
+            size_t next = perm[j];
+            memcpy(p + j * size, p + next * size, size);
+            perm[j] = j;
+            j = next;
+        }
+        memcpy(p + j * size, tmp, size);
+        perm[j] = j;
+    }
+    free(tmp);
+}
+
+/* upper bound of key in the sorted items [0, nmemb) of base */
+static size_t _upper_bound(const char * base, size_t nmemb,
+        const void * key, struct crstruct * d) {
+    unsigned char r[d->rsize];
+    size_t left = 0;
+    size_t right = nmemb;
+    while(left < right) {
+        size_t mid = left + ((right - left) >> 1);
+        d->radix(base + mid * d->size, r, d->arg);
+        if(d->compar(r, key, d->rsize) <= 0) {
+            left = mid + 1;
+        } else {
+            right = mid;
+        }
+    }
+    return left;
+}
+
+/*
+ * Sorts a nearly sorted array in place.
+ *
+ * The items out of order are moved aside in one pass, sorted, and merged back
+ * from the end, such that the cost scales with the number of items out of order.
+ * An item smaller than the last kept item is moved aside, unless the last kept
+ * item is the one out of place (the item is not smaller than the item kept before,
+ * and the next item is smaller than the last kept item).
+ *
+ * Returns the number of items moved aside; if more than nmemb / maxfrac
+ * would be moved aside, falls back to radix_sort and returns nmemb.
+ * */
+size_t _radix_sort_nearly_sorted(struct crstruct * d, void * base, size_t nmemb, size_t maxfrac) {
+    char * p = base;
+    const size_t size = d->size;
+    const size_t rsize = d->rsize;
+    size_t cap = nmemb / maxfrac + 1;
+    unsigned char * keys = malloc(rsize * 4);
+    unsigned char * last = keys; /* the last kept */
+    unsigned char * last2 = keys + rsize; /* the kept before last */
+    unsigned char * key = keys + 2 * rsize;
+    unsigned char * next = keys + 3 * rsize;
+    char * aside = NULL;
+    size_t naside = 0;
+    size_t nkept = 0;
+    size_t i;
+
+    if(keys == NULL) {
+        radix_sort(base, nmemb, size, d->radix, rsize, d->arg);
+        return nmemb;
+    }
+
+    for(i = 0; i < nmemb; i ++) {
+        d->radix(p + i * size, key, d->arg);
+        if(nkept == 0 || d->compar(key, last, rsize) >= 0) {
+            if(aside == NULL) {
+                /* nothing moved aside yet; the kept items are in place */
+                nkept ++;
+            } else {
+                memmove(p + nkept * size, p + i * size, size);
+                nkept ++;
+            }
+            memcpy(last2, last, rsize);
+            memcpy(last, key, rsize);
+            continue;
+        }
+        if(aside == NULL) {
+            aside = malloc(size * cap);
+            if(aside == NULL) {
+                /* nothing is aside yet, and the items are in their places */
+                free(keys);
+                radix_sort(base, nmemb, size, d->radix, rsize, d->arg);
+                return nmemb;
+            }
+        }
+        if(naside == cap) {
+            /* too many; put the items aside back in the gap and sort all. */
+            memcpy(p + nkept * size, aside, naside * size);
+            free(aside);
+            free(keys);
+            radix_sort(base, nmemb, size, d->radix, rsize, d->arg);
+            return nmemb;
+        }
+        int lastout = 0;
+        if(nkept >= 2 && d->compar(key, last2, rsize) >= 0 && i + 1 < nmemb) {
+            d->radix(p + (i + 1) * size, next, d->arg);
+            lastout = d->compar(next, last, rsize) < 0;
+        }
+        if(lastout) {
+            /* replace the last kept item with this one */
+            memcpy(aside + naside * size, p + (nkept - 1) * size, size);
+            memmove(p + (nkept - 1) * size, p + i * size, size);
+            memcpy(last, key, rsize);
+        } else {
+            memcpy(aside + naside * size, p + i * size, size);
+        }
+        naside ++;
+    }
+
+    free(keys);
+    if(naside == 0) {
+        free(aside);
+        return 0;
+    }
+
+    radix_sort(aside, naside, size, d->radix, rsize, d->arg);
+
+    /* merge from the end: each item aside goes after the kept items greater than it */
+    unsigned char r[rsize];
+    size_t dst = nmemb;
+    size_t j;
+    for(j = naside; j > 0; j --) {
+        d->radix(aside + (j - 1) * size, r, d->arg);
+        size_t pos = _upper_bound(p, nkept, r, d);
+        size_t nmove = nkept - pos;
+        memmove(p + (dst - nmove) * size, p + pos * size, nmove * size);
+        dst -= nmove;
+        nkept = pos;
+        dst --;
+        memcpy(p + dst * size, aside + (j - 1) * size, size);
+    }
+    free(aside);
+    return naside;
+}
+
 #define DEFTYPE(type) \
 static int _compar_radix_ ## type ( \
         const type * u1,  \
@@ -57,6 +685,17 @@ static void _bisect_radix_ ## type ( \
         const type * u2,  \
         size_t junk) { \
     *u = *u1 + ((*u2 - *u1) >> 1); \
+} \
+static void _interp_radix_ ## type ( \
+        type * u, \
+        const type * u1,  \
+        const type * u2,  \
+        double frac, \
+        size_t junk) { \
+    type width = *u2 - *u1; \
+    double step = width * frac; \
+    /* width may round up in double */ \
+    *u = *u1 + (step >= (double) width ? width : (type) step); \
 }
 DEFTYPE(uint16_t)
 DEFTYPE(uint32_t)
@@ -151,32 +790,32 @@ void _setup_radix_sort(
         void (*radix)(const void * ptr, void * radix, void * arg),
         size_t rsize,
         void * arg) {
-    /* Cheers stack overflow*/
-    union {
-        uint32_t i;
-        char c[4];
-    } be_detect = {0x01020304};
     d->base = base;
     d->nmemb = nmemb;
     d->rsize = rsize;
     d->arg = arg;
     d->radix = radix;
     d->size = size;
+    d->nthreads = mpsort_get_nthreads();
     switch(rsize) {
         case 2:
             d->compar = (_compar_fn_t) _compar_radix_uint16_t;
             d->bisect = (_bisect_fn_t) _bisect_radix_uint16_t;
+            d->interp = (_interp_fn_t) _interp_radix_uint16_t;
             break;
         case 4:
             d->compar = (_compar_fn_t) _compar_radix_uint32_t;
             d->bisect = (_bisect_fn_t) _bisect_radix_uint32_t;
+            d->interp = (_interp_fn_t) _interp_radix_uint32_t;
             break;
         case 8:
             d->compar = (_compar_fn_t) _compar_radix_uint64_t;
             d->bisect = (_bisect_fn_t) _bisect_radix_uint64_t;
+            d->interp = (_interp_fn_t) _interp_radix_uint64_t;
             break;
         default:
-            if(be_detect.c[0] != 1) {
+            d->interp = NULL;
+            if(!_is_big_endian()) {
                 if(rsize % 8 == 0) {
                     d->compar = _compar_radix_le_u8;
                 } else{
@@ -193,4 +832,3 @@ void _setup_radix_sort(
             }
     }
 }
-
@@ -31,6 +31,13 @@ class build_ext_subclass(build_ext):
         self.compiler.linker_so[0] = self.mpicc
         build_ext.build_extensions(self)
 
+# OpenMP threads the local sort, histogram and merge in the MPI path;
+# set MPSORT_DISABLE_OPENMP to build a serial extension.
+if os.environ.get('MPSORT_DISABLE_OPENMP'):
+    openmp_flags = []
+else:
+    openmp_flags = ['-fopenmp']
+
 extensions = [
         Extension("mpsort.binding", [
                 "mpsort/binding.pyx",
@@ -38,6 +45,8 @@ extensions = [
                 "mp-mpiu.c",
                 "mpsort-mpi.c"],
             include_dirs = ["./", numpy.get_include()],
+            extra_compile_args = openmp_flags,
+            extra_link_args = openmp_flags,
             depends=[
                 "mpsort.h",
                 "mpsort-mpi.h",